@@ -0,0 +1,354 @@
+"""
+Load benchmark of the Flask app against the offline function app stand-in
+
+    python bench.py --kingdoms 100 1000 10000 --actions 2000 --ticks 3
+
+For each size, starts funcapp/local_server.py on a free port with an in-memory
+store and a child process with the Flask app pointed at it. The child seeds the
+galaxies and kingdoms through /api/createstate, /api/createkingdom and
+/api/createkingdomchoices, replays a random mix of player actions, and runs
+refresh ticks. Reports p50/p95/p99 latency per endpoint and the tick durations,
+and exits non-zero when any endpoint answered with an error status.
+"""
+import argparse
+import collections
+import contextlib
+import datetime
+import json
+import math
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+STANDIN_PATH = os.path.join(BENCH_DIR, "..", "funcapp", "local_server.py")
+
+GALAXY_SIZE = 10
+ACTION_WEIGHTS = {
+    "recruits": 3,
+    "structures": 3,
+    "settle": 2,
+    "attack": 2,
+    "spy": 2,
+    "autofill": 1,
+    "scores": 2,
+    "kingdom": 5,
+}
+# Unbuilt stars given to every benchmark kingdom, as the creator must use them all,
+# so the structures action has room to build
+SPARE_STARS = 100
+
+
+def _percentile(sorted_samples, percent):
+    # Nearest-rank percentile
+    rank = max(math.ceil(percent / 100 * len(sorted_samples)), 1)
+    return sorted_samples[rank - 1]
+
+
+def _summarize(samples):
+    summary = {}
+    for label, label_samples in sorted(samples.items()):
+        latencies = sorted(seconds for seconds, _ in label_samples)
+        statuses = collections.Counter(str(status) for _, status in label_samples)
+        summary[label] = {
+            "count": len(latencies),
+            "p50": _percentile(latencies, 50),
+            "p95": _percentile(latencies, 95),
+            "p99": _percentile(latencies, 99),
+            "statuses": dict(statuses),
+            "error_rate": sum(1 for _, status in label_samples if status >= 400) / len(label_samples),
+        }
+    return summary
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _wait_for_port(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Stand-in did not start on port {port}")
+
+
+class BenchClient:
+    def __init__(self, client):
+        self.client = client
+        self.samples = collections.defaultdict(list)
+
+    def request(self, label, method, path, token, payload=None):
+        headers = {"Authorization": f"Bearer {token}"}
+        start = time.perf_counter()
+        response = self.client.open(path, method=method, headers=headers, json=payload)
+        self.samples[label].append((time.perf_counter() - start, response.status_code))
+        return response
+
+
+def _action_request(action, kd_id, target_kd):
+    if action == "recruits":
+        return "POST", "/api/recruits", {"recruitsInput": 10}
+    if action == "structures":
+        return "POST", "/api/structures", {"homes": 1}
+    if action == "settle":
+        return "POST", "/api/settle", {"settleInput": 1}
+    if action == "attack":
+        return "POST", f"/api/attack/{target_kd}", {"attackerValues": {"attack": 10, "generals": 1}}
+    if action == "spy":
+        return "POST", f"/api/spy/{target_kd}", {"drones": 100, "shielded": False, "operation": "spykingdom"}
+    if action == "autofill":
+        return "POST", f"/api/autofill/{target_kd}", {
+            "defenderValues": {"defense": "1000", "military_bonus": "0", "shields": "0"},
+            "buffer": 0.1,
+            "generals": 1,
+        }
+    if action == "scores":
+        return "GET", "/api/scores", None
+    return "GET", "/api/kingdom", None
+
+
+def init_standin():
+    """Create the initial documents; call before importing untitledapp, which reads the accounts"""
+    import requests
+
+    requests.post(
+        os.environ["AZURE_FUNCTION_ENDPOINT"] + "/init",
+        headers={"x-functions-key": os.environ["AZURE_FUNCTIONS_HOST_KEY"]},
+    )
+
+
+def seed_round(bench, num_kingdoms, game_start, game_end, election_start, spare_stars=0):
+    """
+    Create the galaxies and num_kingdoms created kingdoms through the API routes
+
+    Each kingdom then gets spare_stars unbuilt stars written straight to the stand-in.
+    Returns the kingdom ids mapped to a token of their user. Must run in a process
+    whose environment points at a stand-in set up by init_standin.
+    """
+    import untitledapp
+    import untitledapp.bots as uabot
+    import untitledapp.shared as uas
+    from untitledapp import app, db, guard, limiter, User, REQUESTS_SESSION
+
+    untitledapp.ACCOUNTS_READY.wait()
+    limiter.enabled = False
+
+    with app.app_context():
+        admin_token = guard.encode_jwt_token(User.lookup("admin"))
+        password = guard.hash_password("bench")
+        db.session.add_all([
+            User(username=f"bench{i}", password=password, roles="verified")
+            for i in range(num_kingdoms)
+        ])
+        db.session.commit()
+        user_tokens = [
+            guard.encode_jwt_token(User.lookup(f"bench{i}"))
+            for i in range(num_kingdoms)
+        ]
+
+    epoch = datetime.timedelta(seconds=uas.GAME_CONFIG["BASE_EPOCH_SECONDS"])
+    bench.request("createstate", "POST", "/api/createstate", admin_token, {
+        "num_galaxies": math.ceil(num_kingdoms / GALAXY_SIZE),
+        "max_galaxy_size": GALAXY_SIZE,
+        "avg_size_new_galaxy": GALAXY_SIZE,
+    })
+    bench.request("updatestate", "POST", "/api/updatestate", admin_token, {
+        "game_start": game_start.isoformat(),
+        "game_end": game_end.isoformat(),
+        "election_start": election_start.isoformat(),
+        "election_end": "",
+        "next_history": (game_start + epoch).isoformat(),
+    })
+    unit_choices, structures_choices = uabot._get_bot_choices()
+    choices = {"unitsChoices": unit_choices, "structuresChoices": structures_choices, "race": uas.RACES[0]}
+    for i, token in enumerate(user_tokens):
+        bench.request("createkingdom", "POST", "/api/createkingdom", token, {"kdName": f"Bench {i}"})
+        bench.request("createkingdomchoices", "POST", "/api/createkingdomchoices", token, choices)
+
+    with app.app_context():
+        kd_tokens = {
+            User.lookup(f"bench{i}").kd_id: token
+            for i, token in enumerate(user_tokens)
+        }
+    if spare_stars:
+        for kd_id in kd_tokens:
+            REQUESTS_SESSION.patch(
+                os.environ["AZURE_FUNCTION_ENDPOINT"] + f"/kingdom/{kd_id}",
+                headers={"x-functions-key": os.environ["AZURE_FUNCTIONS_HOST_KEY"]},
+                data=json.dumps({"stars": uas.INITIAL_KINGDOM_STATE["kingdom"]["stars"] + spare_stars}),
+            )
+    return kd_tokens
+
+
+def run_size(num_kingdoms, num_actions, num_ticks, seed):
+    """Benchmark one size in this process; the environment must point at a fresh stand-in"""
+    init_standin()
+    from untitledapp import app
+    import untitledapp.refresh as uar
+    import untitledapp.shared as uas
+
+    rng = random.Random(seed)
+    bench = BenchClient(app.test_client())
+
+    time_now = datetime.datetime.now(datetime.timezone.utc)
+    seed_start = time.perf_counter()
+    kd_tokens = seed_round(
+        bench,
+        num_kingdoms,
+        game_start=time_now - datetime.timedelta(hours=1),
+        game_end=time_now + datetime.timedelta(days=30),
+        election_start=time_now + datetime.timedelta(days=30),
+        spare_stars=SPARE_STARS,
+    )
+    seed_seconds = time.perf_counter() - seed_start
+    kd_ids = list(kd_tokens)
+
+    # Each attack sends one general, which does not return within the run
+    generals_available = collections.Counter({
+        kd_id: uas.INITIAL_KINGDOM_STATE["kingdom"]["generals_available"]
+        for kd_id in kd_ids
+    })
+    actions, weights = zip(*ACTION_WEIGHTS.items())
+    actions_start = time.perf_counter()
+    for _ in range(num_actions):
+        kd_id, target_kd = rng.sample(kd_ids, 2) if len(kd_ids) > 1 else (kd_ids[0], kd_ids[0])
+        action = rng.choices(actions, weights)[0]
+        if action == "attack" and not generals_available[kd_id]:
+            attackers = [attacker for attacker in kd_ids if generals_available[attacker] and attacker != target_kd]
+            if not attackers:
+                action = "kingdom"
+            else:
+                kd_id = rng.choice(attackers)
+        if action == "attack":
+            generals_available[kd_id] -= 1
+        method, path, payload = _action_request(action, kd_id, target_kd)
+        bench.request(action, method, path, kd_tokens[kd_id], payload)
+    actions_seconds = time.perf_counter() - actions_start
+
+    tick_seconds = []
+    for _ in range(num_ticks):
+        tick_start = time.perf_counter()
+        with app.app_context():
+            uar._run_refresh()
+        tick_seconds.append(time.perf_counter() - tick_start)
+
+    return {
+        "kingdoms": num_kingdoms,
+        "seed_seconds": seed_seconds,
+        "actions": num_actions,
+        "actions_per_second": num_actions / actions_seconds if actions_seconds else None,
+        "ticks": tick_seconds,
+        "tick_traces": [
+            {key: value for key, value in trace.items() if key not in ("kingdoms", "slowest_kingdoms")}
+            for trace in uar.TRACER.get_traces()
+        ],
+        "endpoints": _summarize(bench.samples),
+    }
+
+
+@contextlib.contextmanager
+def standin_environment():
+    """Start a stand-in with an in-memory store and yield the environment of an app process using it"""
+    port = _free_port()
+    host_key = "bench"
+    standin = subprocess.Popen(
+        [sys.executable, STANDIN_PATH, "--port", str(port), "--store", "memory", "--key", host_key],
+        cwd=os.path.dirname(STANDIN_PATH),
+        stdout=subprocess.DEVNULL,
+    )
+    try:
+        _wait_for_port(port)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            yield {
+                **os.environ,
+                "AZURE_FUNCTION_ENDPOINT": f"http://127.0.0.1:{port}/api",
+                "AZURE_FUNCTIONS_HOST_KEY": host_key,
+                "SQLALCHEMY_DATABASE_URI": f"sqlite:///{os.path.join(tmpdir, 'bench.db')}",
+                "ACCOUNTS_LOCK_FILE": os.path.join(tmpdir, "accounts.lock"),
+                "REFRESH_TRACE_FILE": os.path.join(tmpdir, "ticks.jsonl"),
+                "SECRET_KEY": os.environ.get("SECRET_KEY", "bench"),
+                "ADMIN_PASSWORD": os.environ.get("ADMIN_PASSWORD", "bench"),
+                "REFRESH_SECRET": os.environ.get("REFRESH_SECRET", "bench"),
+            }
+    finally:
+        standin.terminate()
+        standin.wait()
+
+
+def run_child(script, child_args):
+    """Run `script --child ...` against a fresh stand-in and return the JSON it prints last"""
+    with standin_environment() as env:
+        child = subprocess.run(
+            [sys.executable, os.path.abspath(script), *child_args],
+            cwd=BENCH_DIR,
+            env=env,
+            stdout=subprocess.PIPE,
+            text=True,
+            check=True,
+        )
+    return json.loads(child.stdout.strip().splitlines()[-1])
+
+
+def _print_result(result):
+    print(f"\n== {result['kingdoms']} kingdoms ==")
+    print(f"seeded in {result['seed_seconds']:.1f}s, {result['actions_per_second'] or 0:.1f} actions/s")
+    print("ticks: " + ", ".join(f"{seconds:.2f}s" for seconds in result["ticks"]))
+    print(f"{'endpoint':<24}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}  statuses")
+    for label, summary in result["endpoints"].items():
+        print(
+            f"{label:<24}{summary['count']:>8}"
+            f"{summary['p50'] * 1000:>10.1f}{summary['p95'] * 1000:>10.1f}{summary['p99'] * 1000:>10.1f}"
+            f"  {summary['statuses']}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the API against the offline function app stand-in")
+    parser.add_argument("--kingdoms", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--actions", type=int, default=2000, help="Player actions replayed per size")
+    parser.add_argument("--ticks", type=int, default=3, help="Refresh ticks run per size")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Also write the results as JSON to this path")
+    parser.add_argument("--child", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        result = run_size(args.child, args.actions, args.ticks, args.seed)
+        print(json.dumps(result, default=str))
+        return
+
+    results = []
+    failures = []
+    for num_kingdoms in args.kingdoms:
+        result = run_child(__file__, [
+            "--child", str(num_kingdoms),
+            "--actions", str(args.actions),
+            "--ticks", str(args.ticks),
+            "--seed", str(args.seed),
+        ])
+        _print_result(result)
+        results.append(result)
+        failures += [
+            f"{label} failed {summary['error_rate']:.1%} of requests at {num_kingdoms} kingdoms"
+            for label, summary in result["endpoints"].items()
+            if summary["error_rate"]
+        ]
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(results, output_file, indent=2, default=str)
+    if failures:
+        sys.exit("\n".join(failures))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+"""
+Deterministic replay of an action journal against a snapshot
+
+    python replay.py --snapshot snapshot.utsnap --journal actions.jsonl
+
+Restores the snapshot (see /api/admin/snapshots) into a fresh offline function app
+stand-in, then re-executes the entries of the journal written with
+ACTION_JOURNAL_FILE after the snapshot was taken (the journal size it recorded,
+or --offset), in order and back to back: the game clock is pinned at the
+entry's clock and the game randomness is seeded with its seed, so each action
+rolls the same outcomes it did when recorded. Player calls go through the Flask
+test client as the recorded user, refresh ticks run in-process.
+
+Reports the actions per second and latency per route, the recorded against the
+replayed durations, the entries whose status differs from the recorded one, and a
+digest of the game items after the replay; two replays of the same journal give
+the same digest. The accounts document is left out of the digest, as it holds
+password hashes and update times. Notifs are flushed after every action, where the
+app batches them on a wall-clock window, so notif counts may differ from the
+recorded run.
+"""
+import argparse
+import collections
+import datetime
+import hashlib
+import json
+import os
+import random
+import time
+
+import bench
+
+MAX_MISMATCHES = 20
+
+
+def _items_digest(items):
+    digest = hashlib.sha256()
+    for item in sorted(items, key=lambda item: item["id"]):
+        if item.get("type") == "lease" or item["id"] == "accounts":
+            continue
+        digest.update(json.dumps(item, sort_keys=True).encode())
+    return digest.hexdigest()
+
+
+def run_replay(snapshot_path, journal_path, offset, limit):
+    """Replay in this process; the environment must point at a fresh stand-in"""
+    # The replayed actions must not be journaled again, and notifs are flushed after
+    # each action rather than on a wall-clock window
+    os.environ.pop("ACTION_JOURNAL_FILE", None)
+    os.environ["NOTIFS_FLUSH_SECONDS"] = str(24 * 3600)
+    bench.init_standin()
+    from untitledapp import app, guard, User, ACCOUNTS_READY, CLOCK, NOTIFS, _export_items, _restore_snapshot
+    from untitledapp.journal import read_journal
+    from untitledapp.snapshot import SnapshotReader
+    import untitledapp.refresh as uar
+    import untitledapp.shared as uas
+
+    if offset is None:
+        with open(snapshot_path, "rb") as snapshot_file:
+            offset = SnapshotReader(snapshot_file).index["metadata"].get("journal_bytes", 0)
+
+    ACCOUNTS_READY.wait()
+    restore_start = time.perf_counter()
+    with app.app_context():
+        restored = _restore_snapshot(snapshot_path, prune=True)
+    restore_seconds = time.perf_counter() - restore_start
+
+    client = bench.BenchClient(app.test_client())
+    tokens = {}
+    mismatches = []
+    recorded_seconds = collections.defaultdict(float)
+    replayed_seconds = collections.defaultdict(float)
+    count = 0
+    replay_start = time.perf_counter()
+    for entry in read_journal(journal_path, offset):
+        if limit is not None and count >= limit:
+            break
+        CLOCK.set_time(datetime.datetime.fromisoformat(entry["clock"]))
+        rng_token = uas.RNG.set(random.Random(entry["seed"]))
+        try:
+            if entry["kind"] == "tick":
+                label = "tick"
+                start = time.perf_counter()
+                with app.app_context():
+                    _, status = uar._timed_refresh_tick(CLOCK.now(), entry["catch_up"])
+                client.samples[label].append((time.perf_counter() - start, status))
+            else:
+                label = f"{entry['method']} {entry['route']}"
+                user_id = entry["user_id"]
+                if user_id is not None and user_id not in tokens:
+                    with app.app_context():
+                        tokens[user_id] = guard.encode_jwt_token(User.load(user_id))
+                status = client.request(label, entry["method"], entry["path"], tokens.get(user_id), entry["body"]).status_code
+        finally:
+            uas.RNG.reset(rng_token)
+        with app.app_context():
+            NOTIFS.flush()
+        recorded_seconds[label] += entry["seconds"]
+        replayed_seconds[label] += client.samples[label][-1][0]
+        if status != entry["status"] and len(mismatches) < MAX_MISMATCHES:
+            mismatches.append({"entry": count, "action": label, "recorded": entry["status"], "replayed": status})
+        count += 1
+    replay_seconds = time.perf_counter() - replay_start
+
+    with app.app_context():
+        digest = _items_digest(_export_items())
+    return {
+        "snapshot": os.path.basename(snapshot_path),
+        "restored": restored,
+        "restore_seconds": restore_seconds,
+        "offset": offset,
+        "actions": count,
+        "replay_seconds": replay_seconds,
+        "actions_per_second": count / replay_seconds if replay_seconds else None,
+        "recorded_seconds": sum(recorded_seconds.values()),
+        "replayed_seconds": sum(replayed_seconds.values()),
+        "by_action": {
+            label: {"recorded_seconds": recorded_seconds[label], "replayed_seconds": replayed_seconds[label]}
+            for label in recorded_seconds
+        },
+        "mismatches": mismatches,
+        "digest": digest,
+        "endpoints": bench._summarize(client.samples),
+    }
+
+
+def _print_result(result):
+    print(
+        f"restored {result['restored']['imported']} items from {result['snapshot']} in {result['restore_seconds']:.1f}s, "
+        f"replayed {result['actions']} actions in {result['replay_seconds']:.1f}s "
+        f"({result['actions_per_second'] or 0:.1f} actions/s)"
+    )
+    print(f"recorded {result['recorded_seconds']:.2f}s, replayed {result['replayed_seconds']:.2f}s of action time")
+    print(f"{'action':<40}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}  statuses")
+    for label, summary in result["endpoints"].items():
+        print(
+            f"{label:<40}{summary['count']:>8}"
+            f"{summary['p50'] * 1000:>10.1f}{summary['p95'] * 1000:>10.1f}{summary['p99'] * 1000:>10.1f}"
+            f"  {summary['statuses']}"
+        )
+    for mismatch in result["mismatches"]:
+        print(f"entry {mismatch['entry']} {mismatch['action']}: recorded {mismatch['recorded']}, replayed {mismatch['replayed']}")
+    print(f"digest {result['digest']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay an action journal against a snapshot on the offline function app stand-in")
+    parser.add_argument("--snapshot", required=True, help="Snapshot archive taken before the first journaled action")
+    parser.add_argument("--journal", required=True, help="Journal written with ACTION_JOURNAL_FILE")
+    parser.add_argument("--offset", type=int, help="Journal byte offset to start from; defaults to the one the snapshot recorded")
+    parser.add_argument("--limit", type=int, help="Replay only the first LIMIT entries")
+    parser.add_argument("--output", help="Also write the results as JSON to this path")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        result = run_replay(args.snapshot, args.journal, args.offset, args.limit)
+        print(json.dumps(result, default=str))
+        return
+
+    child_args = ["--child", "--snapshot", os.path.abspath(args.snapshot), "--journal", os.path.abspath(args.journal)]
+    if args.offset is not None:
+        child_args += ["--offset", str(args.offset)]
+    if args.limit is not None:
+        child_args += ["--limit", str(args.limit)]
+    result = bench.run_child(__file__, child_args)
+    _print_result(result)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(result, output_file, indent=2, default=str)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+"""
+Headless accelerated-time round simulation with scripted bots
+
+    python simulate.py --bots 20 --days 7 --speed 1000
+
+Runs a full round in-process against the offline function app stand-in. The game
+clock (untitledapp.CLOCK) is pinned at the round start and advanced by
+--tick-seconds per step. Each step lets the bots due to act call the player
+routes, then runs a refresh tick. Steps are paced to --speed times wall-clock
+when they finish early. Reports the tick and endpoint timings per game day, and
+the growth of the per-kingdom documents (queues, history, news, revealed), so
+that slowdowns appearing late in a round show up.
+"""
+import argparse
+import collections
+import datetime
+import json
+import os
+import random
+import time
+
+import bench
+
+BOT_STRATEGIES = ["builder", "attacker", "spy"]
+# Per-kingdom backend documents whose size is sampled over the round
+GROWTH_DOCUMENTS = [
+    "news",
+    "history",
+    "attackhistory",
+    "spyhistory",
+    "revealed",
+    "shared",
+    "settles",
+    "mobis",
+    "structures",
+    "missiles",
+    "engineers",
+]
+
+
+def _bot_requests(strategy, rng, target_kd):
+    if strategy == "builder":
+        return [
+            ("settle", "POST", "/api/settle", {"settleInput": 5}),
+            ("structures", "POST", "/api/structures", {"homes": 1, "hangars": 1, "mines": 1, "fuel_plants": 1}),
+            ("recruits", "POST", "/api/recruits", {"recruitsInput": 10}),
+        ]
+    if strategy == "attacker":
+        return [
+            ("recruits", "POST", "/api/recruits", {"recruitsInput": 20}),
+            ("attack", "POST", f"/api/attack/{target_kd}", {"attackerValues": {"attack": 50, "generals": 1}}),
+        ]
+    return [
+        ("spy", "POST", f"/api/spy/{target_kd}", {
+            "drones": 100,
+            "shielded": False,
+            "operation": rng.choice(["spykingdom", "spymilitary", "spyshields"]),
+        }),
+        ("robprimitives", "POST", "/api/robprimitives", {"drones": 100, "shielded": False}),
+    ]
+
+
+def _document_sizes(kd_ids):
+    from untitledapp import REQUESTS_SESSION
+
+    sizes = collections.defaultdict(list)
+    for kd_id in kd_ids:
+        for document in GROWTH_DOCUMENTS:
+            response = REQUESTS_SESSION.get(
+                os.environ['AZURE_FUNCTION_ENDPOINT'] + f'/kingdom/{kd_id}/{document}',
+                headers={'x-functions-key': os.environ['AZURE_FUNCTIONS_HOST_KEY']},
+            )
+            sizes[document].append(len(response.content))
+    return {
+        document: {"mean_bytes": sum(values) / len(values), "max_bytes": max(values)}
+        for document, values in sizes.items()
+    }
+
+
+def _summarize_ticks(tick_seconds):
+    latencies = sorted(tick_seconds)
+    return {
+        "count": len(latencies),
+        "p50": bench._percentile(latencies, 50),
+        "p95": bench._percentile(latencies, 95),
+        "max": latencies[-1],
+    }
+
+
+def run_round(num_bots, days, speed, tick_seconds, bot_interval, seed):
+    """Simulate one round in this process; the environment must point at a fresh stand-in"""
+    bench.init_standin()
+    from untitledapp import app, CLOCK
+    import untitledapp.refresh as uar
+
+    rng = random.Random(seed)
+    random.seed(seed)
+    client = bench.BenchClient(app.test_client())
+
+    round_start = datetime.datetime.now(datetime.timezone.utc).replace(microsecond=0)
+    round_end = round_start + datetime.timedelta(days=days)
+    CLOCK.set_time(round_start)
+    kd_tokens = bench.seed_round(
+        client,
+        num_bots,
+        game_start=round_start,
+        game_end=round_end,
+        election_start=round_start + datetime.timedelta(days=1),
+    )
+    kd_ids = list(kd_tokens)
+    strategies = {kd_id: BOT_STRATEGIES[i % len(BOT_STRATEGIES)] for i, kd_id in enumerate(kd_ids)}
+    # Stagger the bots so they do not all act on the same step
+    next_actions = {
+        kd_id: round_start + datetime.timedelta(seconds=rng.uniform(0, bot_interval))
+        for kd_id in kd_ids
+    }
+    for kd_id, strategy in strategies.items():
+        if strategy == "builder":
+            client.request("spending", "POST", "/api/spending", kd_tokens[kd_id], {"enabled": True})
+
+    days_profile = []
+    day_ticks = []
+    day_samples_start = {label: len(samples) for label, samples in client.samples.items()}
+    next_day = round_start + datetime.timedelta(days=1)
+    simulation_start = time.perf_counter()
+    behind_steps = 0
+    game_time = round_start
+    while game_time < round_end:
+        step_start = time.perf_counter()
+        game_time = CLOCK.advance(tick_seconds)
+
+        for kd_id in kd_ids:
+            if next_actions[kd_id] > game_time:
+                continue
+            target_kd = rng.choice([other_kd for other_kd in kd_ids if other_kd != kd_id] or [kd_id])
+            for label, method, path, payload in _bot_requests(strategies[kd_id], rng, target_kd):
+                client.request(label, method, path, kd_tokens[kd_id], payload)
+            next_actions[kd_id] = game_time + datetime.timedelta(seconds=bot_interval)
+
+        tick_start = time.perf_counter()
+        with app.app_context():
+            uar._run_refresh()
+        day_ticks.append(time.perf_counter() - tick_start)
+
+        if game_time >= next_day or game_time >= round_end:
+            day_samples = {
+                label: samples[day_samples_start.get(label, 0):]
+                for label, samples in client.samples.items()
+                if len(samples) > day_samples_start.get(label, 0)
+            }
+            with app.app_context():
+                document_sizes = _document_sizes(kd_ids)
+            days_profile.append({
+                "day": len(days_profile) + 1,
+                "game_time": game_time.isoformat(),
+                "wall_seconds": time.perf_counter() - simulation_start,
+                "ticks": _summarize_ticks(day_ticks),
+                "endpoints": bench._summarize(day_samples),
+                "documents": document_sizes,
+            })
+            day_ticks = []
+            day_samples_start = {label: len(samples) for label, samples in client.samples.items()}
+            next_day += datetime.timedelta(days=1)
+
+        step_budget = tick_seconds / speed
+        step_seconds = time.perf_counter() - step_start
+        if step_seconds < step_budget:
+            time.sleep(step_budget - step_seconds)
+        else:
+            behind_steps += 1
+
+    simulation_seconds = time.perf_counter() - simulation_start
+    scores = client.request("scores", "GET", "/api/scores", kd_tokens[kd_ids[0]]).get_json()
+    return {
+        "bots": num_bots,
+        "days": days,
+        "target_speed": speed,
+        "achieved_speed": (round_end - round_start).total_seconds() / simulation_seconds,
+        "behind_steps": behind_steps,
+        "wall_seconds": simulation_seconds,
+        "days_profile": days_profile,
+        "end_state": {
+            "strategies": collections.Counter(strategies.values()),
+            "scores": scores,
+        },
+    }
+
+
+def _print_result(result):
+    print(
+        f"{result['bots']} bots, {result['days']} days: {result['wall_seconds']:.1f}s wall, "
+        f"{result['achieved_speed']:.0f}x (target {result['target_speed']:.0f}x, {result['behind_steps']} steps behind)"
+    )
+    print(f"{'day':>4}{'tick p50 ms':>14}{'tick max ms':>14}  largest documents (mean bytes)")
+    for day in result["days_profile"]:
+        largest = sorted(day["documents"].items(), key=lambda item: item[1]["mean_bytes"], reverse=True)[:4]
+        print(
+            f"{day['day']:>4}{day['ticks']['p50'] * 1000:>14.1f}{day['ticks']['max'] * 1000:>14.1f}  "
+            + ", ".join(f"{document} {sizes['mean_bytes']:.0f}" for document, sizes in largest)
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate a round with scripted bots at accelerated game time")
+    parser.add_argument("--bots", type=int, default=20)
+    parser.add_argument("--days", type=float, default=7)
+    parser.add_argument("--speed", type=float, default=1000, help="Target game seconds per wall-clock second")
+    parser.add_argument("--tick-seconds", type=float, default=300, help="Game seconds between refresh ticks")
+    parser.add_argument("--bot-interval", type=float, default=3600, help="Game seconds between the actions of a bot")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Also write the results as JSON to this path")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        result = run_round(args.bots, args.days, args.speed, args.tick_seconds, args.bot_interval, args.seed)
+        print(json.dumps(result, default=str))
+        return
+
+    result = bench.run_child(__file__, [
+        "--child",
+        "--bots", str(args.bots),
+        "--days", str(args.days),
+        "--speed", str(args.speed),
+        "--tick-seconds", str(args.tick_seconds),
+        "--bot-interval", str(args.bot_interval),
+        "--seed", str(args.seed),
+    ])
+    _print_result(result)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(result, output_file, indent=2, default=str)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+Soak benchmark of the in-memory tick engine
+
+    python soak.py --kingdoms 1000 --minutes 10 --game-speed 48
+
+Seeds a round against the offline function app stand-in like bench.py, sets the
+state's game_speed, then runs the tick engine of untitledapp.refresh in this
+process for --minutes with --tick-seconds ticks, checkpointing and refreshing
+every kingdom once per --checkpoint-seconds in slices after each tick. Reports
+the economy tick latency percentiles, the slice checkpoint durations and the
+late ticks; the engine sustains the tick rate when no tick is late.
+"""
+import argparse
+import collections
+import datetime
+import json
+import time
+
+import bench
+
+
+def run_soak(num_kingdoms, minutes, game_speed, tick_seconds, checkpoint_seconds):
+    """Soak the engine in this process; the environment must point at a fresh stand-in"""
+    bench.init_standin()
+    from untitledapp import app, guard, User
+    import untitledapp.refresh as uar
+    import untitledapp.shared as uas
+
+    client = bench.BenchClient(app.test_client())
+    time_now = datetime.datetime.now(datetime.timezone.utc)
+    seed_start = time.perf_counter()
+    bench.seed_round(
+        client,
+        num_kingdoms,
+        game_start=time_now - datetime.timedelta(hours=1),
+        game_end=time_now + datetime.timedelta(days=30),
+        election_start=time_now + datetime.timedelta(days=30),
+    )
+    seed_seconds = time.perf_counter() - seed_start
+    with app.app_context():
+        admin_token = guard.encode_jwt_token(User.lookup("admin"))
+    client.request("updatestate", "POST", "/api/updatestate", admin_token, {"game_speed": game_speed})
+
+    uar.ENGINE.tick_seconds = tick_seconds
+    uar.ENGINE.checkpoint_seconds = checkpoint_seconds
+    uar.ENGINE.tick_durations = collections.deque()
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    client.request("engine", "POST", "/api/admin/engine", admin_token, {"enabled": True})
+    time.sleep(minutes * 60)
+    engine_stats = client.request("engine", "GET", "/api/admin/engine", admin_token).get_json()
+    client.request("engine", "POST", "/api/admin/engine", admin_token, {"enabled": False})
+    wall_seconds = time.perf_counter() - wall_start
+    cpu_seconds = time.process_time() - cpu_start
+
+    durations = sorted(uar.ENGINE.tick_durations)
+    return {
+        "kingdoms": num_kingdoms,
+        "resident_kingdoms": engine_stats["kingdoms"],
+        "game_speed": game_speed,
+        "epoch_seconds": uas.GAME_CONFIG["BASE_EPOCH_SECONDS"],
+        "tick_seconds": tick_seconds,
+        "checkpoint_seconds": checkpoint_seconds,
+        "seed_seconds": seed_seconds,
+        "wall_seconds": wall_seconds,
+        "cpu_seconds": cpu_seconds,
+        "ticks": {
+            "count": len(durations),
+            "per_second": len(durations) / wall_seconds,
+            "p50": bench._percentile(durations, 50),
+            "p99": bench._percentile(durations, 99),
+            "max": durations[-1],
+        },
+        "engine": uar.ENGINE.stats,
+        "endpoints": bench._summarize(client.samples),
+    }
+
+
+def _print_result(result):
+    ticks = result["ticks"]
+    engine = result["engine"]
+    print(
+        f"{result['resident_kingdoms']} kingdoms at game speed {result['game_speed']:g} "
+        f"(epoch {result['epoch_seconds']:.1f}s), {result['wall_seconds']:.0f}s wall, "
+        f"{result['cpu_seconds']:.0f}s cpu"
+    )
+    print(
+        f"ticks: {ticks['count']} ({ticks['per_second']:.2f}/s), "
+        f"p50 {ticks['p50'] * 1000:.1f}ms, p99 {ticks['p99'] * 1000:.1f}ms, max {ticks['max'] * 1000:.1f}ms, "
+        f"{engine['late_ticks']} late"
+    )
+    print(
+        f"refresh cycles: {engine['cycles']}, slice checkpoints: {engine['checkpoints']}, "
+        f"last {engine['last_checkpoint_seconds'] or 0:.2f}s, max {engine['max_checkpoint_seconds']:.2f}s"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Soak the in-memory tick engine against the offline function app stand-in")
+    parser.add_argument("--kingdoms", type=int, default=1000)
+    parser.add_argument("--minutes", type=float, default=10)
+    parser.add_argument("--game-speed", type=float, default=48, help="State game_speed; 48 makes an epoch 37.5 seconds")
+    parser.add_argument("--tick-seconds", type=float, default=1)
+    parser.add_argument("--checkpoint-seconds", type=float, default=60)
+    parser.add_argument("--output", help="Also write the results as JSON to this path")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        result = run_soak(args.kingdoms, args.minutes, args.game_speed, args.tick_seconds, args.checkpoint_seconds)
+        print(json.dumps(result, default=str))
+        return
+
+    result = bench.run_child(__file__, [
+        "--child",
+        "--kingdoms", str(args.kingdoms),
+        "--minutes", str(args.minutes),
+        "--game-speed", str(args.game_speed),
+        "--tick-seconds", str(args.tick_seconds),
+        "--checkpoint-seconds", str(args.checkpoint_seconds),
+    ])
+    _print_result(result)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(result, output_file, indent=2, default=str)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,13 @@
 import collections
 import datetime
+import fcntl
 import os
 import random
 import requests
+import secrets
 import json
+import tempfile
+import threading
 import time
 import logging
 
@@ -11,6 +15,8 @@ from functools import wraps
 
 import flask
 import flask_sqlalchemy
+import sqlalchemy
+import sqlalchemy.orm
 import flask_praetorian
 import flask_cors
 from flask_mail import Mail
@@ -18,14 +24,32 @@ from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 from flask_sock import Sock, ConnectionClosed
 
+from untitledapp.clock import GameClock
+from untitledapp.gateway import WebsocketGateway, make_bus
+from untitledapp.identity import IdentityCache
+from untitledapp.journal import ActionJournal, new_seed, redact
+from untitledapp.metrics import BackendMetrics
+from untitledapp.notifs import NotifAggregator
+
+STARTUP_START = time.perf_counter()
+
 db = flask_sqlalchemy.SQLAlchemy()
 guard = flask_praetorian.Praetorian()
 cors = flask_cors.CORS()
 mail = Mail()
 
+CLOCK = GameClock()
 REQUESTS_SESSION = requests.Session()
+METRICS = BackendMetrics()
+REQUESTS_SESSION.hooks["response"].append(METRICS.record_response)
+JOURNAL = ActionJournal(os.environ.get("ACTION_JOURNAL_FILE"))
 
-SOCK_HANDLERS = {}
+SOCK_HANDLERS = WebsocketGateway(make_bus())
+IDENTITIES = IdentityCache(ttl=float(os.environ.get("IDENTITY_CACHE_SECONDS", "30")))
+
+def _account_timestamp():
+    # Fixed width so that timestamps compare lexically
+    return datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%f+00:00")
 
 # A generic user model that might be used by an app powered by flask-praetorian
 class User(db.Model):
@@ -38,6 +62,7 @@ class User(db.Model):
     is_active = db.Column(db.Boolean, default=True, server_default='true')
     is_verified = db.Column(db.Boolean, default=True, server_default='false')
     kd_death_date = db.Column(db.Text)
+    updated_at = db.Column(db.Text, default=_account_timestamp, onupdate=_account_timestamp)
 
     @property
     def rolenames(self):
@@ -52,6 +77,20 @@ class User(db.Model):
 
     @classmethod
     def identify(cls, id):
+        """
+        Return a cached identity snapshot; memoized per request and cached per process
+
+        Use User.load for a row that will be modified.
+        """
+        if not flask.has_request_context():
+            return IDENTITIES.get(id, cls.load)
+        request_identities = flask.g.setdefault("identities", {})
+        if id not in request_identities:
+            request_identities[id] = IDENTITIES.get(id, cls.load)
+        return request_identities[id]
+
+    @classmethod
+    def load(cls, id):
         return cls.query.get(id)
 
     @property
@@ -62,6 +101,29 @@ class User(db.Model):
         return self.is_active
 
 
+@sqlalchemy.event.listens_for(User, "after_update")
+@sqlalchemy.event.listens_for(User, "after_delete")
+def _track_identity_change(mapper, connection, target):
+    sqlalchemy.orm.object_session(target).info.setdefault("changed_user_ids", set()).add(target.id)
+
+@sqlalchemy.event.listens_for(db.session, "after_commit")
+def _invalidate_changed_identities(session):
+    changed_user_ids = session.info.pop("changed_user_ids", set())
+    if changed_user_ids:
+        IDENTITIES.invalidate(changed_user_ids)
+        # Other workers on the host receive it through the websocket bus
+        SOCK_HANDLERS.bus.publish("identity", {"invalidate_identities": sorted(changed_user_ids)})
+
+@sqlalchemy.event.listens_for(db.session, "after_rollback")
+def _discard_changed_identities(session):
+    session.info.pop("changed_user_ids", None)
+
+def _on_identity_event(kd_id, event):
+    if kd_id == "identity" and "invalidate_identities" in event:
+        IDENTITIES.invalidate(event["invalidate_identities"])
+
+SOCK_HANDLERS.bus.subscribe(_on_identity_event)
+
 # Initialize flask app for the example
 app = flask.Flask(__name__, static_folder='../../build', static_url_path=None)
 app.debug = True
@@ -94,11 +156,103 @@ mail.init_app(app)
 
 sock = Sock(app)
 
+@app.before_request
+def _start_request_metrics():
+    flask.g.request_start = time.perf_counter()
+    url_rule = flask.request.url_rule
+    METRICS.set_route(url_rule.rule if url_rule is not None else "unmatched")
+
+@app.after_request
+def _record_request_metrics(response):
+    route, _ = METRICS.labels()
+    seconds = time.perf_counter() - flask.g.get("request_start", time.perf_counter())
+    METRICS.record_route(route, flask.request.method, response.status_code, seconds)
+    calls = METRICS.clear_route()
+    if flask.request.headers.get("X-Backend-Metrics"):
+        app.logger.info(
+            '%s %s took %.3fs with %s backend calls, %s bytes sent, %s bytes received, %.3fs backend: %s',
+            flask.request.method,
+            route,
+            seconds,
+            len(calls),
+            sum(call[3] for call in calls),
+            sum(call[4] for call in calls),
+            sum(call[5] for call in calls),
+            [f"{method} {target} {status}" for method, target, status, _, _, _ in calls],
+        )
+    return response
+
+JOURNAL_METHODS = {"POST", "PUT", "PATCH", "DELETE"}
+# Routes that change the game without a mutating method
+JOURNAL_GET_RULES = {"/api/revealrandomgalaxy"}
+# Token, refresh tick (journaled by the tick itself) and operations routes
+JOURNAL_SKIP_RULES = {
+    "/api/login",
+    "/api/adminlogin",
+    "/api/adminrefresh",
+    "/api/refresh",
+    "/api/refreshdata",
+    "/api/finalize",
+    "/api/admin/engine",
+    "/api/admin/snapshots",
+    "/api/admin/snapshots/restore",
+}
+
+def _begin_journal_action():
+    """Seed the game randomness of one action; returns its journal entry and the RNG reset token"""
+    seed = new_seed()
+    entry = {"pid": os.getpid(), "clock": CLOCK.now().isoformat(), "seed": seed}
+    return entry, uas.RNG.set(random.Random(seed))
+
+@app.before_request
+def _start_action_journal():
+    url_rule = flask.request.url_rule
+    if not JOURNAL.enabled or url_rule is None or url_rule.rule in JOURNAL_SKIP_RULES:
+        return
+    if flask.request.method in JOURNAL_METHODS or url_rule.rule in JOURNAL_GET_RULES:
+        flask.g.journal_entry, flask.g.journal_rng_token = _begin_journal_action()
+        flask.g.journal_start = time.perf_counter()
+
+@app.after_request
+def _record_action_journal(response):
+    entry = flask.g.get("journal_entry")
+    if entry is None:
+        return response
+    # The auth decorators drop the token data once the route returns
+    try:
+        user_id = guard.extract_jwt_token(guard.read_token_from_header())["id"]
+    except flask_praetorian.exceptions.PraetorianError:
+        user_id = None
+    body = flask.request.get_json(force=True, silent=True)
+    JOURNAL.record({
+        **entry,
+        "kind": "request",
+        "route": flask.request.url_rule.rule,
+        "method": flask.request.method,
+        "path": flask.request.full_path.rstrip("?"),
+        "user_id": user_id,
+        "body": redact(body) if body is not None else flask.request.get_data(as_text=True) or None,
+        "status": response.status_code,
+        "seconds": time.perf_counter() - flask.g.journal_start,
+    })
+    return response
+
+@app.teardown_request
+def _reset_action_rng(exc):
+    rng_token = flask.g.pop("journal_rng_token", None)
+    if rng_token is not None:
+        uas.RNG.reset(rng_token)
+
 def alive_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        kd_death_date = flask_praetorian.current_user().kd_death_date
-        if kd_death_date not in (None, ""):
+        # Read past the identity cache, whose invalidation only reaches other workers on the socket bus
+        user_status = db.session.query(User.is_active, User.kd_death_date).filter_by(
+            id=flask_praetorian.current_user_id()
+        ).one_or_none()
+        if user_status is None or not user_status.is_active:
+            return flask.jsonify({"message": "Your account is disabled"}), 403
+        if user_status.kd_death_date not in (None, ""):
             return flask.jsonify({"message": "You can not do that because your kingdom is dead!"}), 400
         return f(*args, **kwargs)
     return decorated_function
@@ -107,7 +261,7 @@ def start_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
         state = uag._get_state()
-        time_now = datetime.datetime.now(datetime.timezone.utc)
+        time_now = CLOCK.now()
         if time_now.isoformat() < state["state"]["game_start"]:
             return flask.jsonify({"message": "The game has not yet started!"}), 400
         return f(*args, **kwargs)
@@ -117,46 +271,39 @@ def before_start_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
         state = uag._get_state()
-        time_now = datetime.datetime.now(datetime.timezone.utc)
+        time_now = CLOCK.now()
         if time_now.isoformat() > state["state"]["game_start"]:
             return flask.jsonify({"message": "The game has already started!"}), 400
         return f(*args, **kwargs)
     return decorated_function
 
+def _publish_event(kd_id, event):
+    SOCK_HANDLERS.publish(kd_id, event)
+
 def _mark_kingdom_death(kd_id):
     query = db.session.query(User).filter_by(kd_id=kd_id).all()
     user = query[0]
-    user.kd_death_date = datetime.datetime.now(datetime.timezone.utc).isoformat()
+    user.kd_death_date = CLOCK.now().isoformat()
     db.session.commit()
     uaa._update_accounts()
-    try:
-        ws = SOCK_HANDLERS[kd_id]
-        ws.send(json.dumps({
-            "message": f"You died!",
-            "status": "warning",
-            "category": "Dead",
-            "delay": 999999,
-            "update": [],
-        }))
-    except (KeyError, ConnectionError, StopIteration, ConnectionClosed):
-        pass
+    _publish_event(kd_id, {
+        "message": f"You died!",
+        "status": "warning",
+        "category": "Dead",
+        "delay": 999999,
+        "update": [],
+    })
     return flask.jsonify(str(user.__dict__))
 
-def _add_notifs(kd_id, categories):
-    add_notifs_response = REQUESTS_SESSION.patch(
-        os.environ['AZURE_FUNCTION_ENDPOINT'] + f'/kingdom/{kd_id}/notifs',
-        headers={'x-functions-key': os.environ['AZURE_FUNCTIONS_HOST_KEY']},
-        data=json.dumps({"add_categories": categories}),
-    )
-
-def _clear_notifs(kd_id, categories):
-    clear_notifs_response = REQUESTS_SESSION.patch(
+def _write_notifs(kd_id, add_categories, clear_categories):
+    update_notifs_response = REQUESTS_SESSION.patch(
         os.environ['AZURE_FUNCTION_ENDPOINT'] + f'/kingdom/{kd_id}/notifs',
         headers={'x-functions-key': os.environ['AZURE_FUNCTIONS_HOST_KEY']},
-        data=json.dumps({"clear_categories": categories}),
+        data=json.dumps({"add_categories": add_categories, "clear_categories": clear_categories}),
     )
+    update_notifs_response.raise_for_status()
 
-def _get_notifs(kd_id):
+def _read_notifs(kd_id):
     get_notifs_response = REQUESTS_SESSION.get(
         os.environ['AZURE_FUNCTION_ENDPOINT'] + f'/kingdom/{kd_id}/notifs',
         headers={'x-functions-key': os.environ['AZURE_FUNCTIONS_HOST_KEY']},
@@ -164,6 +311,24 @@ def _get_notifs(kd_id):
     get_notifs_response_json = json.loads(get_notifs_response.text)
     return get_notifs_response_json
 
+NOTIFS = NotifAggregator(
+    _read_notifs,
+    _write_notifs,
+    window=float(os.environ.get("NOTIFS_FLUSH_SECONDS", "1.0")),
+    max_retries=int(os.environ.get("NOTIFS_MAX_RETRIES", "5")),
+)
+
+def _add_notifs(kd_id, categories):
+    NOTIFS.add(kd_id, categories)
+    # The gateway builds the notifs patch on its delivery thread, for connected kingdoms only
+    _publish_event(kd_id, {"update": ["notifs"]})
+
+def _clear_notifs(kd_id, categories):
+    NOTIFS.clear(kd_id, categories)
+
+def _get_notifs(kd_id):
+    return NOTIFS.get(kd_id)
+
 
 @app.route('/api/notifs', methods=['GET'])
 @flask_praetorian.auth_required
@@ -187,12 +352,16 @@ def clear_notifs():
 
 
 import untitledapp.account as uaa
+import untitledapp.bots as uabot
 import untitledapp.build as uab
 import untitledapp.conquer as uac
 import untitledapp.getters as uag
 import untitledapp.politics as uap
 import untitledapp.refresh as uar
 import untitledapp.shared as uas
+import untitledapp.snapshot as uasnap
+
+SOCK_HANDLERS.patch_builder = uag._get_delta_patch
 
 if __name__ != '__main__':
     gunicorn_logger = logging.getLogger('gunicorn.glogging.Logger')
@@ -217,28 +386,86 @@ limiter = Limiter(
     storage_uri="memory://",
 )
 
-# Add users for the example
-with app.app_context():
-    db.create_all()
-    accounts_response = REQUESTS_SESSION.get(
-        os.environ['AZURE_FUNCTION_ENDPOINT'] + f'/accounts',
-        headers={'x-functions-key': os.environ['AZURE_FUNCTIONS_HOST_KEY']},
-    )
-    accounts_json = json.loads(accounts_response.text)
-    accounts = accounts_json["accounts"]
-    for user in accounts:
-        if db.session.query(User).filter_by(username=user["username"]).count() < 1:
-            db.session.add(
-                User(**user)
-            )
-    if db.session.query(User).filter_by(username='admin').count() < 1:
-        db.session.add(User(
-          username='admin',
-          password=guard.hash_password(os.environ["ADMIN_PASSWORD"]),
-          roles='operator,admin',
-          kd_created=True,
-		))
-    db.session.commit()
+ACCOUNTS_READY = threading.Event()
+ACCOUNTS_LOCK_FILE = os.environ.get("ACCOUNTS_LOCK_FILE", os.path.join(tempfile.gettempdir(), "untitledapp-accounts.lock"))
+ACCOUNTS_READY_TIMEOUT = float(os.environ.get("ACCOUNTS_READY_TIMEOUT", "30"))
+ACCOUNTS_BOOTSTRAP_RETRY_SECONDS = float(os.environ.get("ACCOUNTS_BOOTSTRAP_RETRY_SECONDS", "1"))
+ACCOUNTS_BOOTSTRAP_MAX_RETRY_SECONDS = float(os.environ.get("ACCOUNTS_BOOTSTRAP_MAX_RETRY_SECONDS", "60"))
+ACCOUNTS_BOOTSTRAP = {
+    "attempts": 0,
+}
+
+def _ensure_user_columns():
+    # create_all does not add columns to an existing table
+    user_columns = {column["name"] for column in sqlalchemy.inspect(db.engine).get_columns(User.__tablename__)}
+    if "updated_at" not in user_columns:
+        with db.engine.begin() as connection:
+            connection.execute(sqlalchemy.text(f'ALTER TABLE "{User.__tablename__}" ADD COLUMN updated_at TEXT'))
+
+def _bootstrap_accounts():
+    """
+    Create the tables and add the replicated accounts and admin user that are missing
+
+    Only one process per host runs this at a time (file lock); the others wait for it
+    and then find nothing left to add.
+    """
+    bootstrap_start = time.perf_counter()
+    with open(ACCOUNTS_LOCK_FILE, "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            with app.app_context():
+                db.create_all()
+                _ensure_user_columns()
+                accounts_response = REQUESTS_SESSION.get(
+                    os.environ['AZURE_FUNCTION_ENDPOINT'] + f'/accounts',
+                    headers={'x-functions-key': os.environ['AZURE_FUNCTIONS_HOST_KEY']},
+                )
+                if accounts_response.status_code != 200:
+                    raise RuntimeError(f"Accounts returned {accounts_response.status_code}")
+                accounts_json = json.loads(accounts_response.text)
+                accounts = accounts_json["accounts"]
+                existing_usernames = {username for username, in db.session.query(User.username).all()}
+                db.session.add_all([
+                    User(**user)
+                    for user in accounts
+                    if user["username"] not in existing_usernames
+                ])
+                if 'admin' not in existing_usernames:
+                    db.session.add(User(
+                      username='admin',
+                      password=guard.hash_password(os.environ["ADMIN_PASSWORD"]),
+                      roles='operator,admin',
+                      kd_created=True,
+                    ))
+                db.session.commit()
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+    app.logger.info('Accounts bootstrap took %.3fs', time.perf_counter() - bootstrap_start)
+
+def _run_accounts_bootstrap():
+    """Bootstrap the accounts, retrying with exponential backoff; the app is ready only once it succeeds"""
+    retry_seconds = ACCOUNTS_BOOTSTRAP_RETRY_SECONDS
+    while True:
+        ACCOUNTS_BOOTSTRAP["attempts"] += 1
+        try:
+            _bootstrap_accounts()
+        except Exception as e:
+            app.logger.warning('Error bootstrapping accounts %s, retrying in %.0fs', str(e), retry_seconds)
+            time.sleep(retry_seconds)
+            retry_seconds = min(retry_seconds * 2, ACCOUNTS_BOOTSTRAP_MAX_RETRY_SECONDS)
+            continue
+        ACCOUNTS_READY.set()
+        return
+
+@app.before_request
+def _wait_for_accounts():
+    if not ACCOUNTS_READY.is_set() and not ACCOUNTS_READY.wait(timeout=ACCOUNTS_READY_TIMEOUT):
+        return (flask.jsonify({
+            "message": "Accounts are not ready",
+            "attempts": ACCOUNTS_BOOTSTRAP["attempts"],
+        }), 503)
+
+threading.Thread(target=_run_accounts_bootstrap, daemon=True).start()
 
 @app.route('/api/resetstate', methods=["POST"])
 @flask_praetorian.roles_required('admin')
@@ -276,6 +503,14 @@ def update_state():
     """
     req = flask.request.get_json(force=True)
 
+    if "game_speed" in req:
+        try:
+            req["game_speed"] = float(req["game_speed"])
+        except (TypeError, ValueError):
+            return (flask.jsonify({"message": "Game speed must be a number"}), 400)
+        if req["game_speed"] <= 0:
+            return (flask.jsonify({"message": "Game speed must be positive"}), 400)
+
     if "game_start" in req:
         create_response = REQUESTS_SESSION.post(
             os.environ['AZURE_FUNCTION_ENDPOINT'] + f'/createitem',
@@ -337,6 +572,7 @@ def create_state():
 @sock.route('/ws/listen')
 # @flask_praetorian.auth_required
 def listen(ws):
+    listening_kd_id = None
     while True:
         try:
             data = ws.receive()
@@ -349,11 +585,16 @@ def listen(ws):
                 query = db.session.query(User).filter_by(id=id).all()
                 user = query[0]
                 sock.app.logger.info('Added %s to listeners', user.kd_id)
-                SOCK_HANDLERS[user.kd_id] = ws
+                if listening_kd_id is not None:
+                    SOCK_HANDLERS.unregister(listening_kd_id, ws)
+                listening_kd_id = user.kd_id
+                SOCK_HANDLERS.register(listening_kd_id, ws)
 
-            sock.app.logger.info('Current handlers %s', SOCK_HANDLERS)
+            sock.app.logger.info('Current handlers %s', SOCK_HANDLERS.stats()["connections"])
         except ConnectionClosed:
             sock.app.logger.info('Breaking handler')
+            if listening_kd_id is not None:
+                SOCK_HANDLERS.unregister(listening_kd_id, ws)
             break
         except Exception as e:
             sock.app.logger.warning('Error handling listener %s', str(e))
@@ -361,6 +602,193 @@ def listen(ws):
         time.sleep(5)
 
 
+@app.route('/api/admin/websockets', methods=["GET"])
+@flask_praetorian.roles_required('admin')
+def websockets_stats():
+    """
+    Return websocket gateway connections, delivery counts and queue depth
+    """
+    return flask.jsonify(SOCK_HANDLERS.stats()), 200
+
+
+@app.route('/api/metrics', methods=["GET"])
+@flask_praetorian.roles_required('admin')
+def metrics():
+    """
+    Return backend call counts, bytes and latency per route in the Prometheus text format
+    """
+    return METRICS.render(), 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+
+
+SNAPSHOT_DIR = os.environ.get("SNAPSHOT_DIR", os.path.join(tempfile.gettempdir(), "untitledapp-snapshots"))
+SNAPSHOT_EXPORT_PAGE_ITEMS = int(os.environ.get("SNAPSHOT_EXPORT_PAGE_ITEMS", "500"))
+
+def _export_items():
+    continuation = None
+    while True:
+        export_response = REQUESTS_SESSION.get(
+            os.environ['AZURE_FUNCTION_ENDPOINT'] + f'/items/export',
+            headers={'x-functions-key': os.environ['AZURE_FUNCTIONS_HOST_KEY']},
+            params={"continuation": continuation, "max_items": SNAPSHOT_EXPORT_PAGE_ITEMS},
+        )
+        export_json = json.loads(export_response.text)
+        yield from export_json["items"]
+        continuation = export_json["continuation"]
+        if not continuation:
+            return
+
+def _take_snapshot(path, metadata=None):
+    """Write every game item to a snapshot archive at path; returns its index summary"""
+    with open(path + ".partial", "wb") as snapshot_file:
+        writer = uasnap.SnapshotWriter(snapshot_file, chunk_items=uasnap.SNAPSHOT_CHUNK_ITEMS, metadata=metadata)
+        # Leases belong to the running processes, not to the game
+        writer.add_all(item for item in _export_items() if item.get("type") != "lease")
+        writer.close()
+    os.replace(path + ".partial", path)
+    with open(path, "rb") as snapshot_file:
+        return uasnap.SnapshotReader(snapshot_file).summary()
+
+def _sync_users_from_accounts(prune=False):
+    """Make the users table match the replicated accounts document, by username"""
+    accounts_response = REQUESTS_SESSION.get(
+        os.environ['AZURE_FUNCTION_ENDPOINT'] + f'/accounts',
+        headers={'x-functions-key': os.environ['AZURE_FUNCTIONS_HOST_KEY']},
+    )
+    accounts = json.loads(accounts_response.text)["accounts"]
+    users = {user.username: user for user in db.session.query(User).all()}
+    for account in accounts:
+        user = users.get(account["username"])
+        if user is None:
+            if db.session.get(User, account["id"]) is not None:
+                account = {k: v for k, v in account.items() if k != "id"}
+            db.session.add(User(**account))
+            continue
+        for key, value in account.items():
+            if key != "id":
+                setattr(user, key, value)
+    if prune:
+        account_usernames = {account["username"] for account in accounts}
+        for username, user in users.items():
+            if username not in account_usernames:
+                db.session.delete(user)
+    db.session.commit()
+
+def _restore_snapshot(path, prune=False):
+    """
+    Upsert every item of the snapshot archive at path, one chunk per call
+
+    With prune, items created after the snapshot are deleted so the store matches it
+    exactly. Users are then synced from the restored accounts document.
+    """
+    imported = 0
+    with open(path, "rb") as snapshot_file:
+        reader = uasnap.SnapshotReader(snapshot_file)
+        for items in reader.iter_chunks():
+            import_response = REQUESTS_SESSION.post(
+                os.environ['AZURE_FUNCTION_ENDPOINT'] + f'/items/import',
+                headers={'x-functions-key': os.environ['AZURE_FUNCTIONS_HOST_KEY']},
+                data=json.dumps({"items": items}),
+            )
+            if import_response.status_code != 200:
+                raise uasnap.SnapshotError(f"Import failed: {import_response.text}")
+            imported += json.loads(import_response.text)["imported"]
+        deleted = 0
+        if prune:
+            prune_response = REQUESTS_SESSION.post(
+                os.environ['AZURE_FUNCTION_ENDPOINT'] + f'/items/prune',
+                headers={'x-functions-key': os.environ['AZURE_FUNCTIONS_HOST_KEY']},
+                data=json.dumps({"keep_ids": list(reader.index["item_chunks"])}),
+            )
+            if prune_response.status_code != 200:
+                raise uasnap.SnapshotError(f"Prune failed: {prune_response.text}")
+            deleted = len(json.loads(prune_response.text)["deleted"])
+    _sync_users_from_accounts(prune)
+    return {"imported": imported, "deleted": deleted}
+
+def _get_snapshot_path(name):
+    if not name or os.path.basename(name) != name or name.startswith("."):
+        return None
+    return os.path.join(SNAPSHOT_DIR, name)
+
+def _with_refresh_lease(func, *args):
+    """Run func with refresh ticks and the tick engine held off"""
+    if uar._engine_running():
+        return None, ("Stop the tick engine first", 409)
+    lease = uar._acquire_refresh_lease(datetime.datetime.now(datetime.timezone.utc))
+    if not lease["acquired"]:
+        return None, ("A refresh tick is running, try again", 409)
+    try:
+        return func(*args), None
+    finally:
+        uar._release_refresh_lease(lease["token"])
+
+
+@app.route('/api/admin/snapshots', methods=["GET"])
+@flask_praetorian.roles_required('admin')
+def list_snapshots():
+    """
+    Return the snapshots in the snapshot directory with their index summaries
+    """
+    snapshots = []
+    if os.path.isdir(SNAPSHOT_DIR):
+        for name in sorted(os.listdir(SNAPSHOT_DIR)):
+            if name.endswith(".partial"):
+                continue
+            try:
+                with open(os.path.join(SNAPSHOT_DIR, name), "rb") as snapshot_file:
+                    summary = uasnap.SnapshotReader(snapshot_file).summary()
+            except (uasnap.SnapshotError, OSError, ValueError):
+                continue
+            snapshots.append({"name": name, "bytes": os.path.getsize(os.path.join(SNAPSHOT_DIR, name)), **summary})
+    return flask.jsonify({"snapshots": snapshots}), 200
+
+
+@app.route('/api/admin/snapshots', methods=["POST"])
+@flask_praetorian.roles_required('admin')
+def take_snapshot():
+    """
+    Snapshot every game item to a compressed archive in the snapshot directory
+    """
+    req = flask.request.get_json(force=True, silent=True) or {}
+    name = req.get("name") or datetime.datetime.now(datetime.timezone.utc).strftime("snapshot-%Y%m%dT%H%M%SZ.utsnap")
+    path = _get_snapshot_path(name)
+    if path is None:
+        return flask.jsonify({"message": "Invalid snapshot name"}), 400
+
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    start_counter = time.perf_counter()
+    summary, error = _with_refresh_lease(_take_snapshot, path, {"note": req.get("note", ""), "journal_bytes": JOURNAL.size()})
+    if error:
+        return flask.jsonify({"message": error[0]}), error[1]
+    return flask.jsonify({
+        "name": name,
+        "bytes": os.path.getsize(path),
+        "seconds": time.perf_counter() - start_counter,
+        **summary,
+    }), 200
+
+
+@app.route('/api/admin/snapshots/restore', methods=["POST"])
+@flask_praetorian.roles_required('admin')
+def restore_snapshot():
+    """
+    Restore every game item and user from a snapshot in the snapshot directory
+    """
+    req = flask.request.get_json(force=True)
+    path = _get_snapshot_path(req.get("name"))
+    if path is None or not os.path.isfile(path):
+        return flask.jsonify({"message": "Snapshot not found"}), 404
+
+    start_counter = time.perf_counter()
+    try:
+        restored, error = _with_refresh_lease(_restore_snapshot, path, bool(req.get("prune", False)))
+    except uasnap.SnapshotError as e:
+        return flask.jsonify({"message": str(e)}), 500
+    if error:
+        return flask.jsonify({"message": error[0]}), error[1]
+    return flask.jsonify({**restored, "seconds": time.perf_counter() - start_counter}), 200
+
+
 def _validate_kingdom_name(
     name,    
 ):
@@ -381,7 +809,7 @@ def _validate_kingdom_name(
 # @flask_praetorian.roles_required('verified')
 def create_initial_kingdom():
     req = flask.request.get_json(force=True)
-    user = flask_praetorian.current_user()
+    user = User.load(flask_praetorian.current_user_id())
 
     if user.kd_id != "" and user.kd_id != None:
         return (flask.jsonify({"message": "You already have a kingdom ID"}), 400)
@@ -389,7 +817,19 @@ def create_initial_kingdom():
     valid_name, message = _validate_kingdom_name(req["kdName"])
     if not valid_name:
         return (flask.jsonify({"message": message}), 400)
+
+    kd_id = _create_kingdom(req["kdName"])
+    if kd_id is None:
+        return (flask.jsonify({"message": "Error creating kingdom"}), 400)
+
+    user.kd_id = kd_id
+    db.session.commit()
+    uaa._update_accounts()
     
+    return flask.jsonify({"message": ""}), 200
+
+def _create_kingdom(kd_name):
+    """Create a kingdom in one of the smallest galaxies and return its id, or None on failure"""
     galaxies = uag._get_galaxy_info()
     size_galaxies = collections.defaultdict(list)
     for galaxy_id, kingdoms in galaxies.items():
@@ -398,14 +838,14 @@ def create_initial_kingdom():
     smallest_galaxy_size = min(size_galaxies.keys())
     smallest_galaxies = size_galaxies[smallest_galaxy_size]
 
-    chosen_galaxy = random.choice(smallest_galaxies)
+    chosen_galaxy = uas.RNG.get().choice(smallest_galaxies)
     create_kd_response = REQUESTS_SESSION.post(
         os.environ['AZURE_FUNCTION_ENDPOINT'] + f'/kingdom',
         headers={'x-functions-key': os.environ['AZURE_FUNCTIONS_HOST_KEY']},
-        data=json.dumps({"kingdom_name": req["kdName"], "galaxy": chosen_galaxy}),
+        data=json.dumps({"kingdom_name": kd_name, "galaxy": chosen_galaxy}),
     )
     if create_kd_response.status_code != 201:
-        return (flask.jsonify({"message": "Error creating kingdom"}), 400)
+        return None
     
     kd_id = create_kd_response.text
 
@@ -414,7 +854,7 @@ def create_initial_kingdom():
         state = initial_state.copy()
         if table == "kingdom":
             state["kdId"] = kd_id
-            state["name"] = req["kdName"]
+            state["name"] = kd_name
 
         create_response = REQUESTS_SESSION.post(
             os.environ['AZURE_FUNCTION_ENDPOINT'] + f'/createitem',
@@ -424,12 +864,7 @@ def create_initial_kingdom():
                 "state": state,
             }),
         )        
-
-    user.kd_id = kd_id
-    db.session.commit()
-    uaa._update_accounts()
-    
-    return flask.jsonify({"message": ""}), 200
+    return kd_id
 
 
 @app.route('/api/resetkingdom', methods=["POST"])
@@ -437,7 +872,7 @@ def create_initial_kingdom():
 @before_start_required
 # @flask_praetorian.roles_required('verified')
 def reset_initial_kingdom():    
-    user = flask_praetorian.current_user()
+    user = User.load(flask_praetorian.current_user_id())
     kd_id = user.kd_id
     kd_info = uag._get_kd_info(kd_id)
     for table, initial_state in uas.INITIAL_KINGDOM_STATE.items():
@@ -513,7 +948,7 @@ def _validate_kingdom_choices(
 # @flask_praetorian.roles_required('verified')
 def create_kingdom_choices():
     req = flask.request.get_json(force=True)
-    user = flask_praetorian.current_user()
+    user = User.load(flask_praetorian.current_user_id())
 
     if user.kd_created:
         return (flask.jsonify({"message": "This kingdom has already been created"}), 400)
@@ -532,7 +967,15 @@ def create_kingdom_choices():
     if not valid_kd:
         return (flask.jsonify({"message": message}), 400)
     
-    kd_id = user.kd_id
+    _create_kingdom_choices(user.kd_id, unit_choices, structures_choices, race)
+
+    user.kd_created = True
+    db.session.commit()
+    uaa._update_accounts()
+    
+    return (flask.jsonify({"message": ""}), 200)
+
+def _create_kingdom_choices(kd_id, unit_choices, structures_choices, race):
     kd_info = uag._get_kd_info(kd_id)
     drones = unit_choices.pop("drones")
 
@@ -548,13 +991,14 @@ def create_kingdom_choices():
     }
     state = uag._get_state()
     start_time_datetime = datetime.datetime.fromisoformat(state["state"]["game_start"]).astimezone(datetime.timezone.utc)
-    payload["last_income"] = max(state["state"]["game_start"], datetime.datetime.now(datetime.timezone.utc).isoformat())
+    payload["last_income"] = max(state["state"]["game_start"], CLOCK.now().isoformat())
+    payload["last_siphons"] = payload["last_income"]
     payload["next_resolve"] = kd_info["next_resolve"]
     payload["next_resolve"]["spy_attempt"] = (
-        max(datetime.datetime.now(datetime.timezone.utc), start_time_datetime)
+        max(CLOCK.now(), start_time_datetime)
         + datetime.timedelta(seconds=uas.GAME_CONFIG["BASE_EPOCH_SECONDS"] * uas.GAME_CONFIG["BASE_SPY_ATTEMPT_TIME_MULTIPLIER"])
     ).isoformat()
-    payload["coordinate"] = random.randint(0, 99)
+    payload["coordinate"] = uas.RNG.get().randint(0, 99)
     payload["race"] = race
 
     patch_response = REQUESTS_SESSION.patch(
@@ -563,11 +1007,51 @@ def create_kingdom_choices():
         data=json.dumps(payload),
     )        
 
-    user.kd_created = True
-    db.session.commit()
+@app.route('/api/admin/bots', methods=["GET"])
+@flask_praetorian.roles_required('admin')
+def bots_stats():
+    """
+    Return the bot kingdoms and the bot engine stats of this process
+    """
+    return flask.jsonify({"kd_ids": uabot._get_bot_kd_ids(), **uabot.BOT_STATS}), 200
+
+@app.route('/api/admin/bots', methods=["POST"])
+@flask_praetorian.roles_required('admin')
+def create_bots():
+    """
+    Create bot kingdoms, driven each tick by the bot engine in bots.py
+    """
+    req = flask.request.get_json(force=True)
+    count = int(req.get("count", 0) or 0)
+    if count <= 0:
+        return (flask.jsonify({"message": "Count must be positive"}), 400)
+
+    password = guard.hash_password(secrets.token_urlsafe(32))
+    kd_ids = []
+    for _ in range(count):
+        kd_name = f"Bot {secrets.token_hex(3)}"
+        valid_name, _ = _validate_kingdom_name(kd_name)
+        if not valid_name:
+            continue
+        kd_id = _create_kingdom(kd_name)
+        if kd_id is None:
+            continue
+
+        unit_choices, structures_choices = uabot._get_bot_choices()
+        race = uas.RACES[int(kd_id) % len(uas.RACES)]
+        _create_kingdom_choices(kd_id, unit_choices, structures_choices, race)
+        db.session.add(User(
+            username=f"bot-{kd_id}",
+            password=password,
+            roles=uabot.BOT_ROLE,
+            kd_id=kd_id,
+            kd_created=True,
+        ))
+        db.session.commit()
+        kd_ids.append(kd_id)
     uaa._update_accounts()
-    
-    return (flask.jsonify({"message": ""}), 200)
+
+    return (flask.jsonify({"message": f"Created {len(kd_ids)} bots", "kd_ids": kd_ids}), 200)
 
 def _validate_shields(req_values):
 
@@ -658,17 +1142,13 @@ def send_message(target_kd):
         data=json.dumps(payload_to)
     )
     _add_notifs(target_kd, ["messages"])
-    try:
-        ws = SOCK_HANDLERS[target_kd]
-        ws.send(json.dumps({
-            "message": f"New message from {kingdoms[kd_id]}!",
-            "status": "info",
-            "category": "Message",
-            "delay": 30000,
-            "update": ["messages"],
-        }))
-    except (KeyError, ConnectionError, StopIteration, ConnectionClosed):
-        pass
+    _publish_event(target_kd, {
+        "message": f"New message from {kingdoms[kd_id]}!",
+        "status": "info",
+        "category": "Message",
+        "delay": 30000,
+        "update": ["messages"],
+    })
     
     return (flask.jsonify({"message": "Message sent!", "status": "success"}), 200)
 
@@ -710,7 +1190,7 @@ def spending():
 
         if enabled:
             next_resolve = kd_info_parse["next_resolve"]
-            next_resolve["auto_spending"] = (datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=uas.GAME_CONFIG["BASE_EPOCH_SECONDS"] * uas.GAME_CONFIG["BASE_AUTO_SPENDING_TIME_MULTIPLIER"])).isoformat()
+            next_resolve["auto_spending"] = (CLOCK.now() + datetime.timedelta(seconds=uas.GAME_CONFIG["BASE_EPOCH_SECONDS"] * uas.GAME_CONFIG["BASE_AUTO_SPENDING_TIME_MULTIPLIER"])).isoformat()
             payload["next_resolve"] = next_resolve
         else:
             total_funding = sum(kd_info_parse["funding"].values())
@@ -827,6 +1307,8 @@ def catch_all(path):
     else:
         return app.send_static_file('index.html')
 
+app.logger.info('Started in %.3fs', time.perf_counter() - STARTUP_START)
+
 # Run the example
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=8000)
\ No newline at end of file
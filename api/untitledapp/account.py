@@ -1,10 +1,12 @@
+import datetime
 import json
 import os
 
 import flask
 import flask_praetorian
+import sqlalchemy
 
-from untitledapp import app, guard, db, User, REQUESTS_SESSION
+from untitledapp import app, guard, db, User, REQUESTS_SESSION, _account_timestamp
 
 @app.route('/api/login', methods=['POST'])
 def login():
@@ -43,16 +45,65 @@ def refresh():
     ret = {'accessToken': new_token}
     return ret, 200
 
+ACCOUNTS_REPLICATION_SLACK_SECONDS = 5
+ACCOUNTS_RECONCILE_SECONDS = int(os.environ.get("ACCOUNTS_RECONCILE_SECONDS", "3600"))
+ACCOUNTS_REPLICATION = {
+    "replicated_at": _account_timestamp(),
+    "reconciled_at": None,
+}
+
+def _serialize_user(user):
+    return {k: v for k, v in user.__dict__.items() if k != "_sa_instance_state"}
+
 def _update_accounts():
+    """
+    Replicate the accounts changed since the last replication to the accounts document
+
+    Rows are upserted by id; a small slack re-sends rows committed concurrently with the
+    previous replication, and _reconcile_accounts periodically rewrites everything.
+    """
+    replicated_at = _account_timestamp()
+    since = (
+        datetime.datetime.fromisoformat(ACCOUNTS_REPLICATION["replicated_at"])
+        - datetime.timedelta(seconds=ACCOUNTS_REPLICATION_SLACK_SECONDS)
+    ).strftime("%Y-%m-%dT%H:%M:%S.%f+00:00")
+    query = db.session.query(User).filter(
+        sqlalchemy.or_(User.updated_at >= since, User.updated_at == None)
+    ).all()
+    users = [_serialize_user(user) for user in query]
+    if not users:
+        return "No accounts changed"
+    update_accounts = REQUESTS_SESSION.post(
+        os.environ['AZURE_FUNCTION_ENDPOINT'] + f'/accounts/upsert',
+        headers={'x-functions-key': os.environ['AZURE_FUNCTIONS_HOST_KEY']},
+        data=json.dumps({"accounts": users}),
+    )
+    # Keep the old mark on failure so the next replication re-sends these rows
+    if update_accounts.status_code == 200:
+        ACCOUNTS_REPLICATION["replicated_at"] = replicated_at
+    return update_accounts.text
+
+def _reconcile_accounts():
     query = db.session.query(User).all()
-    users = [{k: v for k, v in user.__dict__.items() if k != "_sa_instance_state"} for user in query]
+    users = [_serialize_user(user) for user in query]
     update_accounts = REQUESTS_SESSION.patch(
         os.environ['AZURE_FUNCTION_ENDPOINT'] + f'/accounts',
         headers={'x-functions-key': os.environ['AZURE_FUNCTIONS_HOST_KEY']},
         data=json.dumps({"accounts": users}),
     )
+    ACCOUNTS_REPLICATION["reconciled_at"] = _account_timestamp()
     return update_accounts.text
 
+def _reconcile_accounts_if_due():
+    reconciled_at = ACCOUNTS_REPLICATION["reconciled_at"]
+    if reconciled_at is not None:
+        seconds_since = (
+            datetime.datetime.now(datetime.timezone.utc)
+            - datetime.datetime.fromisoformat(reconciled_at)
+        ).total_seconds()
+        if seconds_since < ACCOUNTS_RECONCILE_SECONDS:
+            return
+    _reconcile_accounts()
 
 
 @app.route('/api/disable_user', methods=['POST'])
@@ -139,7 +190,7 @@ def register():
 @app.route('/api/finalize')
 def finalize():
     registration_token = guard.read_token_from_header()
-    user = guard.get_user_from_registration_token(registration_token)
+    user = User.load(guard.get_user_from_registration_token(registration_token).id)
     user.roles = 'operator,verified'
     db.session.commit()
     _update_accounts()
@@ -0,0 +1,289 @@
+import datetime
+import json
+import math
+import os
+import time
+
+import untitledapp.getters as uag
+import untitledapp.shared as uas
+from untitledapp import db, User, REQUESTS_SESSION
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+BOT_ROLE = "bot"
+BOT_PERSONALITIES = ["economy", "attacker", "defender"]
+# Share of the spending left after settles and structures that goes to military, per personality
+BOT_MILITARY_SHARE = (0.5, 0.9, 0.8)
+BOT_AUTO_ATTACK_PCT = (0.0, 0.5, 0.25)
+BOT_UNITS_TARGET = {
+    "economy": {"attack": 0.2, "defense": 0.6, "flex": 0.2, "big_flex": 0},
+    "attacker": {"attack": 0.5, "defense": 0.2, "flex": 0.3, "big_flex": 0},
+    "defender": {"attack": 0.1, "defense": 0.7, "flex": 0.2, "big_flex": 0},
+}
+BOT_HOMES_SHARE = 0.3
+BOT_ROB_KEEP_SPY_ATTEMPTS = 2
+BOT_ROB_DRONES_PCT = 0.25
+BOT_KINGDOM_FIELDS = [
+    "kdId",
+    "status",
+    "stars",
+    "population",
+    "money",
+    "drones",
+    "spy_attempts",
+    "generals_available",
+    "units",
+    "structures",
+    "next_resolve",
+    "auto_spending_enabled",
+    "auto_spending",
+    "structures_target",
+    "units_target",
+    "auto_attack_enabled",
+    "auto_attack_settings",
+    "auto_rob_enabled",
+    "auto_rob_settings",
+]
+BOT_STATS = {
+    "ticks": 0,
+    "bots": 0,
+    "patched": 0,
+    "last_duration": None,
+}
+
+
+class _ScalarOps:
+    """The numpy functions used by _decide, for a single kingdom without numpy"""
+
+    @staticmethod
+    def asarray(values):
+        return values
+
+    @staticmethod
+    def maximum(value, other):
+        return max(value, other)
+
+    @staticmethod
+    def clip(value, low, high):
+        return min(max(value, low), high)
+
+    @staticmethod
+    def where(condition, if_true, if_false):
+        return if_true if condition else if_false
+
+    @staticmethod
+    def round(value, decimals):
+        return round(value, decimals)
+
+
+def _decide(xp, funcs, features):
+    """
+    Bot settings from kingdom features, elementwise
+
+    Works on numpy arrays of every bot kingdom at once (xp=numpy with the array
+    formulas uas.GAME_FUNCS_NP) or on the scalars of one kingdom (xp=_ScalarOps
+    with uas.GAME_FUNCS).
+    """
+    personality = features["personality"]
+    stars = xp.maximum(features["stars"], 1)
+    unbuilt = xp.clip(1 - features["structures_total"] / stars, 0, 1)
+
+    structures_pct = xp.round(xp.clip(unbuilt * 2, 0.1, 0.5), 3)
+    settle_pct = xp.where(unbuilt > 0.2, 0.1, 0.3)
+    # Once the population caps the engineers, their share goes to military as well
+    engineers_capped = features["engineers"] >= funcs["BASE_MAX_ENGINEERS"](features["population"])
+    military_share = xp.where(engineers_capped, 1.0, xp.asarray(BOT_MILITARY_SHARE)[personality])
+    military_pct = xp.round((1 - structures_pct - settle_pct) * military_share, 3)
+    engineers_pct = xp.round(1 - structures_pct - settle_pct - military_pct, 3)
+
+    # Keep room in the hangars for the units the bot is building towards
+    hangars_share = xp.round(xp.clip(
+        1.2 * features["hangar_units"] / (stars * uas.GAME_CONFIG["BASE_HANGAR_CAPACITY"]),
+        0.1,
+        0.4,
+    ), 3)
+
+    auto_attack_pct = xp.asarray(BOT_AUTO_ATTACK_PCT)[personality]
+    auto_attack = (auto_attack_pct > 0) & (features["generals_available"] > 0) & (features["offense_units"] > 0)
+    auto_rob = (features["spy_attempts"] > BOT_ROB_KEEP_SPY_ATTEMPTS) & (features["drones"] > 0)
+    return {
+        "settle_pct": settle_pct,
+        "structures_pct": structures_pct,
+        "military_pct": military_pct,
+        "engineers_pct": engineers_pct,
+        "hangars_share": hangars_share,
+        "auto_attack": auto_attack,
+        "auto_attack_pct": auto_attack_pct,
+        "auto_rob": auto_rob,
+    }
+
+
+def _get_features(kd_info):
+    return {
+        "personality": int(kd_info["kdId"]) % len(BOT_PERSONALITIES),
+        "stars": kd_info["stars"],
+        "population": int(kd_info["population"]),
+        "engineers": kd_info["units"].get("engineers", 0),
+        "structures_total": sum(kd_info["structures"].values()),
+        "hangar_units": sum(
+            uas.UNITS[key_unit].get("hangar_capacity", 0) * value_unit
+            for key_unit, value_unit in kd_info["units"].items()
+            if key_unit in uas.UNITS
+        ),
+        "offense_units": sum(
+            value_unit
+            for key_unit, value_unit in kd_info["units"].items()
+            if uas.UNITS.get(key_unit, {}).get("offense", 0) > 0
+        ),
+        "generals_available": kd_info["generals_available"],
+        "spy_attempts": kd_info["spy_attempts"],
+        "drones": kd_info["drones"],
+    }
+
+
+def _decide_all(kds_info):
+    """Decisions of every bot kingdom, as one dict of python scalars per kingdom"""
+    features = [_get_features(kd_info) for kd_info in kds_info]
+    if np is None:
+        return [_decide(_ScalarOps, uas.GAME_FUNCS, kd_features) for kd_features in features]
+
+    arrays = {
+        key: np.asarray([kd_features[key] for kd_features in features])
+        for key in features[0]
+    }
+    decisions = _decide(np, uas.GAME_FUNCS_NP, arrays)
+    return [
+        {key: np.broadcast_to(values, len(features))[i].item() for key, values in decisions.items()}
+        for i in range(len(features))
+    ]
+
+
+def _get_structures_target(personality_name, hangars_share):
+    other_structures = [
+        key_structure
+        for key_structure in uas.STRUCTURES
+        if key_structure not in ("homes", "hangars")
+    ]
+    other_share = round((1 - BOT_HOMES_SHARE - hangars_share) / len(other_structures), 3)
+    structures_target = {key_structure: other_share for key_structure in other_structures}
+    structures_target["homes"] = BOT_HOMES_SHARE
+    structures_target["hangars"] = hangars_share
+    return structures_target
+
+
+def _get_bot_payload(kd_info, decision, time_update):
+    """Settings that changed for one bot kingdom, as a kingdom patch"""
+    personality_name = BOT_PERSONALITIES[int(kd_info["kdId"]) % len(BOT_PERSONALITIES)]
+    settings = {
+        "auto_spending_enabled": True,
+        "auto_spending": {
+            "settle": decision["settle_pct"],
+            "structures": decision["structures_pct"],
+            "military": decision["military_pct"],
+            "engineers": decision["engineers_pct"],
+        },
+        "structures_target": _get_structures_target(personality_name, decision["hangars_share"]),
+        "units_target": BOT_UNITS_TARGET[personality_name],
+        "auto_attack_enabled": bool(decision["auto_attack"]),
+        "auto_attack_settings": {
+            "pure": decision["auto_attack_pct"],
+            "flex": decision["auto_attack_pct"],
+        },
+        "auto_rob_enabled": bool(decision["auto_rob"]),
+        "auto_rob_settings": {
+            "drones": BOT_ROB_DRONES_PCT,
+            "shielded": False,
+            "keep": BOT_ROB_KEEP_SPY_ATTEMPTS,
+        },
+    }
+    payload = {
+        key: value
+        for key, value in settings.items()
+        if kd_info.get(key) != value
+    }
+    if kd_info["next_resolve"]["auto_spending"] == uas.DATE_SENTINEL:
+        payload["next_resolve"] = {
+            **kd_info["next_resolve"],
+            "auto_spending": (
+                time_update
+                + datetime.timedelta(seconds=uas.GAME_CONFIG["BASE_EPOCH_SECONDS"] * uas.GAME_CONFIG["BASE_AUTO_SPENDING_TIME_MULTIPLIER"])
+            ).isoformat(),
+        }
+    return payload
+
+
+def _get_bot_kd_ids():
+    query = db.session.query(User.kd_id).filter(
+        User.roles.contains(BOT_ROLE),
+        User.kd_created == True,
+        User.kd_death_date == None,
+    )
+    return [kd_id for kd_id, in query.all() if kd_id]
+
+
+def _patch_kds_info(kd_payloads):
+    if not kd_payloads:
+        return
+    REQUESTS_SESSION.patch(
+        os.environ['AZURE_FUNCTION_ENDPOINT'] + f'/kingdoms/bulk',
+        headers={'x-functions-key': os.environ['AZURE_FUNCTIONS_HOST_KEY']},
+        data=json.dumps({"kingdoms": kd_payloads}),
+    )
+
+
+def _resolve_bots(time_update):
+    """
+    Decide the auto spending, structure and unit targets, and auto primitives attacks
+    and robs of every bot kingdom in one pass
+
+    One bulk read and at most one bulk write per tick; the existing auto spending,
+    auto attack and auto rob resolves then act on the settings in the kingdom loop.
+    """
+    start_counter = time.perf_counter()
+    kd_ids = _get_bot_kd_ids()
+    if not kd_ids:
+        return
+    kds_info = [
+        kd_info
+        for kd_info in uag._get_kds_info(kd_ids, BOT_KINGDOM_FIELDS).values()
+        if kd_info["status"].lower() != "dead"
+    ]
+    if not kds_info:
+        return
+
+    decisions = _decide_all(kds_info)
+    kd_payloads = {}
+    for kd_info, decision in zip(kds_info, decisions):
+        payload = _get_bot_payload(kd_info, decision, time_update)
+        if payload:
+            kd_payloads[kd_info["kdId"]] = payload
+    _patch_kds_info(kd_payloads)
+
+    BOT_STATS["ticks"] += 1
+    BOT_STATS["bots"] = len(kds_info)
+    BOT_STATS["patched"] = len(kd_payloads)
+    BOT_STATS["last_duration"] = time.perf_counter() - start_counter
+
+
+def _get_bot_choices():
+    # Kingdom creator choices with enough hangars for the starting units
+    starting_points = uas.KINGDOM_CREATOR_STARTING_POINTS
+    stars = uas.INITIAL_KINGDOM_STATE["kingdom"]["stars"]
+    attack = starting_points // (4 * uas.KINGDOM_CREATOR_POINTS["attack"])
+    defense = starting_points // (4 * uas.KINGDOM_CREATOR_POINTS["defense"])
+    drones = (
+        starting_points
+        - attack * uas.KINGDOM_CREATOR_POINTS["attack"]
+        - defense * uas.KINGDOM_CREATOR_POINTS["defense"]
+    ) // uas.KINGDOM_CREATOR_POINTS["drones"]
+    hangars = math.ceil(1.5 * (attack + defense) / uas.GAME_CONFIG["BASE_HANGAR_CAPACITY"])
+    homes = (stars - hangars) // 2
+    other_structures = [key_structure for key_structure in uas.STRUCTURES if key_structure not in ("homes", "hangars")]
+    structures = {key_structure: (stars - hangars - homes) // len(other_structures) for key_structure in other_structures}
+    structures["hangars"] = hangars
+    structures["homes"] = stars - sum(structures.values())
+    return {"drones": drones, "attack": attack, "defense": defense}, structures
+
@@ -10,7 +10,7 @@ from flask_sock import Sock, ConnectionClosed
 
 import untitledapp.getters as uag
 import untitledapp.shared as uas
-from untitledapp import app, alive_required, REQUESTS_SESSION, SOCK_HANDLERS
+from untitledapp import app, alive_required, CLOCK, REQUESTS_SESSION
 
 def _make_time_splits(min_time, max_time, num_splits):
     assert num_splits % 2 == 0, "num_splits must be even"
@@ -117,7 +117,7 @@ def recruits():
     state = uag._get_state()
 
     start_time = max(
-        datetime.datetime.now(datetime.timezone.utc),
+        CLOCK.now(),
         datetime.datetime.fromisoformat(state["state"]["game_start"]).astimezone(datetime.timezone.utc)
     )
     units = uag._calc_units(start_time, current_units, generals_units, mobis_units)
@@ -230,7 +230,7 @@ def train_mobis():
     state = uag._get_state()
 
     start_time = max(
-        datetime.datetime.now(datetime.timezone.utc),
+        CLOCK.now(),
         datetime.datetime.fromisoformat(state["state"]["game_start"]).astimezone(datetime.timezone.utc)
     )
 
@@ -476,7 +476,7 @@ def build_structures():
     state = uag._get_state()
 
     start_time = max(
-        datetime.datetime.now(datetime.timezone.utc),
+        CLOCK.now(),
         datetime.datetime.fromisoformat(state["state"]["game_start"]).astimezone(datetime.timezone.utc)
     )
     structures = uag._calc_structures(start_time, current_structures, building_structures)
@@ -689,7 +689,7 @@ def settle():
     state = uag._get_state()
 
     start_time = max(
-        datetime.datetime.now(datetime.timezone.utc),
+        CLOCK.now(),
         datetime.datetime.fromisoformat(state["state"]["game_start"]).astimezone(datetime.timezone.utc)
     )
     new_settles, min_settle_time = _get_new_settles(kd_info_parse, settle_input, start_time)
@@ -794,7 +794,7 @@ def build_missiles():
     state = uag._get_state()
 
     start_time = max(
-        datetime.datetime.now(datetime.timezone.utc),
+        CLOCK.now(),
         datetime.datetime.fromisoformat(state["state"]["game_start"]).astimezone(datetime.timezone.utc)
     )
 
@@ -891,7 +891,7 @@ def train_engineers():
     state = uag._get_state()
 
     start_time = max(
-        datetime.datetime.now(datetime.timezone.utc),
+        CLOCK.now(),
         datetime.datetime.fromisoformat(state["state"]["game_start"]).astimezone(datetime.timezone.utc)
     )
     new_engineers, min_engineers_time = _get_new_engineers(engineers_input, start_time)
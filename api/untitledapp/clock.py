@@ -0,0 +1,54 @@
+import datetime
+import threading
+import time
+
+
+class GameClock:
+    """
+    Source of the current game time for the game logic
+
+    Runs at `speed` times wall-clock from the moment it is (re)anchored, so the
+    default speed of 1 tracks datetime.now. set_time() and advance() pin the clock
+    at an exact time for headless simulation until resume() lets it run again.
+    """
+
+    def __init__(self, speed=1.0):
+        self._lock = threading.Lock()
+        self.speed = speed
+        self._frozen = None
+        self._anchor(datetime.datetime.now(datetime.timezone.utc))
+
+    def _anchor(self, game_time):
+        self._origin_game = game_time
+        self._origin_real = time.monotonic()
+
+    def now(self):
+        with self._lock:
+            if self._frozen is not None:
+                return self._frozen
+            elapsed = (time.monotonic() - self._origin_real) * self.speed
+            return self._origin_game + datetime.timedelta(seconds=elapsed)
+
+    def set_time(self, game_time):
+        with self._lock:
+            self._frozen = game_time.astimezone(datetime.timezone.utc)
+
+    def advance(self, seconds):
+        game_time = self.now() + datetime.timedelta(seconds=seconds)
+        self.set_time(game_time)
+        return game_time
+
+    def resume(self, speed=None):
+        game_time = self.now()
+        with self._lock:
+            if speed is not None:
+                self.speed = speed
+            self._frozen = None
+            self._anchor(game_time)
+
+    def reset(self):
+        """Back to wall-clock time at speed 1"""
+        with self._lock:
+            self.speed = 1.0
+            self._frozen = None
+            self._anchor(datetime.datetime.now(datetime.timezone.utc))
@@ -1,17 +1,16 @@
 import datetime
+import itertools
 import json
 import math
 import os
-import random
 import uuid
 
 import flask
 import flask_praetorian
-from flask_sock import Sock, ConnectionClosed
 
 import untitledapp.getters as uag
 import untitledapp.shared as uas
-from untitledapp import app, alive_required, start_required, _mark_kingdom_death, _add_notifs, REQUESTS_SESSION, SOCK_HANDLERS
+from untitledapp import app, alive_required, start_required, _mark_kingdom_death, _add_notifs, _publish_event, CLOCK, REQUESTS_SESSION
 
 @app.route('/api/revealrandomgalaxy', methods=['GET'])
 @flask_praetorian.auth_required
@@ -54,9 +53,9 @@ def reveal_random_galaxy():
     if not len(potential_galaxies):
         return (flask.jsonify({"message": 'There are no more galaxies to reveal'}), 400)
 
-    galaxy_to_reveal = random.choice(list(potential_galaxies))
+    galaxy_to_reveal = uas.RNG.get().choice(list(potential_galaxies))
 
-    time = (datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=uas.GAME_CONFIG["BASE_EPOCH_SECONDS"] * uas.GAME_CONFIG["BASE_REVEAL_DURATION_MULTIPLIER"])).isoformat()
+    time = (CLOCK.now() + datetime.timedelta(seconds=uas.GAME_CONFIG["BASE_EPOCH_SECONDS"] * uas.GAME_CONFIG["BASE_REVEAL_DURATION_MULTIPLIER"])).isoformat()
     payload = {
         "new_galaxies": {
             galaxy_to_reveal: time
@@ -211,11 +210,7 @@ def calculate_attack(target_kd):
     )
     
     kd_info_parse = json.loads(kd_info.text)
-    current_bonuses = {
-        project: project_dict.get("max_bonus", 0) * min(kd_info_parse["projects_points"][project] / kd_info_parse["projects_max_points"][project], 1.0)
-        for project, project_dict in uas.PROJECTS.items()
-        if "max_bonus" in project_dict
-    }
+    current_bonuses = uag._get_current_bonuses(kd_info_parse)
 
     revealed = uag._get_revealed(kd_id)
     shared = uag._get_shared(kd_id)["shared"]
@@ -301,7 +296,7 @@ def calculate_attack(target_kd):
         uas.GAME_CONFIG["BASE_DEFENDER_UNIT_LOSS_RATE"] * attack_ratio,
         war=war,
     )
-    time_now = datetime.datetime.now(datetime.timezone.utc)
+    time_now = CLOCK.now()
     galaxies_inverted, _ = uag._get_galaxies_inverted()
     galaxy_policies, _ = uag._get_galaxy_politics(kd_id, galaxies_inverted[kd_id])
     is_warlike = "Warlike" in galaxy_policies["active_policies"]
@@ -326,39 +321,13 @@ def calculate_attack(target_kd):
         else:
             cut = 0
             sharer = None
-        spoils_rate = uas.GAME_CONFIG["BASE_KINGDOM_LOSS_RATE"] * (
-            1
-            + (int(kd_info_parse["race"] == "Xo") * uas.GAME_CONFIG["XO_ATTACK_GAINS_INCREASE"])
-            + (int(war) * uas.GAME_CONFIG["WAR_GAINS_INCREASE"])
-        )
-        min_stars_gain = uas.GAME_CONFIG["BASE_ATTACK_MIN_STARS_GAIN"] * (
-            1
-            + (int(kd_info_parse["race"] == "Xo") * uas.GAME_CONFIG["XO_ATTACK_GAINS_INCREASE"])
-            + (int(war) * uas.GAME_CONFIG["WAR_GAINS_INCREASE"])
-        )
-        spoils_values = {
-            key_spoil: max(math.floor(value_spoil * spoils_rate * (1 - cut)), 0)
-            for key_spoil, value_spoil in max_target_kd_info.items()
-            if key_spoil in {"stars", "population", "money", "fuel"}
-        }
-        try:
-            spoils_values["stars"] = max(spoils_values["stars"], math.floor(min_stars_gain * (1 - cut)))
-        except KeyError:
-            pass
+        spoils_values = _calc_expected_spoils(max_target_kd_info, kd_info_parse["race"], war, 1 - cut)
         if spoils_values:
             message += 'You will gain '
             message += ', '.join([f"{value} {key}" for key, value in spoils_values.items()])
             message += '. \n'
             if sharer:
-                sharer_spoils_values = {
-                    key_spoil: max(math.floor(value_spoil * spoils_rate * cut), 0)
-                    for key_spoil, value_spoil in max_target_kd_info.items()
-                    if key_spoil in {"stars", "population", "money", "fuel"}
-                }
-                try:
-                    sharer_spoils_values["stars"] = max(sharer_spoils_values["stars"], math.floor(min_stars_gain * cut))
-                except KeyError:
-                    pass
+                sharer_spoils_values = _calc_expected_spoils(max_target_kd_info, kd_info_parse["race"], war, cut)
                 kingdoms = uag._get_kingdoms()
                 sharer_name = kingdoms[sharer]
                 message += f'Your galaxymate {sharer_name} will gain '
@@ -403,8 +372,142 @@ def _validate_autofill_request(req, kd_info_parse):
     if generals > kd_info_parse["generals_available"]:
         return False, "You do not have that many generals"
     
-    return True, ""
+    if req.get("objective", "priority") not in uas.AUTOFILL_OBJECTIVES:
+        return False, "Please choose a valid autofill objective"
     
+    return True, ""
+
+def _calc_autofill_cost(
+    objective,
+    attacker_units,
+    attacker_losses,
+):
+    if objective == "units":
+        return sum(attacker_losses.values())
+    if objective == "networth":
+        return sum([
+            uas.GAME_CONFIG["NETWORTH_VALUES"][key_unit] * value_unit
+            for key_unit, value_unit in attacker_losses.items()
+        ])
+    if objective == "defense":
+        return sum([
+            uas.UNITS[key_unit]["defense"] * value_unit
+            for key_unit, value_unit in attacker_units.items()
+        ])
+    return 0
+
+def _get_autofill_search_counts(lower, upper, step):
+    counts = set(range(lower, upper + 1, step))
+    counts.add(upper)
+    return sorted(counts)
+
+def _solve_autofill_units(
+    available_units,
+    required_offense,
+    offense_multiplier,
+    objective,
+    war=False,
+    xo=False,
+):
+    """Find the unit mix clearing required_offense at the lowest objective cost
+
+    The last unit type is sized exactly from the remaining offense; the others
+    are searched on a grid that is narrowed around the best mix until the step
+    reaches a single unit, which keeps the search bounded for large armies.
+    """
+    unit_keys = [
+        key_unit
+        for key_unit in uas.AUTOFILL_PRIORITY
+        if available_units.get(key_unit, 0) > 0
+    ]
+    all_units = {
+        key_unit: available_units.get(key_unit, 0) if key_unit in unit_keys else 0
+        for key_unit in uas.AUTOFILL_PRIORITY
+    }
+    if not unit_keys or offense_multiplier <= 0:
+        return all_units
+
+    required_raw = math.ceil(required_offense / offense_multiplier)
+    while math.floor(required_raw * offense_multiplier) < required_offense:
+        required_raw += 1
+    while required_raw > 0 and math.floor((required_raw - 1) * offense_multiplier) >= required_offense:
+        required_raw -= 1
+
+    available_raw = sum([
+        uas.UNITS[key_unit]["offense"] * value_unit
+        for key_unit, value_unit in all_units.items()
+    ])
+    if available_raw < required_raw:
+        return all_units
+
+    last_key = min(
+        unit_keys,
+        key=lambda key_unit: _calc_autofill_cost(
+            objective,
+            {key_unit: 1},
+            {key_unit: uas.GAME_CONFIG["BASE_ATTACKER_UNIT_LOSS_RATE"]},
+        ) / uas.UNITS[key_unit]["offense"],
+    )
+    search_keys = [key_unit for key_unit in unit_keys if key_unit != last_key]
+    search_upper = {
+        key_unit: min(
+            all_units[key_unit],
+            math.ceil(required_raw / uas.UNITS[key_unit]["offense"]),
+        )
+        for key_unit in search_keys
+    }
+
+    def _evaluate(search_counts):
+        attacker_units = {key_unit: 0 for key_unit in uas.AUTOFILL_PRIORITY}
+        attacker_units.update(search_counts)
+        remaining_raw = required_raw - sum([
+            uas.UNITS[key_unit]["offense"] * value_unit
+            for key_unit, value_unit in search_counts.items()
+        ])
+        attacker_units[last_key] = max(math.ceil(remaining_raw / uas.UNITS[last_key]["offense"]), 0)
+        if attacker_units[last_key] > all_units[last_key]:
+            return None, attacker_units
+        attacker_losses = _calc_losses(
+            attacker_units,
+            uas.GAME_CONFIG["BASE_ATTACKER_UNIT_LOSS_RATE"],
+            war=war,
+            xo=xo,
+        )
+        score = (
+            _calc_autofill_cost(objective, attacker_units, attacker_losses),
+            sum(attacker_units.values()),
+            sum([
+                uas.UNITS[key_unit]["cost"] * value_unit
+                for key_unit, value_unit in attacker_units.items()
+            ]),
+        )
+        return score, attacker_units
+
+    best_score = None
+    best_units = all_units
+    bounds = {key_unit: (0, search_upper[key_unit]) for key_unit in search_keys}
+    step = max([math.ceil(upper / uas.AUTOFILL_SEARCH_STEPS) for upper in search_upper.values()] + [1])
+    while True:
+        grids = [
+            _get_autofill_search_counts(bounds[key_unit][0], bounds[key_unit][1], step)
+            for key_unit in search_keys
+        ]
+        for counts in itertools.product(*grids):
+            score, attacker_units = _evaluate(dict(zip(search_keys, counts)))
+            if score is not None and (best_score is None or score < best_score):
+                best_score = score
+                best_units = attacker_units
+        if step == 1:
+            break
+        bounds = {
+            key_unit: (
+                max(best_units[key_unit] - step, 0),
+                min(best_units[key_unit] + step, search_upper[key_unit]),
+            )
+            for key_unit in search_keys
+        }
+        step = max(math.ceil(step / uas.AUTOFILL_SEARCH_STEPS), 1)
+    return best_units
 
 def _autofill_attack(req, kd_id, target_kd):
     defender_raw_values = req["defenderValues"]
@@ -415,11 +518,7 @@ def _autofill_attack(req, kd_id, target_kd):
     )
     
     kd_info_parse = json.loads(kd_info.text)
-    current_bonuses = {
-        project: project_dict.get("max_bonus", 0) * min(kd_info_parse["projects_points"][project] / kd_info_parse["projects_max_points"][project], 1.0)
-        for project, project_dict in uas.PROJECTS.items()
-        if "max_bonus" in project_dict
-    }
+    current_bonuses = uag._get_current_bonuses(kd_info_parse)
 
     revealed = uag._get_revealed(kd_id)
     shared = uag._get_shared(kd_id)["shared"]
@@ -481,34 +580,55 @@ def _autofill_attack(req, kd_id, target_kd):
     remaining_defense = max(defense_adjusted, 1)
     generals = int(req.get("generals", 1))
     attacker_fuelless = kd_info_parse["fuel"] <= 0
-    for key_unit in uas.AUTOFILL_PRIORITY:
-        if remaining_defense == 0:
-            attacker_units[key_unit] = 0
-        available_units = kd_info_parse["units"].get(key_unit, 0)
-        if available_units > 0:
-            current_unit_attack = uag._calc_max_offense(
-                {
-                    key_unit: available_units,
-                },
-                military_bonus=float(current_bonuses['military_bonus'] or 0), 
-                other_bonuses=0,
-                generals=generals,
-                fuelless=attacker_fuelless,
-                lumina=kd_info_parse["race"] == "Lumina",
-                denounced=defender_empire == empires_info["empires"].get(attacker_empire, {}).get("denounced", ""),
-                war=war,
-                surprise_war_penalty=surprise_war_penalty,
-            )
-            if current_unit_attack > remaining_defense:
-                required_ratio = remaining_defense / current_unit_attack
-                units_fill = math.ceil(required_ratio * available_units)
-                attacker_units[key_unit] = units_fill
-                remaining_defense = 0
+    objective = req.get("objective", "priority")
+    if objective != "priority":
+        offense_multiplier = uag._calc_offense_multiplier(
+            military_bonus=float(current_bonuses['military_bonus'] or 0), 
+            other_bonuses=0,
+            generals=generals,
+            fuelless=attacker_fuelless,
+            lumina=kd_info_parse["race"] == "Lumina",
+            denounced=defender_empire == empires_info["empires"].get(attacker_empire, {}).get("denounced", ""),
+            war=war,
+            surprise_war_penalty=surprise_war_penalty,
+        )
+        attacker_units = _solve_autofill_units(
+            kd_info_parse["units"],
+            max(defense_adjusted, defense + 1),
+            offense_multiplier,
+            objective,
+            war=war,
+            xo=kd_info_parse["race"] == "Xo",
+        )
+    else:
+        for key_unit in uas.AUTOFILL_PRIORITY:
+            if remaining_defense == 0:
+                attacker_units[key_unit] = 0
+            available_units = kd_info_parse["units"].get(key_unit, 0)
+            if available_units > 0:
+                current_unit_attack = uag._calc_max_offense(
+                    {
+                        key_unit: available_units,
+                    },
+                    military_bonus=float(current_bonuses['military_bonus'] or 0), 
+                    other_bonuses=0,
+                    generals=generals,
+                    fuelless=attacker_fuelless,
+                    lumina=kd_info_parse["race"] == "Lumina",
+                    denounced=defender_empire == empires_info["empires"].get(attacker_empire, {}).get("denounced", ""),
+                    war=war,
+                    surprise_war_penalty=surprise_war_penalty,
+                )
+                if current_unit_attack > remaining_defense:
+                    required_ratio = remaining_defense / current_unit_attack
+                    units_fill = math.ceil(required_ratio * available_units)
+                    attacker_units[key_unit] = units_fill
+                    remaining_defense = 0
+                else:
+                    attacker_units[key_unit] = available_units
+                    remaining_defense = remaining_defense - current_unit_attack
             else:
-                attacker_units[key_unit] = available_units
-                remaining_defense = remaining_defense - current_unit_attack
-        else:
-            attacker_units[key_unit] = 0
+                attacker_units[key_unit] = 0
 
     attack = uag._calc_max_offense(
         attacker_units,
@@ -536,7 +656,7 @@ def _autofill_attack(req, kd_id, target_kd):
         uas.GAME_CONFIG["BASE_DEFENDER_UNIT_LOSS_RATE"] * attack_ratio,
         war=war,
     )
-    time_now = datetime.datetime.now(datetime.timezone.utc)
+    time_now = CLOCK.now()
     galaxies_inverted, _ = uag._get_galaxies_inverted()
     galaxy_policies, _ = uag._get_galaxy_politics(kd_id, galaxies_inverted[kd_id])
     is_warlike = "Warlike" in galaxy_policies["active_policies"]
@@ -561,39 +681,13 @@ def _autofill_attack(req, kd_id, target_kd):
         else:
             cut = 0
             sharer = None
-        spoils_rate = uas.GAME_CONFIG["BASE_KINGDOM_LOSS_RATE"] * (
-            1
-            + (int(kd_info_parse["race"] == "Xo") * uas.GAME_CONFIG["XO_ATTACK_GAINS_INCREASE"])
-            + (int(war) * uas.GAME_CONFIG["WAR_GAINS_INCREASE"])
-        )
-        min_stars_gain = uas.GAME_CONFIG["BASE_ATTACK_MIN_STARS_GAIN"] * (
-            1
-            + (int(kd_info_parse["race"] == "Xo") * uas.GAME_CONFIG["XO_ATTACK_GAINS_INCREASE"])
-            + (int(war) * uas.GAME_CONFIG["WAR_GAINS_INCREASE"])
-        )
-        spoils_values = {
-            key_spoil: max(math.floor(value_spoil * spoils_rate * (1 - cut)), 0)
-            for key_spoil, value_spoil in max_target_kd_info.items()
-            if key_spoil in {"stars", "population", "money", "fuel"}
-        }
-        try:
-            spoils_values["stars"] = max(spoils_values["stars"], math.floor(min_stars_gain * (1 - cut)))
-        except KeyError:
-            pass
+        spoils_values = _calc_expected_spoils(max_target_kd_info, kd_info_parse["race"], war, 1 - cut)
         if spoils_values:
             message += 'You will gain '
             message += ', '.join([f"{value} {key}" for key, value in spoils_values.items()])
             message += '. \n'
             if sharer:
-                sharer_spoils_values = {
-                    key_spoil: max(math.floor(value_spoil * spoils_rate * cut), 0)
-                    for key_spoil, value_spoil in max_target_kd_info.items()
-                    if key_spoil in {"stars", "population", "money", "fuel"}
-                }
-                try:
-                    sharer_spoils_values["stars"] = max(sharer_spoils_values["stars"], math.floor(min_stars_gain * cut))
-                except KeyError:
-                    pass
+                sharer_spoils_values = _calc_expected_spoils(max_target_kd_info, kd_info_parse["race"], war, cut)
                 kingdoms = uag._get_kingdoms()
                 sharer_name = kingdoms[sharer]
                 message += f'Your galaxymate {sharer_name} will gain '
@@ -634,8 +728,201 @@ def autofill_attack(target_kd):
         kd_id,
         target_kd,
     )
+    return (flask.jsonify(payload), status_code)
+
+def _validate_targets_request(req, attacker_raw_values, kd_info_parse):
+    valid_attack_request, attack_request_message = _validate_attack_request(
+        attacker_raw_values,
+        kd_info_parse,
+        calculate=True,
+    )
+    if not valid_attack_request:
+        return False, attack_request_message
+
+    # Same default as the attack calculator
+    generals = int(attacker_raw_values.get("generals", 0) or 0)
+    if generals < 0 or generals > 4:
+        return False, "Generals must be between 0 and 4"
+
+    if float(req.get("buffer", 0) or 0) < 0:
+        return False, "Buffer must be greater than 0"
     
-    payload, status_code = _autofill_attack(req, kd_id, target_kd)
+    if req.get("objective", "units") not in uas.AUTOFILL_OBJECTIVES:
+        return False, "Please choose a valid autofill objective"
+
+    return True, ""
+
+def _calc_expected_spoils(max_target_kd_info, attacker_race, war, share):
+    """Spoils of a successful attack on the target, for the given share of them (1 - cut, or the cut)"""
+    gains_multiplier = (
+        1
+        + (int(attacker_race == "Xo") * uas.GAME_CONFIG["XO_ATTACK_GAINS_INCREASE"])
+        + (int(war) * uas.GAME_CONFIG["WAR_GAINS_INCREASE"])
+    )
+    spoils_rate = uas.GAME_CONFIG["BASE_KINGDOM_LOSS_RATE"] * gains_multiplier
+    min_stars_gain = uas.GAME_CONFIG["BASE_ATTACK_MIN_STARS_GAIN"] * gains_multiplier
+    spoils_values = {
+        key_spoil: max(math.floor(value_spoil * spoils_rate * share), 0)
+        for key_spoil, value_spoil in max_target_kd_info.items()
+        if key_spoil in {"stars", "population", "money", "fuel"}
+    }
+    if "stars" in spoils_values:
+        spoils_values["stars"] = max(spoils_values["stars"], math.floor(min_stars_gain * share))
+    return spoils_values
+
+def _find_targets(req, kd_id):
+    """Evaluate every kingdom with revealed military as an attack target in one pass"""
+    kd_info_parse = uag._get_kd_info(kd_id)
+    current_bonuses = uag._get_current_bonuses(kd_info_parse)
+
+    attacker_raw_values = req.get("attackerValues") or {}
+    valid_request, request_message = _validate_targets_request(req, attacker_raw_values, kd_info_parse)
+    if not valid_request:
+        return {"message": request_message}, 400
+
+    attacker_units = {
+        key: int(value)
+        for key, value in attacker_raw_values.items()
+        if (key in uas.UNITS and value != "")
+    }
+    if not any(attacker_units.values()):
+        attacker_units = {
+            key_unit: kd_info_parse["units"].get(key_unit, 0)
+            for key_unit in uas.AUTOFILL_PRIORITY
+        }
+    generals = int(attacker_raw_values.get("generals", 0) or 0)
+    buffer = float(req.get("buffer", 0) or 0)
+    objective = req.get("objective", "units")
+
+    revealed = uag._get_revealed(kd_id)
+    shared = uag._get_shared(kd_id)["shared"]
+    galaxies_inverted, _ = uag._get_galaxies_inverted()
+    empires_inverted, empires_info, _, _ = uag._get_empires_inverted()
+    target_kds = [
+        other_kd_id
+        for other_kd_id, revealed_categories in revealed["revealed"].items()
+        if "military" in revealed_categories
+        and other_kd_id != kd_id
+        and galaxies_inverted.get(other_kd_id) != galaxies_inverted[kd_id]
+    ]
+    max_kds_info = uag._get_max_kingdoms(
+        kd_id,
+        target_kds,
+        revealed_info=revealed,
+        galaxies_inverted=galaxies_inverted,
+    )
+
+    attacker_empire = empires_inverted.get(kd_id)
+    attacker_fuelless = kd_info_parse["fuel"] <= 0
+    targets = []
+    for target_kd, max_target_kd_info in max_kds_info.items():
+        if max_target_kd_info.get("status", "").lower() == "dead":
+            continue
+
+        defender_empire = empires_inverted.get(target_kd)
+        war = defender_empire in empires_info["empires"].get(attacker_empire, {}).get("war", [])
+        peace = defender_empire in empires_info["empires"].get(attacker_empire, {}).get("peace", {})
+        surprise_war_penalty = empires_info["empires"].get(defender_empire, {}).get("surprise_war_penalty", False)
+
+        defender_units = {
+            key: value
+            for key, value in max_target_kd_info.get("units", {}).items()
+            if uas.UNITS[key].get("defense", 0) > 0
+        }
+        estimated = "current_bonuses" not in max_target_kd_info or "shields" not in max_target_kd_info
+        # Without the intel, _calc_max_defense assumes the highest military bonus and shields
+        defender_bonuses = {}
+        if "current_bonuses" in max_target_kd_info:
+            defender_bonuses["military_bonus"] = max_target_kd_info["current_bonuses"]["military_bonus"]
+        if "shields" in max_target_kd_info:
+            defender_bonuses["shields"] = max_target_kd_info["shields"]["military"]
+        if "fuel" in max_target_kd_info:
+            target_fuelless = max_target_kd_info["fuel"] <= 0
+        else:
+            target_fuelless = False
+
+        defense = uag._calc_max_defense(
+            defender_units,
+            other_bonuses=0,
+            fuelless=target_fuelless,
+            gaian=kd_info_parse["race"] == "Gaian",
+            peace=peace,
+            **defender_bonuses,
+        )
+        defense_adjusted = math.floor(defense * (1 + (buffer / 100)))
+        offense_multiplier = uag._calc_offense_multiplier(
+            military_bonus=float(current_bonuses['military_bonus'] or 0), 
+            other_bonuses=0,
+            generals=generals,
+            fuelless=attacker_fuelless,
+            lumina=kd_info_parse["race"] == "Lumina",
+            denounced=defender_empire == empires_info["empires"].get(attacker_empire, {}).get("denounced", ""),
+            war=war,
+            surprise_war_penalty=surprise_war_penalty,
+        )
+        attack = math.floor(
+            sum([
+                uas.UNITS[key_unit]["offense"] * value_unit
+                for key_unit, value_unit in attacker_units.items()
+            ])
+            * offense_multiplier
+        )
+        required_units = _solve_autofill_units(
+            attacker_units,
+            max(defense_adjusted, defense + 1),
+            offense_multiplier,
+            objective,
+            war=war,
+            xo=kd_info_parse["race"] == "Xo",
+        )
+        required_offense = math.floor(
+            sum([
+                uas.UNITS[key_unit]["offense"] * value_unit
+                for key_unit, value_unit in required_units.items()
+            ])
+            * offense_multiplier
+        )
+        attacker_losses = _calc_losses(
+            required_units,
+            uas.GAME_CONFIG["BASE_ATTACKER_UNIT_LOSS_RATE"],
+            war=war,
+            xo=kd_info_parse["race"] == "Xo",
+        )
+        cut = shared[target_kd]["cut"] if target_kd in shared else 0
+        spoils_values = _calc_expected_spoils(max_target_kd_info, kd_info_parse["race"], war, 1 - cut)
+        targets.append({
+            "kd_id": target_kd,
+            "name": max_target_kd_info.get("name"),
+            "defender_defense": defense,
+            "attacker_offense": attack,
+            "success": attack > defense,
+            "required_units": required_units,
+            "required_offense": required_offense,
+            "attacker_losses": attacker_losses,
+            "spoils": spoils_values,
+            "estimated": estimated,
+            "war": war,
+        })
+
+    targets = sorted(
+        targets,
+        key=lambda target: (
+            not target["success"],
+            -target["spoils"].get("stars", 0),
+            sum(target["attacker_losses"].values()),
+        )
+    )
+    return {"targets": targets}, 200
+
+@app.route('/api/targets', methods=['POST'])
+@flask_praetorian.auth_required
+@alive_required
+# @flask_praetorian.roles_required('verified')
+def find_targets():
+    req = flask.request.get_json(force=True)
+    kd_id = flask_praetorian.current_user().kd_id
+
+    payload, status_code = _find_targets(req, kd_id)
     return (flask.jsonify(payload), status_code)
 
 def _attack(req, kd_id, target_kd):
@@ -648,22 +935,14 @@ def _attack(req, kd_id, target_kd):
     )
     
     kd_info_parse = json.loads(kd_info.text)
-    current_bonuses = {
-        project: project_dict.get("max_bonus", 0) * min(kd_info_parse["projects_points"][project] / kd_info_parse["projects_max_points"][project], 1.0)
-        for project, project_dict in uas.PROJECTS.items()
-        if "max_bonus" in project_dict
-    }
+    current_bonuses = uag._get_current_bonuses(kd_info_parse)
 
     shared = uag._get_shared(kd_id)["shared"]
     galaxies_inverted, galaxy_info = uag._get_galaxies_inverted()
     target_kd_info = uag._get_kd_info(target_kd)
     if target_kd_info["status"].lower() == "dead":
         return kd_info_parse, {"message": "You can't attack this kingdom because they are dead!"}, 400
-    target_current_bonuses = {
-        project: project_dict.get("max_bonus", 0) * min(target_kd_info["projects_points"][project] / target_kd_info["projects_max_points"][project], 1.0)
-        for project, project_dict in uas.PROJECTS.items()
-        if "max_bonus" in project_dict
-    }
+    target_current_bonuses = uag._get_current_bonuses(target_kd_info)
 
     empires_inverted, empires_info, _, _ = uag._get_empires_inverted()
     attacker_empire = empires_inverted.get(kd_id)
@@ -726,7 +1005,7 @@ def _attack(req, kd_id, target_kd):
         uas.GAME_CONFIG["BASE_DEFENDER_UNIT_LOSS_RATE"] * attack_ratio,
         war=war,
     )
-    time_now = datetime.datetime.now(datetime.timezone.utc)
+    time_now = CLOCK.now()
     galaxy_policies, _ = uag._get_galaxy_politics(kd_id, galaxies_inverted[kd_id])
     is_warlike = "Warlike" in galaxy_policies["active_policies"]
     n_generals = int(attacker_raw_values["generals"])
@@ -921,17 +1200,13 @@ def _attack(req, kd_id, target_kd):
             headers={'x-functions-key': os.environ['AZURE_FUNCTIONS_HOST_KEY']},
             data=json.dumps(sharer_kd_info),
         )
-        try:
-            ws = SOCK_HANDLERS[sharer]
-            ws.send(json.dumps({
-                "message": f"You have gained {sharer_spoils_values['stars']} from an attack by your galaxymate {kd_info_parse['name']}",
-                "status": "info",
-                "category": "Galaxy",
-                "delay": 15000,
-                "update": [],
-            }))
-        except (KeyError, ConnectionError, StopIteration, ConnectionClosed):
-            pass
+        _publish_event(sharer, {
+            "message": f"You have gained {sharer_spoils_values['stars']} from an attack by your galaxymate {kd_info_parse['name']}",
+            "status": "info",
+            "category": "Galaxy",
+            "delay": 15000,
+            "update": [],
+        })
     
     if target_kd_info["stars"] <= 0:
         target_kd_info["status"] = "Dead"
@@ -946,17 +1221,13 @@ def _attack(req, kd_id, target_kd):
         "from": kd_id,
         "news": defender_message,
     }
-    try:
-        ws = SOCK_HANDLERS[target_kd]
-        ws.send(json.dumps({
-            "message": defender_message,
-            "status": "warning",
-            "category": "Attack",
-            "delay": 60000,
-            "update": ["news", "galaxynews"],
-        }))
-    except (KeyError, ConnectionError, StopIteration, ConnectionClosed):
-        pass
+    _publish_event(target_kd, {
+        "message": defender_message,
+        "status": "warning",
+        "category": "Attack",
+        "delay": 60000,
+        "update": ["news", "galaxynews"],
+    })
     target_news_patch_response = REQUESTS_SESSION.patch(
         os.environ['AZURE_FUNCTION_ENDPOINT'] + f'/kingdom/{target_kd}/news',
         headers={'x-functions-key': os.environ['AZURE_FUNCTIONS_HOST_KEY']},
@@ -1050,17 +1321,13 @@ def _attack(req, kd_id, target_kd):
                     data=json.dumps(kd_revealed_to_patch_payload),
                 )
             if kd_revealed_to != target_kd:
-                try:
-                    ws = SOCK_HANDLERS[kd_revealed_to]
-                    ws.send(json.dumps({
-                        "message": f"Your galaxymate {target_kd_info['name']} was attacked by {kd_info_parse['name']}. Galaxy {attacker_galaxy} will be revealed for {uas.GAME_CONFIG['BASE_EPOCH_SECONDS'] * uas.GAME_CONFIG['BASE_REVEAL_DURATION_MULTIPLIER'] / 3600} hours",
-                        "status": "info",
-                        "category": "Galaxy",
-                        "delay": 15000,
-                        "update": ["galaxynews"],
-                    }))
-                except (KeyError, ConnectionError, StopIteration, ConnectionClosed):
-                    pass
+                _publish_event(kd_revealed_to, {
+                    "message": f"Your galaxymate {target_kd_info['name']} was attacked by {kd_info_parse['name']}. Galaxy {attacker_galaxy} will be revealed for {uas.GAME_CONFIG['BASE_EPOCH_SECONDS'] * uas.GAME_CONFIG['BASE_REVEAL_DURATION_MULTIPLIER'] / 3600} hours",
+                    "status": "info",
+                    "category": "Galaxy",
+                    "delay": 15000,
+                    "update": ["galaxynews"],
+                })
     for defender_galaxy_kd in galaxy_info[defender_galaxy]:
         _add_notifs(defender_galaxy_kd, ["news_galaxy"])
 
@@ -1110,16 +1377,12 @@ def calculate_attack_primitives():
     state = uag._get_state()
     
     start_time = datetime.datetime.fromisoformat(state["state"]["game_start"]).astimezone(datetime.timezone.utc)
-    now_time = datetime.datetime.now(datetime.timezone.utc)
+    now_time = CLOCK.now()
     seconds_elapsed = (now_time - start_time).total_seconds()
     primitives_defense_per_star = uas.GAME_FUNCS["BASE_PRIMITIVES_DEFENSE_PER_STAR"](max(seconds_elapsed, 0))
     
     kd_info_parse = json.loads(kd_info.text)
-    current_bonuses = {
-        project: project_dict.get("max_bonus", 0) * min(kd_info_parse["projects_points"][project] / kd_info_parse["projects_max_points"][project], 1.0)
-        for project, project_dict in uas.PROJECTS.items()
-        if "max_bonus" in project_dict
-    }
+    current_bonuses = uag._get_current_bonuses(kd_info_parse)
 
     valid_attack_request, attack_request_message = _validate_attack_request(
         attacker_raw_values,
@@ -1158,7 +1421,7 @@ def calculate_attack_primitives():
         uas.GAME_CONFIG["BASE_ATTACKER_UNIT_LOSS_RATE"],
         xo=kd_info_parse["race"] == "Xo",
     )
-    time_now = datetime.datetime.now(datetime.timezone.utc)
+    time_now = CLOCK.now()
     galaxies_inverted, _ = uag._get_galaxies_inverted()
     galaxy_policies, _ = uag._get_galaxy_politics(kd_id, galaxies_inverted[kd_id])
     is_warlike = "Warlike" in galaxy_policies["active_policies"]
@@ -1205,15 +1468,11 @@ def _attack_primitives(req, kd_id):
     )
     
     kd_info_parse = json.loads(kd_info.text)
-    current_bonuses = {
-        project: project_dict.get("max_bonus", 0) * min(kd_info_parse["projects_points"][project] / kd_info_parse["projects_max_points"][project], 1.0)
-        for project, project_dict in uas.PROJECTS.items()
-        if "max_bonus" in project_dict
-    }
+    current_bonuses = uag._get_current_bonuses(kd_info_parse)
     state = uag._get_state()
     
     start_time = datetime.datetime.fromisoformat(state["state"]["game_start"]).astimezone(datetime.timezone.utc)
-    now_time = datetime.datetime.now(datetime.timezone.utc)
+    now_time = CLOCK.now()
     seconds_elapsed = (now_time - start_time).total_seconds()
     primitives_defense_per_star = uas.GAME_FUNCS["BASE_PRIMITIVES_DEFENSE_PER_STAR"](max(seconds_elapsed, 0))
 
@@ -1244,7 +1503,7 @@ def _attack_primitives(req, kd_id):
         uas.GAME_CONFIG["BASE_ATTACKER_UNIT_LOSS_RATE"],
         xo=kd_info_parse["race"] == "Xo",
     )
-    time_now = datetime.datetime.now(datetime.timezone.utc)
+    time_now = CLOCK.now()
     galaxies_inverted, _ = uag._get_galaxies_inverted()
     galaxy_policies, _ = uag._get_galaxy_politics(kd_id, galaxies_inverted[kd_id])
     is_warlike = "Warlike" in galaxy_policies["active_policies"]
@@ -1664,15 +1923,16 @@ def _spy(req, kd_id, target_kd):
         has_drone_gadgets="drone_gadgets" in kd_info_parse["completed_projects"]
     )
 
-    roll = random.uniform(0, 1)
-    spy_radar_roll = random.uniform(0, 1)
+    rng = uas.RNG.get()
+    roll = rng.uniform(0, 1)
+    spy_radar_roll = rng.uniform(0, 1)
     success = roll < spy_probability
     if (kd_info_parse["race"] == "Vult") and operation in uas.AGGRO_OPERATIONS:
         spy_radar_success = False
     else:
         spy_radar_success = spy_radar_roll < max_target_kd_info["shields"]["spy_radar"]
 
-    time_now = datetime.datetime.now(datetime.timezone.utc)
+    time_now = CLOCK.now()
     revealed_until = None
     siphon_damage = None
     siphon_until = None
@@ -1859,17 +2119,13 @@ def _spy(req, kd_id, target_kd):
         data=json.dumps(target_news_payload),
     )
     _add_notifs(target_kd, ["news_kingdom"])
-    try:
-        ws = SOCK_HANDLERS[target_kd]
-        ws.send(json.dumps({
-            "message": target_message,
-            "status": "warning",
-            "category": "Spy",
-            "delay": 15000,
-            "update": ["news"],
-        }))
-    except (KeyError, ConnectionError, StopIteration, ConnectionClosed):
-        pass
+    _publish_event(target_kd, {
+        "message": target_message,
+        "status": "warning",
+        "category": "Spy",
+        "delay": 15000,
+        "update": ["news"],
+    })
 
     if success and operation in uas.REVEAL_OPERATIONS:
         share_to_galaxy = req.get("share_to_galaxy", False)
@@ -1941,7 +2197,7 @@ def _rob_primitives(req, kd_id):
     state = uag._get_state()
     
     start_time = datetime.datetime.fromisoformat(state["state"]["game_start"]).astimezone(datetime.timezone.utc)
-    now_time = datetime.datetime.now(datetime.timezone.utc)
+    now_time = CLOCK.now()
     seconds_elapsed = (now_time - start_time).total_seconds()
     primitives_rob_per_drone = uas.GAME_FUNCS["BASE_PRIMITIVES_ROB_PER_DRONE"](max(seconds_elapsed, 0))
 
@@ -1989,7 +2245,7 @@ def _rob_primitives(req, kd_id):
         data=json.dumps(kd_patch_payload, default=str),
     )
 
-    time_now = datetime.datetime.now(datetime.timezone.utc)
+    time_now = CLOCK.now()
     history_payload = {
         "time": time_now.isoformat(),
         "to": "",
@@ -2115,6 +2371,8 @@ def _validate_schedule_attack(
         return False, "Pure offense must be between 0% and 100%"
     if options["target"] == kd_id:
         return False, "You can not schedule an attack against yourself"
+    if options["autofill_objective"] not in uas.AUTOFILL_OBJECTIVES:
+        return False, "Please choose a valid autofill objective"
     
     return True, ""
 
@@ -2128,6 +2386,7 @@ def _schedule_attack(
     options["pure_offense"] = float(options["pure_offense"] or 0) / 100
     options["flex_offense"] = float(options["flex_offense"] or 0) / 100
     options["autofill_buffer"] = float(options["autofill_buffer"] or 0) / 100
+    options["autofill_objective"] = options.get("autofill_objective") or "priority"
     valid_schedule, message = _validate_schedule_attack(options, kd_info["kdId"])
     if not valid_schedule:
         return False, {}, message
@@ -2306,7 +2565,7 @@ def add_schedule():
     schedule_type = req.get("type")
     schedule_time = datetime.datetime.fromisoformat(req["time"].replace('Z', '+00:00')).isoformat()
     schedule_options = req.get("options", {})
-    schedule_id = uuid.uuid4()
+    schedule_id = uuid.UUID(int=uas.RNG.get().getrandbits(128), version=4)
     
     state = uag._get_state()
 
@@ -2535,7 +2794,7 @@ def _launch_missiles(req, kd_id, target_kd):
         headers={'x-functions-key': os.environ['AZURE_FUNCTIONS_HOST_KEY']},
         data=json.dumps(defender_patch_payload, default=str),
     )
-    time_now = datetime.datetime.now(datetime.timezone.utc)
+    time_now = CLOCK.now()
     target_news_payload = {
         "time": time_now.isoformat(),
         "from": kd_id,
@@ -2557,17 +2816,13 @@ def _launch_missiles(req, kd_id, target_kd):
         headers={'x-functions-key': os.environ['AZURE_FUNCTIONS_HOST_KEY']},
         data=json.dumps(history_payload, default=str),
     )
-    try:
-        ws = SOCK_HANDLERS[target_kd]
-        ws.send(json.dumps({
-            "message": defender_message,
-            "status": "warning",
-            "category": "Missiles",
-            "delay": 30000,
-            "update": [],
-        }))
-    except (KeyError, ConnectionError, StopIteration, ConnectionClosed):
-        pass
+    _publish_event(target_kd, {
+        "message": defender_message,
+        "status": "warning",
+        "category": "Missiles",
+        "delay": 30000,
+        "update": [],
+    })
 
     new_kd_info = {
         **kd_info_parse,
@@ -2629,17 +2884,13 @@ def accept_shared():
         data=json.dumps(revealed_payload),
     )
     
-    try:
-        ws = SOCK_HANDLERS[shared_from_kd]
-        ws.send(json.dumps({
-            "message": f"{kingdoms[kd_id]} accepted intel {shared_info['shared'][accepted_kd]['shared_stat']} for target {kingdoms[accepted_kd]}",
-            "status": "info",
-            "category": "Galaxy",
-            "delay": 15000,
-            "update": [],
-        }))
-    except (KeyError, ConnectionError, StopIteration, ConnectionClosed):
-        pass
+    _publish_event(shared_from_kd, {
+        "message": f"{kingdoms[kd_id]} accepted intel {shared_info['shared'][accepted_kd]['shared_stat']} for target {kingdoms[accepted_kd]}",
+        "status": "info",
+        "category": "Galaxy",
+        "delay": 15000,
+        "update": [],
+    })
     return (flask.jsonify(shared_info_response.text), 200)
 
 def _offer_shared(req, kd_id):
@@ -2733,17 +2984,13 @@ def _offer_shared(req, kd_id):
             )
 
         
-        try:
-            ws = SOCK_HANDLERS[kd_to_update]
-            ws.send(json.dumps({
-                "message": f"{kingdoms[kd_id]} offered intel {shared_stat} for target {kingdoms[shared_kd]} with a cut of {cut:.1%}",
-                "status": "info",
-                "category": "Galaxy",
-                "delay": 15000,
-                "update": [],
-            }))
-        except (KeyError, ConnectionError, StopIteration, ConnectionClosed):
-            pass
+        _publish_event(kd_to_update, {
+            "message": f"{kingdoms[kd_id]} offered intel {shared_stat} for target {kingdoms[shared_kd]} with a cut of {cut:.1%}",
+            "status": "info",
+            "category": "Galaxy",
+            "delay": 15000,
+            "update": [],
+        })
     
     your_shared_info_response = REQUESTS_SESSION.post(
         os.environ['AZURE_FUNCTION_ENDPOINT'] + f'/kingdom/{kd_id}/shared',
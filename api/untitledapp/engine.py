@@ -0,0 +1,201 @@
+import collections
+import datetime
+import threading
+import time
+
+import untitledapp.formulas as uaf
+
+
+def _timestamp(value):
+    return datetime.datetime.fromisoformat(value).astimezone(datetime.timezone.utc).timestamp()
+
+
+class TickEngine:
+    """
+    Authoritative in-memory economy of every live kingdom, ticked every few seconds
+
+    load() takes kingdom documents, tick() advances the money, funding, fuel, drones,
+    population, project points and structure losses of every resident kingdom in
+    memory with the refresh's formulas (formulas.calc_economy), and checkpoint()
+    returns the accumulated changes as increment patch operations per kingdom so they
+    commute with player writes made in the meantime. Everything event-like (queues,
+    purchases, attacks, deaths) is left to the refresh of each kingdom after its
+    checkpoint, which also recomputes networth and settles siphons over the whole
+    time since the kingdom's last refresh.
+
+    Durations follow config["BASE_EPOCH_SECONDS"] at each tick, so game speed
+    changes apply without a reload.
+    """
+
+    def __init__(self, config, units, funcs, tick_seconds=1.0, checkpoint_seconds=60.0, keep=3600):
+        self.config = config
+        self.units = units
+        self.funcs = funcs
+        self.tick_seconds = tick_seconds
+        self.checkpoint_seconds = checkpoint_seconds
+        self.kingdoms = {}
+        self.tick_durations = collections.deque(maxlen=keep)
+        self._lock = threading.Lock()
+        self.stats = {
+            "kingdoms": 0,
+            "ticks": 0,
+            "late_ticks": 0,
+            "checkpoints": 0,
+            "cycles": 0,
+            "last_tick_seconds": None,
+            "max_tick_seconds": 0.0,
+            "last_checkpoint": None,
+            "last_checkpoint_seconds": None,
+            "max_checkpoint_seconds": 0.0,
+        }
+
+    def _row(self, kd_info, current_bonuses, active_policies, overflow):
+        total_units = dict(kd_info["units"])
+        for general in kd_info["generals_out"]:
+            for key_unit, value_unit in general.items():
+                if key_unit == "return_time":
+                    continue
+                total_units[key_unit] = total_units.get(key_unit, 0) + value_unit
+        shields_fuel = kd_info["stars"] * 100 * (
+            kd_info["shields"]["military"] * self.config["BASE_MILITARY_SHIELDS_COST_PER_LAND_PER_PCT"]
+            + kd_info["shields"]["spy"] * self.config["BASE_SPY_SHIELDS_COST_PER_LAND_PER_PCT"]
+            + kd_info["shields"]["spy_radar"] * self.config["BASE_SPY_RADAR_COST_PER_LAND_PER_PCT"]
+            + kd_info["shields"]["missiles"] * self.config["BASE_MISSILES_SHIELDS_COST_PER_LAND_PER_PCT"]
+        )
+        is_vult = kd_info["race"] == "Vult"
+        return {
+            "kd_id": kd_info["kdId"],
+            "last_income": _timestamp(kd_info["last_income"]),
+            "stars": kd_info["stars"],
+            "structures": dict(kd_info["structures"]),
+            "is_vult": is_vult,
+            "money_bonus": (
+                current_bonuses["money_bonus"]
+                - ("Isolationist" in active_policies) * self.config["BASE_ISOLATIONIST_DECREASE"]
+                + ("Free Trade" in active_policies) * self.config["BASE_FREE_TRADE_INCREASE"]
+            ),
+            "fuel_bonus": current_bonuses["fuel_bonus"] + (kd_info["race"] == "Lumina") * self.config["LUMINA_FUEL_PRODUCTION_INCREASE"],
+            "overflow": overflow,
+            "units_fuel": sum(self.units[key_unit]["fuel"] * value_unit for key_unit, value_unit in total_units.items()),
+            "shields_fuel": shields_fuel,
+            "min_fuel": self.funcs["BASE_NEGATIVE_FUEL_CAP"](kd_info["stars"]),
+            "population": kd_info["population"],
+            "fuel": kd_info["fuel"],
+            "auto_spending": dict(kd_info["auto_spending"]) if kd_info["auto_spending_enabled"] else {},
+            "projects_assigned": {k: v for k, v in kd_info["projects_assigned"].items() if v},
+            "deltas": {},
+        }
+
+    def load(self, kds_info, bonuses, active_policies, overflows):
+        """
+        Load or reload the given kingdoms; their pending changes must be checkpointed first
+
+        overflows holds the hangar overflow of each kingdom, units in training included,
+        as the refresh computes it.
+        """
+        rows = {
+            kd_info["kdId"]: self._row(kd_info, bonuses[kd_info["kdId"]], active_policies, overflows[kd_info["kdId"]])
+            for kd_info in kds_info
+            if kd_info["status"].lower() != "dead"
+        }
+        dead_kd_ids = [kd_info["kdId"] for kd_info in kds_info if kd_info["kdId"] not in rows]
+        with self._lock:
+            self.kingdoms.update(rows)
+            for kd_id in dead_kd_ids:
+                self.kingdoms.pop(kd_id, None)
+            self.stats["kingdoms"] = len(self.kingdoms)
+
+    def unload(self, kd_ids=None):
+        """Drop the given kingdoms, or all of them, with any pending changes"""
+        with self._lock:
+            for kd_id in list(self.kingdoms) if kd_ids is None else kd_ids:
+                self.kingdoms.pop(kd_id, None)
+            self.stats["kingdoms"] = len(self.kingdoms)
+
+    def _tick_kingdom(self, row, time_now):
+        epoch_elapsed = (time_now - row["last_income"]) / self.config["BASE_EPOCH_SECONDS"]
+        if epoch_elapsed <= 0:
+            return
+        row["last_income"] = time_now
+        deltas = row["deltas"]
+        economy = uaf.calc_economy(self.config, row, epoch_elapsed)
+
+        new_income = economy["gross_income"] * epoch_elapsed
+        allocated = 0
+        for key_spending, pct_spending in row["auto_spending"].items():
+            path = f"/funding/{key_spending}"
+            deltas[path] = deltas.get(path, 0) + pct_spending * new_income
+            allocated += pct_spending
+        deltas["/money"] = deltas.get("/money", 0) + new_income * (1 - allocated)
+
+        deltas["/fuel"] = deltas.get("/fuel", 0) + economy["fuel"] - row["fuel"]
+        row["fuel"] = economy["fuel"]
+        if row["fuel"] <= 0:
+            # The refresh drops the shields of fuelless kingdoms
+            row["shields_fuel"] = 0
+
+        deltas["/drones"] = deltas.get("/drones", 0) + economy["drones"] * epoch_elapsed
+
+        deltas["/population"] = deltas.get("/population", 0) + economy["pop_change"]
+        row["population"] += economy["pop_change"]
+
+        for key_project, new_points in economy["project_points"].items():
+            path = f"/projects_points/{key_project}"
+            deltas[path] = deltas.get(path, 0) + new_points
+
+        for key_structure, reduction in economy["structures_reduction"].items():
+            path = f"/structures/{key_structure}"
+            deltas[path] = deltas.get(path, 0) - reduction
+            row["structures"][key_structure] -= reduction
+
+    def tick(self, time_now):
+        """Advance every resident kingdom to time_now, a datetime"""
+        start_counter = time.perf_counter()
+        timestamp = time_now.timestamp()
+        with self._lock:
+            for row in self.kingdoms.values():
+                if row["population"] > 0:
+                    self._tick_kingdom(row, timestamp)
+        tick_seconds = time.perf_counter() - start_counter
+        self.tick_durations.append(tick_seconds)
+        self.stats["ticks"] += 1
+        self.stats["last_tick_seconds"] = tick_seconds
+        self.stats["max_tick_seconds"] = max(self.stats["max_tick_seconds"], tick_seconds)
+        return tick_seconds
+
+    def requeue(self, kd_id, operations):
+        """Put the increments of checkpoint operations that were not written back into the kingdom's changes"""
+        with self._lock:
+            row = self.kingdoms.get(kd_id)
+            if row is None:
+                return
+            for operation in operations:
+                if operation["op"] == "incr":
+                    row["deltas"][operation["path"]] = row["deltas"].get(operation["path"], 0) + operation["value"]
+
+    def checkpoint(self, time_now, kd_ids=None):
+        """
+        Return and clear the changes of the given kingdoms, or all of them, since their
+        last checkpoint, as patch operations per kingdom
+
+        last_income is set to the time of the last tick of each kingdom, so a refresh
+        of the kingdom right after only adds the income of the time since.
+        """
+        operations = {}
+        with self._lock:
+            for kd_id in list(self.kingdoms) if kd_ids is None else kd_ids:
+                row = self.kingdoms.get(kd_id)
+                if row is None or not row["deltas"]:
+                    continue
+                operations[kd_id] = [
+                    {"op": "incr", "path": path, "value": value}
+                    for path, value in row["deltas"].items()
+                ] + [{
+                    "op": "set",
+                    "path": "/last_income",
+                    "value": datetime.datetime.fromtimestamp(row["last_income"], datetime.timezone.utc).isoformat(),
+                }]
+                row["deltas"] = {}
+        self.stats["checkpoints"] += 1
+        self.stats["last_checkpoint"] = time_now.isoformat()
+        return operations
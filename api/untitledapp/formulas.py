@@ -0,0 +1,221 @@
+import functools
+import math
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+FORMULA_CACHE_SIZE = 4096
+
+
+def _cached(func, cache_size):
+    # typed so that e.g. stars=5 and stars=5.0 keep returning int and float respectively
+    return functools.lru_cache(maxsize=cache_size, typed=True)(func)
+
+
+def build_game_funcs(config, cache_size=FORMULA_CACHE_SIZE):
+    """
+    Bind the GAME_CONFIG constants used by each game formula once.
+
+    The formulas of integer game quantities (stars, population, generals) are memoized;
+    the time-based formulas take continuous seconds and are left uncached.
+    """
+    settle_stars_power = config["BASE_SETTLE_STARS_POWER"]
+    settle_cost_constant = config["BASE_SETTLE_COST_CONSTANT"]
+    max_settle_cap = config["BASE_MAX_SETTLE_CAP"]
+    structure_stars_power = config["BASE_STRUCTURE_STARS_POWER"]
+    structure_cost_constant = config["BASE_STRUCTURE_COST_CONSTANT"]
+    max_recruits_cap = config["BASE_MAX_RECRUITS_CAP"]
+    max_engineers_pop_cap = config["BASE_MAX_ENGINEERS_POP_CAP"]
+    generals_attack_modifier = config["BASE_GENERALS_ATTACK_MODIFIER"]
+    primitives_defense_per_star = config["BASE_PRIMITIVES_DEFENSE_PER_STAR"]
+    primitives_defense_seconds = config["BASE_EPOCH_SECONDS"] * config["BASE_PRIMITIVES_DEFENSE_EPOCH_MULTIPLER"]
+    primitives_rob_per_drone = config["BASE_PRIMITIVES_ROB_PER_DRONE"]
+    primitives_rob_seconds = config["BASE_EPOCH_SECONDS"] * config["BASE_PRIMITIVES_ROB_EPOCH_MULTIPLIER"]
+    negative_fuel_per_star = config["BASE_NEGATIVE_FUEL_PER_STAR"]
+
+    return {
+        "BASE_SETTLE_COST": _cached(lambda stars: math.floor((stars ** settle_stars_power) * settle_cost_constant), cache_size),
+        "BASE_MAX_SETTLE": _cached(lambda stars: math.floor(stars * max_settle_cap), cache_size),
+        "BASE_STRUCTURE_COST": _cached(lambda stars: math.floor((stars ** structure_stars_power) * structure_cost_constant), cache_size),
+        "BASE_MAX_RECRUITS": _cached(lambda pop: math.floor(pop * max_recruits_cap), cache_size),
+        "BASE_MAX_ENGINEERS": _cached(lambda pop: math.floor(pop * max_engineers_pop_cap), cache_size),
+        "BASE_GENERALS_BONUS": _cached(lambda generals: (generals - 1) * generals_attack_modifier, cache_size),
+        "BASE_PRIMITIVES_DEFENSE_PER_STAR": lambda seconds: primitives_defense_per_star * math.sqrt(1 + seconds / primitives_defense_seconds),
+        "BASE_PRIMITIVES_ROB_PER_DRONE": lambda seconds: primitives_rob_per_drone / math.sqrt(1 + seconds / primitives_rob_seconds),
+        "BASE_NEGATIVE_FUEL_CAP": _cached(lambda stars: stars * -negative_fuel_per_star, cache_size),
+    }
+
+
+def projects_max_points(stars, stars_power, constant):
+    return (stars ** stars_power) * constant
+
+
+def build_projects_funcs(projects, cache_size=FORMULA_CACHE_SIZE):
+    def _bind(stars_power, constant):
+        return _cached(lambda stars: (stars ** stars_power) * constant, cache_size)
+
+    return {
+        key: _bind(project_dict["stars_power"], project_dict["constant"])
+        for key, project_dict in projects.items()
+    }
+
+
+def _np_pow(values, power):
+    # numpy's vectorized power can differ from libm's pow in the last bit, so each element is
+    # raised the way the scalar formulas do it to keep both variants bit-for-bit identical
+    return np.frompyfunc(lambda value: float(value) ** power, 1, 1)(values).astype(np.float64)
+
+
+def build_game_funcs_np(config):
+    """
+    Array variants of build_game_funcs for batch simulation, or None when numpy is not installed.
+
+    Each takes and returns numpy arrays with the same float64 arithmetic as the scalar
+    formulas; floored formulas return int64 arrays.
+    """
+    if np is None:
+        return None
+
+    settle_stars_power = config["BASE_SETTLE_STARS_POWER"]
+    settle_cost_constant = config["BASE_SETTLE_COST_CONSTANT"]
+    max_settle_cap = config["BASE_MAX_SETTLE_CAP"]
+    structure_stars_power = config["BASE_STRUCTURE_STARS_POWER"]
+    structure_cost_constant = config["BASE_STRUCTURE_COST_CONSTANT"]
+    max_recruits_cap = config["BASE_MAX_RECRUITS_CAP"]
+    max_engineers_pop_cap = config["BASE_MAX_ENGINEERS_POP_CAP"]
+    generals_attack_modifier = config["BASE_GENERALS_ATTACK_MODIFIER"]
+    primitives_defense_per_star = config["BASE_PRIMITIVES_DEFENSE_PER_STAR"]
+    primitives_defense_seconds = config["BASE_EPOCH_SECONDS"] * config["BASE_PRIMITIVES_DEFENSE_EPOCH_MULTIPLER"]
+    primitives_rob_per_drone = config["BASE_PRIMITIVES_ROB_PER_DRONE"]
+    primitives_rob_seconds = config["BASE_EPOCH_SECONDS"] * config["BASE_PRIMITIVES_ROB_EPOCH_MULTIPLIER"]
+    negative_fuel_per_star = config["BASE_NEGATIVE_FUEL_PER_STAR"]
+
+    def _floor(values):
+        return np.floor(values).astype(np.int64)
+
+    return {
+        "BASE_SETTLE_COST": lambda stars: _floor(_np_pow(np.asarray(stars, dtype=np.float64), settle_stars_power) * settle_cost_constant),
+        "BASE_MAX_SETTLE": lambda stars: _floor(np.asarray(stars, dtype=np.float64) * max_settle_cap),
+        "BASE_STRUCTURE_COST": lambda stars: _floor(_np_pow(np.asarray(stars, dtype=np.float64), structure_stars_power) * structure_cost_constant),
+        "BASE_MAX_RECRUITS": lambda pop: _floor(np.asarray(pop, dtype=np.float64) * max_recruits_cap),
+        "BASE_MAX_ENGINEERS": lambda pop: _floor(np.asarray(pop, dtype=np.float64) * max_engineers_pop_cap),
+        "BASE_GENERALS_BONUS": lambda generals: (np.asarray(generals, dtype=np.float64) - 1) * generals_attack_modifier,
+        "BASE_PRIMITIVES_DEFENSE_PER_STAR": lambda seconds: primitives_defense_per_star * np.sqrt(1 + np.asarray(seconds, dtype=np.float64) / primitives_defense_seconds),
+        "BASE_PRIMITIVES_ROB_PER_DRONE": lambda seconds: primitives_rob_per_drone / np.sqrt(1 + np.asarray(seconds, dtype=np.float64) / primitives_rob_seconds),
+        "BASE_NEGATIVE_FUEL_CAP": lambda stars: np.asarray(stars, dtype=np.float64) * -negative_fuel_per_star,
+    }
+
+
+def build_projects_funcs_np(projects):
+    if np is None:
+        return None
+
+    def _bind(stars_power, constant):
+        return lambda stars: _np_pow(np.asarray(stars, dtype=np.float64), stars_power) * constant
+
+    return {
+        key: _bind(project_dict["stars_power"], project_dict["constant"])
+        for key, project_dict in projects.items()
+    }
+
+
+def calc_economy(config, economy, epoch_elapsed):
+    """
+    Advance a kingdom's economy by epoch_elapsed epochs; shared by the refresh and the tick engine
+
+    economy holds the kingdom's structures, stars, population and fuel, its money and fuel
+    bonuses, whether it is Vult, its hangar overflow, the fuel its units and shields burn
+    per epoch, its negative fuel cap and its engineers per project. The money, fuel and
+    drones income are per epoch; fuel is the new fuel level and the other changes are
+    over the elapsed epochs.
+    """
+    structures = economy["structures"]
+    population = economy["population"]
+    stars = economy["stars"]
+    fuelless = economy["fuel"] <= 0
+
+    gross_income = (
+        math.floor(structures["mines"]) * config["BASE_MINES_INCOME_PER_EPOCH"]
+        + math.floor(population) * config["BASE_POP_INCOME_PER_EPOCH"]
+    ) * (1 + economy["money_bonus"])
+
+    new_fuel = math.floor(structures["fuel_plants"]) * config["BASE_FUEL_PLANTS_INCOME_PER_EPOCH"] * (1 + economy["fuel_bonus"])
+    fuel_consumption = (
+        economy["units_fuel"]
+        + economy["shields_fuel"]
+        + population * config["BASE_POP_FUEL_CONSUMPTION_PER_EPOCH"]
+    )
+    max_fuel = math.floor(structures["fuel_plants"]) * config["BASE_FUEL_PLANTS_CAPACITY"]
+    fuel = max(min(max_fuel, economy["fuel"] + (new_fuel - fuel_consumption) * epoch_elapsed), economy["min_fuel"])
+
+    drones = (
+        math.floor(structures["drone_factories"])
+        * config["BASE_DRONE_FACTORIES_PRODUCTION_PER_EPOCH"]
+        * (1 + economy["is_vult"] * config["VULT_DRONE_PRODUCTION_INCREASE"])
+    )
+
+    pop_capacity = math.floor(
+        structures["homes"]
+        * config["BASE_HOMES_CAPACITY"]
+        * (
+            1
+            - fuelless * config["BASE_FUELLESS_POP_CAP_REDUCTION"]
+            - economy["is_vult"] * config["VULT_POPULATION_REDUCTION"]
+        )
+    )
+    pop_difference = max(pop_capacity - economy["overflow"], 0) - population
+    if pop_difference < 0:
+        pop_change = -min(
+            max(
+                config["BASE_PCT_POP_LOSS_PER_EPOCH"] * population * epoch_elapsed,
+                config["BASE_POP_LOSS_PER_STAR_PER_EPOCH"] * stars * epoch_elapsed,
+            ),
+            -pop_difference,
+        )
+    elif pop_difference > 0:
+        pop_change = min(
+            max(
+                config["BASE_PCT_POP_GROWTH_PER_EPOCH"] * population * epoch_elapsed,
+                config["BASE_POP_GROWTH_PER_STAR_PER_EPOCH"] * stars * epoch_elapsed,
+            ) * (1 - fuelless * config["BASE_FUELLESS_POP_GROWTH_REDUCTION"]),
+            pop_difference,
+        )
+    else:
+        pop_change = 0
+
+    count_structures = sum(structures.values())
+    structures_reduction = {}
+    if count_structures > stars:
+        structures_to_reduce = count_structures - stars
+        greater_reduction = max(
+            structures_to_reduce * config["BASE_STRUCTURES_LOSS_RETURN_RATE"] * epoch_elapsed,
+            min(stars * config["BASE_STRUCTURES_LOSS_PER_STAR_PER_EPOCH"] * epoch_elapsed, structures_to_reduce, count_structures),
+        )
+        structures_reduction = {
+            key_structure: value_structure / count_structures * greater_reduction
+            for key_structure, value_structure in structures.items()
+        }
+
+    return {
+        "gross_income": gross_income,
+        "new_fuel": new_fuel,
+        "fuel_consumption": fuel_consumption,
+        "fuel": fuel,
+        "drones": drones,
+        "pop_change": pop_change,
+        "project_points": {
+            key_project: assigned_engineers * config["BASE_ENGINEER_PROJECT_POINTS_PER_EPOCH"] * epoch_elapsed
+            for key_project, assigned_engineers in economy["projects_assigned"].items()
+        },
+        "structures_reduction": structures_reduction,
+    }
+
+
+def formula_cache_info(funcs):
+    return {
+        key: func.cache_info()._asdict()
+        for key, func in funcs.items()
+        if hasattr(func, "cache_info")
+    }
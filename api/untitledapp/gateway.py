@@ -0,0 +1,186 @@
+import collections
+import glob
+import json
+import logging
+import os
+import queue
+import socket
+import threading
+
+from flask_sock import ConnectionClosed
+
+LOGGER = logging.getLogger(__name__)
+
+
+class InMemoryBus:
+    """Per-process pub/sub bus; publish never blocks and drops events when the queue is full"""
+
+    def __init__(self, maxsize=10000):
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.subscribers = []
+        self.published = 0
+        self.dropped = 0
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def subscribe(self, callback):
+        self.subscribers.append(callback)
+        self._start()
+
+    def publish(self, kd_id, event):
+        self._enqueue(str(kd_id), event)
+
+    def queue_depth(self):
+        return self.queue.qsize()
+
+    def _enqueue(self, kd_id, event):
+        try:
+            self.queue.put_nowait((kd_id, event))
+            self.published += 1
+        except queue.Full:
+            self.dropped += 1
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._dispatch, daemon=True)
+                self._thread.start()
+
+    def _dispatch(self):
+        while True:
+            kd_id, event = self.queue.get()
+            for callback in self.subscribers:
+                try:
+                    callback(kd_id, event)
+                except Exception as e:
+                    LOGGER.warning('Error dispatching event to %s: %s', kd_id, str(e))
+
+
+class SocketBus(InMemoryBus):
+    """Bus shared by every worker on the host through unix datagram sockets in bus_dir
+
+    Each worker binds its own socket and publish fans the event out to all of
+    them, so a kingdom is reached whichever worker holds its websocket.
+    """
+
+    def __init__(self, bus_dir, maxsize=10000):
+        super().__init__(maxsize=maxsize)
+        self.bus_dir = bus_dir
+        os.makedirs(bus_dir, exist_ok=True)
+        self.path = os.path.join(bus_dir, f"{os.getpid()}.sock")
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self.receiver = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.receiver.bind(self.path)
+        self.sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sender.setblocking(False)
+        self._receive_thread = None
+
+    def subscribe(self, callback):
+        super().subscribe(callback)
+        with self._lock:
+            if self._receive_thread is None:
+                self._receive_thread = threading.Thread(target=self._receive, daemon=True)
+                self._receive_thread.start()
+
+    def publish(self, kd_id, event):
+        data = json.dumps({"kd_id": str(kd_id), "event": event}, default=str).encode()
+        for path in glob.glob(os.path.join(self.bus_dir, "*.sock")):
+            try:
+                self.sender.sendto(data, path)
+            except (ConnectionRefusedError, FileNotFoundError):
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+            except BlockingIOError:
+                self.dropped += 1
+            except OSError as e:
+                LOGGER.warning('Error publishing to %s: %s', path, str(e))
+                self.dropped += 1
+
+    def _receive(self):
+        while True:
+            data = self.receiver.recv(65536)
+            try:
+                message = json.loads(data)
+            except ValueError:
+                continue
+            self._enqueue(message["kd_id"], message["event"])
+
+
+class WebsocketGateway:
+    """Delivers bus events to every open websocket of a kingdom
+
+    When a patch_builder is set, the views named in an event's "update" list
+    are built once and pushed as a "patch" so clients do not refetch them.
+    """
+
+    def __init__(self, bus, patch_builder=None):
+        self.bus = bus
+        self.patch_builder = patch_builder
+        self.connections = collections.defaultdict(set)
+        # Totals rather than per kingdom, so that kingdoms that disconnected are not kept around
+        self.delivered = 0
+        self.failed = 0
+        self._lock = threading.Lock()
+        self.bus.subscribe(self._deliver)
+
+    def register(self, kd_id, ws):
+        with self._lock:
+            self.connections[str(kd_id)].add(ws)
+
+    def unregister(self, kd_id, ws):
+        with self._lock:
+            self.connections[str(kd_id)].discard(ws)
+            if not self.connections[str(kd_id)]:
+                self.connections.pop(str(kd_id))
+
+    def publish(self, kd_id, event):
+        self.bus.publish(kd_id, event)
+
+    def stats(self):
+        with self._lock:
+            connections = {
+                kd_id: len(kd_connections)
+                for kd_id, kd_connections in self.connections.items()
+            }
+        return {
+            "connections": connections,
+            "published": self.bus.published,
+            "dropped": self.bus.dropped,
+            "queue_depth": self.bus.queue_depth(),
+            "delivered": self.delivered,
+            "failed": self.failed,
+        }
+
+    def _deliver(self, kd_id, event):
+        with self._lock:
+            kd_connections = list(self.connections.get(kd_id, ()))
+        if not kd_connections:
+            return
+        if self.patch_builder is not None and event.get("update"):
+            patch = event.get("patch", {})
+            patch = {
+                **self.patch_builder(kd_id, [view for view in event["update"] if view not in patch]),
+                **patch,
+            }
+            event = {
+                **event,
+                "patch": patch,
+                "update": [view for view in event["update"] if view not in patch],
+            }
+        data = json.dumps(event, default=str)
+        for ws in kd_connections:
+            try:
+                ws.send(data)
+                self.delivered += 1
+            except (ConnectionError, StopIteration, ConnectionClosed):
+                self.failed += 1
+                self.unregister(kd_id, ws)
+
+
+def make_bus():
+    if os.environ.get("WS_BUS", "memory") == "socket":
+        return SocketBus(os.environ.get("WS_BUS_DIR", "/tmp/untitledapp-bus"))
+    return InMemoryBus()
@@ -1,15 +1,50 @@
+import collections
 import copy
 import datetime
+import hashlib
 import json
 import math
 import os
+import threading
 
 import flask
 import flask_praetorian
 from flask_sock import Sock, ConnectionClosed
 
 import untitledapp.shared as uas
-from untitledapp import app, alive_required, start_required, REQUESTS_SESSION, SOCK_HANDLERS
+from untitledapp import app, alive_required, start_required, _get_notifs, CLOCK, REQUESTS_SESSION
+
+# Per-viewer field masks, least recently used viewers evicted first
+VISIBILITY_INDEX = collections.OrderedDict()
+VISIBILITY_INDEX_MAX_VIEWERS = int(os.environ.get("VISIBILITY_INDEX_MAX_VIEWERS", "1024"))
+VISIBILITY_INDEX_LOCK = threading.Lock()
+ETAG_TIME_BUCKET_SECONDS = 60
+
+
+def _get_doc_version(doc):
+    if isinstance(doc, dict) and "_etag" in doc:
+        return doc["_etag"]
+    return hashlib.sha1(json.dumps(doc, sort_keys=True, default=str).encode()).hexdigest()
+
+def _get_time_bucket():
+    time_now = CLOCK.now()
+    return int(time_now.timestamp() // ETAG_TIME_BUCKET_SECONDS)
+
+def _conditional_response(view, versions, build_payload):
+    """
+    Respond 304 when the client's If-None-Match matches the versions of the view's inputs.
+
+    build_payload is only called when the client is out of date, so derived views
+    are not recomputed or re-serialized for unchanged inputs.
+    """
+    etag = hashlib.sha1(json.dumps([view, versions], default=str).encode()).hexdigest()
+    if etag in flask.request.if_none_match:
+        response = flask.make_response("", 304)
+    else:
+        response = flask.make_response(flask.jsonify(build_payload()), 200)
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
 
 def _get_state():
     get_response = REQUESTS_SESSION.get(
@@ -17,22 +52,11 @@ def _get_state():
         headers={'x-functions-key': os.environ['AZURE_FUNCTIONS_HOST_KEY']},
     )
     get_response_json = json.loads(get_response.text)
+    uas._set_game_speed(get_response_json["state"].get("game_speed", 1))
     return get_response_json
 
-@app.route('/api/state', methods=["GET"])
-# @flask_praetorian.roles_required('verified')
-def get_state():
-    """
-    Get state
-    """    
-    get_response_json = _get_state()
-    start_time = datetime.datetime.fromisoformat(get_response_json["state"]["game_start"]).astimezone(datetime.timezone.utc)
-    now_time = datetime.datetime.now(datetime.timezone.utc)
-    seconds_elapsed = (now_time - start_time).total_seconds()
-    primitives_defense_per_star = uas.GAME_FUNCS["BASE_PRIMITIVES_DEFENSE_PER_STAR"](max(seconds_elapsed, 0))
-    primitives_rob_per_drone = uas.GAME_FUNCS["BASE_PRIMITIVES_ROB_PER_DRONE"](max(seconds_elapsed, 0))
-    return flask.jsonify({
-        **get_response_json,
+def _build_config():
+    return {
         "pretty_names": uas.PRETTY_NAMES,
         "units": uas.UNITS,
         "structures": {
@@ -49,14 +73,73 @@ def get_state():
         "missiles": uas.MISSILES,
         "income_per_pop": uas.GAME_CONFIG["BASE_POP_INCOME_PER_EPOCH"],
         "fuel_consumption_per_pop": uas.GAME_CONFIG["BASE_POP_FUEL_CONSUMPTION_PER_EPOCH"],
-        "primitives_defense_per_star": primitives_defense_per_star,
-        "primitives_rob_per_drone": primitives_rob_per_drone,
         "aggro_operations": uas.AGGRO_OPERATIONS,
         "reveal_operations": uas.REVEAL_OPERATIONS,
         "game_config": uas.GAME_CONFIG,
         "races": uas.RACES,
         "surrender_options": uas.SURRENDER_OPTIONS,
-    }), 200
+        "game_speed": uas.GAME_SPEED,
+    }
+
+# Serialized config and its hash per game speed, which scales the epoch-based durations
+CONFIG_CACHE = {}
+
+def _get_config():
+    game_speed = uas.GAME_SPEED
+    cached = CONFIG_CACHE.get(game_speed)
+    if cached is None:
+        config_json = json.dumps(_build_config(), sort_keys=True)
+        cached = CONFIG_CACHE[game_speed] = (config_json, hashlib.sha256(config_json.encode()).hexdigest()[:16])
+    return cached
+
+@app.route('/api/config', methods=["GET"])
+def get_config():
+    """
+    Get the static game config, serialized once per game speed and keyed by its hash
+    """
+    config_json, config_hash = _get_config()
+    requested_hash = flask.request.args.get("v", config_hash)
+    if requested_hash != config_hash:
+        # This process may not have seen the state with the new game speed yet
+        _get_state()
+        config_json, config_hash = _get_config()
+    if config_hash in flask.request.if_none_match:
+        response = flask.make_response("", 304)
+    else:
+        response = flask.make_response(config_json, 200)
+        response.mimetype = "application/json"
+    response.set_etag(config_hash)
+    if requested_hash == config_hash:
+        response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+    else:
+        response.headers["Cache-Control"] = "no-cache"
+    return response
+
+@app.route('/api/state', methods=["GET"])
+# @flask_praetorian.roles_required('verified')
+def get_state():
+    """
+    Get state; the static game config is served by /api/config and referenced by config_hash
+    """    
+    get_response_json = _get_state()
+    return _conditional_response(
+        "state",
+        [_get_doc_version(get_response_json), _get_time_bucket(), _get_config()[1]],
+        lambda: _build_state(get_response_json),
+    )
+
+def _build_state(get_response_json):
+    start_time = datetime.datetime.fromisoformat(get_response_json["state"]["game_start"]).astimezone(datetime.timezone.utc)
+    now_time = CLOCK.now()
+    seconds_elapsed = (now_time - start_time).total_seconds()
+    primitives_defense_per_star = uas.GAME_FUNCS["BASE_PRIMITIVES_DEFENSE_PER_STAR"](max(seconds_elapsed, 0))
+    primitives_rob_per_drone = uas.GAME_FUNCS["BASE_PRIMITIVES_ROB_PER_DRONE"](max(seconds_elapsed, 0))
+    return {
+        **get_response_json,
+        "primitives_defense_per_star": primitives_defense_per_star,
+        "primitives_rob_per_drone": primitives_rob_per_drone,
+        "config_hash": _get_config()[1],
+    }
 
 def _get_scores():
     get_response = REQUESTS_SESSION.get(
@@ -67,37 +150,33 @@ def _get_scores():
     return get_response_json
 
 
-def _get_scores_redacted(revealed, kd_id, galaxies_inverted):
-    scores = _get_scores()
+def _get_scores_redacted(revealed, kd_id, galaxies_inverted, scores=None):
+    if scores is None:
+        scores = _get_scores()
 
     top_nw = sorted(scores["networth"].items(), key=lambda item: -item[1])
     top_stars = sorted(scores["stars"].items(), key=lambda item: -item[1])
     top_points = sorted(scores["points"].items(), key=lambda item: -item[1])
 
-    top_nw_redacted = []
-    top_stars_redacted = []
-    top_points_redacted = []
-    for item in top_nw:
-        if "stats" in revealed["revealed"].get(item[0], {}) or item[0] == kd_id or galaxies_inverted[item[0]] == galaxies_inverted[kd_id]:
-            top_nw_redacted.append(item)
-        else:
-            top_nw_redacted.append(
-                ("", item[1])
-            )
-    for item in top_stars:
-        if "stats" in revealed["revealed"].get(item[0], {}) or item[0] == kd_id or galaxies_inverted[item[0]] == galaxies_inverted[kd_id]:
-            top_stars_redacted.append(item)
-        else:
-            top_stars_redacted.append(
-                ("", item[1])
-            )
-    for item in top_points:
-        if item[0] == kd_id or galaxies_inverted[item[0]] == galaxies_inverted[kd_id]:
-            top_points_redacted.append(item)
-        else:
-            top_points_redacted.append(
-                ("", item[1])
-            )
+    visibility_index = _get_visibility_index(kd_id, revealed, galaxies_inverted)
+    stats_keys = set(uas.REVEALED_ALLOWED_KEYS["stats"])
+
+    def _stats_visible(other_kd_id):
+        kingdom_info_keys = visibility_index["masks"].get(other_kd_id, visibility_index["default_mask"])
+        return other_kd_id == kd_id or kingdom_info_keys == None or stats_keys <= kingdom_info_keys
+
+    top_nw_redacted = [
+        item if _stats_visible(item[0]) else ("", item[1])
+        for item in top_nw
+    ]
+    top_stars_redacted = [
+        item if _stats_visible(item[0]) else ("", item[1])
+        for item in top_stars
+    ]
+    top_points_redacted = [
+        item if item[0] == kd_id or item[0] in visibility_index["galaxymates"] else ("", item[1])
+        for item in top_points
+    ]
         
     top_galaxy_networth = sorted(scores["galaxy_networth"].items(), key=lambda x: -x[1])
     payload = {
@@ -115,9 +194,13 @@ def get_scores():
     
     kd_id = flask_praetorian.current_user().kd_id
     revealed = _get_revealed(kd_id)
-    galaxies_inverted, _ = _get_galaxies_inverted()
-    scores_redacted = _get_scores_redacted(revealed, kd_id, galaxies_inverted)
-    return flask.jsonify(scores_redacted), 200
+    galaxies_doc = _get_galaxies_doc()
+    scores = _get_scores()
+    return _conditional_response(
+        "scores",
+        [kd_id, _get_doc_version(scores), _get_doc_version(revealed), _get_doc_version(galaxies_doc), _get_time_bucket()],
+        lambda: _get_scores_redacted(revealed, kd_id, _invert_galaxies(galaxies_doc["galaxies"]), scores=scores),
+    )
 
 @app.route('/api/kingdomid')
 @flask_praetorian.auth_required
@@ -143,7 +226,11 @@ def kingdom():
     )
     
     kd_info_parse = json.loads(kd_info.text)
-    return (flask.jsonify(kd_info_parse), 200)
+    return _conditional_response(
+        "kingdom",
+        [_get_doc_version(kd_info_parse)],
+        lambda: kd_info_parse,
+    )
 
 
 @app.route('/api/shields')
@@ -171,33 +258,41 @@ def shields():
         }
     }
 
-@app.route('/api/news')
-@flask_praetorian.auth_required
-# @flask_praetorian.roles_required('verified')
-def news():
-    kd_id = flask_praetorian.current_user().kd_id
-    
+def _get_news(kd_id):
     news = REQUESTS_SESSION.get(
         os.environ['AZURE_FUNCTION_ENDPOINT'] + f'/kingdom/{kd_id}/news',
         headers={'x-functions-key': os.environ['AZURE_FUNCTIONS_HOST_KEY']}
     )
     
     news_parse = json.loads(news.text)
-    return (flask.jsonify(news_parse["news"]), 200)
+    return news_parse["news"]
 
-@app.route('/api/messages')
+@app.route('/api/news')
 @flask_praetorian.auth_required
 # @flask_praetorian.roles_required('verified')
-def messages():
+def news():
     kd_id = flask_praetorian.current_user().kd_id
     
+    news = _get_news(kd_id)
+    return (flask.jsonify(news), 200)
+
+def _get_messages(kd_id):
     messages = REQUESTS_SESSION.get(
         os.environ['AZURE_FUNCTION_ENDPOINT'] + f'/kingdom/{kd_id}/messages',
         headers={'x-functions-key': os.environ['AZURE_FUNCTIONS_HOST_KEY']}
     )
     
     messages_parse = json.loads(messages.text)
-    return (flask.jsonify(messages_parse["messages"]), 200)
+    return messages_parse["messages"]
+
+@app.route('/api/messages')
+@flask_praetorian.auth_required
+# @flask_praetorian.roles_required('verified')
+def messages():
+    kd_id = flask_praetorian.current_user().kd_id
+    
+    messages = _get_messages(kd_id)
+    return (flask.jsonify(messages), 200)
 
 def _get_kingdoms():
     kd_info = REQUESTS_SESSION.get(
@@ -215,14 +310,17 @@ def kingdoms():
     kingdoms = _get_kingdoms()
     return (flask.jsonify(kingdoms), 200)
 
-def _get_galaxy_info():
+def _get_galaxies_doc():
     galaxy_info = REQUESTS_SESSION.get(
         os.environ['AZURE_FUNCTION_ENDPOINT'] + f'/galaxies',
         headers={'x-functions-key': os.environ['AZURE_FUNCTIONS_HOST_KEY']}
     )
     galaxy_info_parse = json.loads(galaxy_info.text)
     
-    return galaxy_info_parse["galaxies"]
+    return galaxy_info_parse
+
+def _get_galaxy_info():
+    return _get_galaxies_doc()["galaxies"]
 
 
 
@@ -231,16 +329,24 @@ def _get_galaxy_info():
 @flask_praetorian.auth_required
 # @flask_praetorian.roles_required('verified')
 def galaxies():
-    galaxy_info = _get_galaxy_info()
-    return (flask.jsonify(galaxy_info), 200)
-
-def _get_galaxies_inverted():
-    galaxy_info = _get_galaxy_info()
+    galaxies_doc = _get_galaxies_doc()
+    return _conditional_response(
+        "galaxies",
+        [_get_doc_version(galaxies_doc)],
+        lambda: galaxies_doc["galaxies"],
+    )
 
+def _invert_galaxies(galaxy_info):
     galaxies_inverted = {}
     for galaxy_name, kd_list in galaxy_info.items():
         for kd in kd_list:
             galaxies_inverted[kd] = galaxy_name
+    return galaxies_inverted
+
+def _get_galaxies_inverted():
+    galaxy_info = _get_galaxy_info()
+
+    galaxies_inverted = _invert_galaxies(galaxy_info)
     return galaxies_inverted, galaxy_info
 
 @app.route('/api/galaxies_inverted')
@@ -279,7 +385,11 @@ def _get_empires_inverted():
 # @flask_praetorian.roles_required('verified')
 def empires():
     empires = _get_empire_info()
-    return (flask.jsonify(empires["empires"]), 200)
+    return _conditional_response(
+        "empires",
+        [_get_doc_version(empires)],
+        lambda: empires["empires"],
+    )
 
 @app.route('/api/empires_inverted')
 @flask_praetorian.auth_required
@@ -314,12 +424,7 @@ def empire_politics():
     empire_politics = _get_empire_politics(kd_empire)
     return (flask.jsonify(empire_politics), 200)
 
-@app.route('/api/galaxynews')
-@flask_praetorian.auth_required
-# @flask_praetorian.roles_required('verified')
-def galaxy_news():
-    kd_id = flask_praetorian.current_user().kd_id
-    
+def _get_galaxy_news(kd_id):
     galaxies_inverted, _ = _get_galaxies_inverted()
     galaxy = galaxies_inverted[kd_id]
     
@@ -329,7 +434,16 @@ def galaxy_news():
     )
     
     news_parse = json.loads(news.text)
-    return (flask.jsonify(news_parse["news"]), 200)
+    return news_parse["news"]
+
+@app.route('/api/galaxynews')
+@flask_praetorian.auth_required
+# @flask_praetorian.roles_required('verified')
+def galaxy_news():
+    kd_id = flask_praetorian.current_user().kd_id
+    
+    news = _get_galaxy_news(kd_id)
+    return (flask.jsonify(news), 200)
 
 
 @app.route('/api/empirenews')
@@ -367,20 +481,33 @@ def universe_news():
 
 
 
+def _get_attack_history(kd_id):
+    history = REQUESTS_SESSION.get(
+        os.environ['AZURE_FUNCTION_ENDPOINT'] + f'/kingdom/{kd_id}/attackhistory',
+        headers={'x-functions-key': os.environ['AZURE_FUNCTIONS_HOST_KEY']}
+    )
+    
+    history_parse = json.loads(history.text)
+    return history_parse["attack_history"]
+
 @app.route('/api/attackhistory')
 @flask_praetorian.auth_required
 # @flask_praetorian.roles_required('verified')
 def attack_history():
     kd_id = flask_praetorian.current_user().kd_id
     
+    history = _get_attack_history(kd_id)
+    return (flask.jsonify(history), 200)
+
+
+def _get_spy_history(kd_id):
     history = REQUESTS_SESSION.get(
-        os.environ['AZURE_FUNCTION_ENDPOINT'] + f'/kingdom/{kd_id}/attackhistory',
+        os.environ['AZURE_FUNCTION_ENDPOINT'] + f'/kingdom/{kd_id}/spyhistory',
         headers={'x-functions-key': os.environ['AZURE_FUNCTIONS_HOST_KEY']}
     )
     
     history_parse = json.loads(history.text)
-    return (flask.jsonify(history_parse["attack_history"]), 200)
-
+    return history_parse["spy_history"]
 
 @app.route('/api/spyhistory')
 @flask_praetorian.auth_required
@@ -388,14 +515,18 @@ def attack_history():
 def spy_history():
     kd_id = flask_praetorian.current_user().kd_id
     
+    history = _get_spy_history(kd_id)
+    return (flask.jsonify(history), 200)
+
+
+def _get_missile_history(kd_id):
     history = REQUESTS_SESSION.get(
-        os.environ['AZURE_FUNCTION_ENDPOINT'] + f'/kingdom/{kd_id}/spyhistory',
+        os.environ['AZURE_FUNCTION_ENDPOINT'] + f'/kingdom/{kd_id}/missilehistory',
         headers={'x-functions-key': os.environ['AZURE_FUNCTIONS_HOST_KEY']}
     )
     
     history_parse = json.loads(history.text)
-    return (flask.jsonify(history_parse["spy_history"]), 200)
-
+    return history_parse["missile_history"]
 
 @app.route('/api/missilehistory')
 @flask_praetorian.auth_required
@@ -403,13 +534,8 @@ def spy_history():
 def missile_history():
     kd_id = flask_praetorian.current_user().kd_id
     
-    history = REQUESTS_SESSION.get(
-        os.environ['AZURE_FUNCTION_ENDPOINT'] + f'/kingdom/{kd_id}/missilehistory',
-        headers={'x-functions-key': os.environ['AZURE_FUNCTIONS_HOST_KEY']}
-    )
-    
-    history_parse = json.loads(history.text)
-    return (flask.jsonify(history_parse["missile_history"]), 200)
+    history = _get_missile_history(kd_id)
+    return (flask.jsonify(history), 200)
 
 
 def _calc_units(
@@ -439,7 +565,7 @@ def _calc_units(
             key: 0
             for key in uas.UNITS.keys()
         }
-        max_time = start_time + datetime.timedelta(hours=hours)
+        max_time = start_time + datetime.timedelta(hours=hours) / uas.GAME_SPEED
         for mobi in mobis_units:
             
             
@@ -451,8 +577,7 @@ def _calc_units(
         units[f"hour_{hours}"] = hour_units
     return units
 
-def _calc_max_offense(
-    unit_dict,
+def _calc_offense_multiplier(
     military_bonus=0.25,
     other_bonuses=0.0,
     generals=4,
@@ -473,11 +598,7 @@ def _calc_max_offense(
         int_surprise_war_penalty = 0
     else:
         int_surprise_war_penalty = int(surprise_war_penalty)
-    raw_attack = sum([
-        stat_map["offense"] * unit_dict.get(key, 0)
-        for key, stat_map in uas.UNITS.items() 
-    ])
-    attack_w_bonuses = raw_attack * (
+    return (
         1
         + uas.GAME_FUNCS["BASE_GENERALS_BONUS"](generals)
         + military_bonus
@@ -488,6 +609,32 @@ def _calc_max_offense(
         + (int_war * uas.GAME_CONFIG["WAR_OFFENSE_INCREASE"])
         + (int_surprise_war_penalty * uas.GAME_CONFIG["SURPRISE_WAR_PENALTY_OFFENSE_INCREASE"])
     )
+
+def _calc_max_offense(
+    unit_dict,
+    military_bonus=0.25,
+    other_bonuses=0.0,
+    generals=4,
+    fuelless=False,
+    lumina=False,
+    denounced=False,
+    war=False,
+    surprise_war_penalty=False,
+):
+    raw_attack = sum([
+        stat_map["offense"] * unit_dict.get(key, 0)
+        for key, stat_map in uas.UNITS.items() 
+    ])
+    attack_w_bonuses = raw_attack * _calc_offense_multiplier(
+        military_bonus=military_bonus,
+        other_bonuses=other_bonuses,
+        generals=generals,
+        fuelless=fuelless,
+        lumina=lumina,
+        denounced=denounced,
+        war=war,
+        surprise_war_penalty=surprise_war_penalty,
+    )
     return math.floor(attack_w_bonuses)
 
 def _calc_max_defense(
@@ -570,34 +717,42 @@ def _get_units_adjusted_costs(state):
 
     return units_desc
 
-def _get_mobis_queue(kd_id):
+def _get_mobis_doc(kd_id):
     mobis_info = REQUESTS_SESSION.get(
         os.environ['AZURE_FUNCTION_ENDPOINT'] + f'/kingdom/{kd_id}/mobis',
         headers={'x-functions-key': os.environ['AZURE_FUNCTIONS_HOST_KEY']}
     )
     
     mobis_info_parse = json.loads(mobis_info.text)
-    return mobis_info_parse["mobis"]
+    return mobis_info_parse
 
-def _get_mobis(kd_id):
-    
+def _get_mobis_queue(kd_id):
+    return _get_mobis_doc(kd_id)["mobis"]
 
-    kd_info = REQUESTS_SESSION.get(
-        os.environ['AZURE_FUNCTION_ENDPOINT'] + f'/kingdom/{kd_id}',
-        headers={'x-functions-key': os.environ['AZURE_FUNCTIONS_HOST_KEY']}
-    )
-    
-    kd_info_parse = json.loads(kd_info.text)
+def _get_mobis_inputs(kd_id):
+    galaxies_inverted, _ = _get_galaxies_inverted()
+    galaxy_policies, _ = _get_galaxy_politics(kd_id, galaxies_inverted[kd_id])
+    return {
+        "kd_info": _get_kd_info(kd_id),
+        "mobis": _get_mobis_doc(kd_id),
+        "state": _get_state(),
+        "galaxy_policies": galaxy_policies,
+    }
 
-    mobis_info_parse = _get_mobis_queue(kd_id)
+def _get_mobis(kd_id):
+    return _build_mobis(_get_mobis_inputs(kd_id))
+
+def _build_mobis(inputs):
+    kd_info_parse = inputs["kd_info"]
+    mobis_info_parse = inputs["mobis"]["mobis"]
     current_units = kd_info_parse["units"]
     generals_units = kd_info_parse["generals_out"]
     mobis_units = mobis_info_parse
 
-    state = _get_state()
+    state = inputs["state"]
 
     start_time = max(
-        datetime.datetime.now(datetime.timezone.utc),
+        CLOCK.now(),
         datetime.datetime.fromisoformat(state["state"]["game_start"]).astimezone(datetime.timezone.utc)
     )
     units = _calc_units(start_time, current_units, generals_units, mobis_units)
@@ -609,8 +764,7 @@ def _get_mobis(kd_id):
     )[:10]
     len_queue = len(mobis_info_parse)
 
-    galaxies_inverted, _ = _get_galaxies_inverted()
-    galaxy_policies, _ = _get_galaxy_politics(kd_id, galaxies_inverted[kd_id])
+    galaxy_policies = inputs["galaxy_policies"]
     is_conscription = "Conscription" in galaxy_policies["active_policies"]
     recruit_time = _calc_recruit_time(is_conscription, (uas.GAME_CONFIG["BASE_RECRUIT_TIME_MIN_MULTIPLIER"] + uas.GAME_CONFIG["BASE_RECRUIT_TIME_MAX_MUTLIPLIER"]) / 2)
 
@@ -639,8 +793,12 @@ def _get_mobis(kd_id):
 # @flask_praetorian.roles_required('verified')
 def mobis():
     kd_id = flask_praetorian.current_user().kd_id
-    payload = _get_mobis(kd_id)
-    return (flask.jsonify(payload), 200)
+    inputs = _get_mobis_inputs(kd_id)
+    return _conditional_response(
+        "mobis",
+        [_get_doc_version(doc) for doc in inputs.values()] + [_get_time_bucket()],
+        lambda: _build_mobis(inputs),
+    )
 
 
 def _calc_structures(
@@ -685,21 +843,25 @@ def _calc_available_structures(structure_price, kd_info, structures_info):
     return max_available_structures, current_available_structures
 
 
-def _get_structures_info(kd_id):
-    
+def _get_structures_inputs(kd_id):
     structures_info = REQUESTS_SESSION.get(
         os.environ['AZURE_FUNCTION_ENDPOINT'] + f'/kingdom/{kd_id}/structures',
         headers={'x-functions-key': os.environ['AZURE_FUNCTIONS_HOST_KEY']}
     )
     
     structures_info_parse = json.loads(structures_info.text)
+    return {
+        "structures": structures_info_parse,
+        "kd_info": _get_kd_info(kd_id),
+        "state": _get_state(),
+    }
 
-    kd_info = REQUESTS_SESSION.get(
-        os.environ['AZURE_FUNCTION_ENDPOINT'] + f'/kingdom/{kd_id}',
-        headers={'x-functions-key': os.environ['AZURE_FUNCTIONS_HOST_KEY']}
-    )
-    
-    kd_info_parse = json.loads(kd_info.text)
+def _get_structures_info(kd_id):
+    return _build_structures_info(_get_structures_inputs(kd_id))
+
+def _build_structures_info(inputs):
+    structures_info_parse = inputs["structures"]
+    kd_info_parse = inputs["kd_info"]
 
     top_queue = sorted(
         structures_info_parse["structures"],
@@ -711,10 +873,10 @@ def _get_structures_info(kd_id):
     current_structures = kd_info_parse["structures"]
     building_structures = structures_info_parse["structures"]
 
-    state = _get_state()
+    state = inputs["state"]
 
     start_time = max(
-        datetime.datetime.now(datetime.timezone.utc),
+        CLOCK.now(),
         datetime.datetime.fromisoformat(state["state"]["game_start"]).astimezone(datetime.timezone.utc)
     )
     structures = _calc_structures(start_time, current_structures, building_structures)
@@ -737,9 +899,12 @@ def _get_structures_info(kd_id):
 # @flask_praetorian.roles_required('verified')
 def structures():
     kd_id = flask_praetorian.current_user().kd_id
-    payload = _get_structures_info(kd_id)
-
-    return (flask.jsonify(payload), 200)
+    inputs = _get_structures_inputs(kd_id)
+    return _conditional_response(
+        "structures",
+        [_get_doc_version(doc) for doc in inputs.values()] + [_get_time_bucket()],
+        lambda: _build_structures_info(inputs),
+    )
 
 
 def _get_kd_info(kd_id):
@@ -752,38 +917,116 @@ def _get_kd_info(kd_id):
     return kd_info_parse
 
 
-def _get_max_kd_info(other_kd_id, kd_id, revealed_info, max=False, galaxies_inverted=None):
-    if galaxies_inverted == None:
-        galaxies_inverted, _ = _get_galaxies_inverted()
-    always_allowed_keys = {"name", "race", "status", "coordinate"}
-    allowed_keys = {
-        "stats": ["stars", "networth"],
-        "kingdom": ["stars", "fuel", "population", "networth", "money", "missiles"],
-        "military": ["units", "generals_available", "generals_out"],
-        "structures": ["structures"],
-        "shields": ["shields"],
-        "projects": ["projects_points", "projects_max_points", "projects_assigned", "completed_projects"],
-        "drones": ["drones", "spy_attempts"],
+def _get_current_bonuses(kd_info):
+    return {
+        project: project_dict.get("max_bonus", 0) * min(kd_info["projects_points"][project] / kd_info["projects_max_points"][project], 1.0)
+        for project, project_dict in uas.PROJECTS.items()
+        if "max_bonus" in project_dict
     }
-    kd_info = REQUESTS_SESSION.get(
-        os.environ['AZURE_FUNCTION_ENDPOINT'] + f'/kingdom/{other_kd_id}',
-        headers={'x-functions-key': os.environ['AZURE_FUNCTIONS_HOST_KEY']}
+
+
+def _get_delta_patch(kd_id, views):
+    """Build the new values of the frontend views a websocket event marks as changed
+
+    Views that fail to build are left out so the client falls back to refetching them.
+    """
+    delta_views = {
+        "kingdom": _get_kd_info,
+        "mobis": _get_mobis,
+        "news": _get_news,
+        "galaxynews": _get_galaxy_news,
+        "messages": _get_messages,
+        "attackhistory": _get_attack_history,
+        "spyhistory": _get_spy_history,
+        "missilehistory": _get_missile_history,
+        "notifs": _get_notifs,
+    }
+    patch = {}
+    for view in views:
+        if view not in delta_views:
+            continue
+        try:
+            patch[view] = delta_views[view](kd_id)
+        except Exception as e:
+            app.logger.warning('Error building %s delta for %s: %s', view, kd_id, str(e))
+    return patch
+
+
+def _get_kds_info(kd_ids, fields=None):
+    payload = {"kd_ids": kd_ids}
+    if fields != None:
+        payload["fields"] = sorted(fields)
+    kds_info = REQUESTS_SESSION.post(
+        os.environ['AZURE_FUNCTION_ENDPOINT'] + f'/kingdoms/bulk',
+        headers={'x-functions-key': os.environ['AZURE_FUNCTIONS_HOST_KEY']},
+        data=json.dumps(payload),
     )
     
-    kd_info_parse = json.loads(kd_info.text)
-    if max:
-        return kd_info_parse
+    kds_info_parse = json.loads(kds_info.text)
+    return kds_info_parse["kingdoms"]
 
-    if other_kd_id in revealed_info["revealed_galaxymates"]:
-        return kd_info_parse
-    
-    revealed_categories = revealed_info["revealed"].get(other_kd_id, {}).keys()
-    kingdom_info_keys = always_allowed_keys
-    for revealed_category in revealed_categories:
-        kingdom_info_keys = kingdom_info_keys.union(allowed_keys[revealed_category])
+def _build_visibility_index(revealed_info, galaxymates, fingerprint):
+    default_mask = frozenset(uas.REVEALED_ALWAYS_ALLOWED_KEYS)
+    masks = {}
+    for other_kd_id, revealed_dict in revealed_info["revealed"].items():
+        kingdom_info_keys = set(default_mask)
+        # Categories stay visible until the revealed resolve removes them
+        for revealed_category in revealed_dict:
+            kingdom_info_keys.update(uas.REVEALED_ALLOWED_KEYS[revealed_category])
+        masks[other_kd_id] = frozenset(kingdom_info_keys)
+
+    for other_kd_id in galaxymates:
+        masks[other_kd_id] = masks.get(other_kd_id, default_mask).union(uas.REVEALED_ALLOWED_KEYS["stats"])
 
-    if galaxies_inverted[other_kd_id] == galaxies_inverted[kd_id]:
-        kingdom_info_keys = kingdom_info_keys.union(allowed_keys["stats"])
+    for other_kd_id in revealed_info["revealed_galaxymates"]:
+        masks[other_kd_id] = None
+
+    return {
+        "fingerprint": fingerprint,
+        "default_mask": default_mask,
+        "masks": masks,
+        "galaxymates": galaxymates,
+    }
+
+def _get_visibility_index(kd_id, revealed_info, galaxies_inverted):
+    """Return the viewer's field masks, rebuilding them only when intel or galaxy membership changed
+
+    Masks are None for kingdoms whose full info is visible. At most
+    VISIBILITY_INDEX_MAX_VIEWERS viewers are kept.
+    """
+    kd_galaxy = galaxies_inverted.get(kd_id)
+    galaxymates = frozenset(
+        other_kd_id
+        for other_kd_id, galaxy_id in galaxies_inverted.items()
+        if galaxy_id == kd_galaxy
+    )
+    revealed_fingerprint = revealed_info.get("_etag") or json.dumps(
+        [revealed_info["revealed"], revealed_info["revealed_galaxymates"]],
+        sort_keys=True,
+    )
+    fingerprint = (revealed_fingerprint, galaxymates)
+
+    with VISIBILITY_INDEX_LOCK:
+        visibility_index = VISIBILITY_INDEX.get(kd_id)
+        if visibility_index != None:
+            VISIBILITY_INDEX.move_to_end(kd_id)
+    if visibility_index == None or visibility_index["fingerprint"] != fingerprint:
+        visibility_index = _build_visibility_index(revealed_info, galaxymates, fingerprint)
+        with VISIBILITY_INDEX_LOCK:
+            VISIBILITY_INDEX[kd_id] = visibility_index
+            VISIBILITY_INDEX.move_to_end(kd_id)
+            while len(VISIBILITY_INDEX) > VISIBILITY_INDEX_MAX_VIEWERS:
+                VISIBILITY_INDEX.popitem(last=False)
+    return visibility_index
+
+def _get_max_kd_info_keys(other_kd_id, kd_id, revealed_info, galaxies_inverted):
+    """Return the kingdom keys kd_id may see of other_kd_id, or None if it may see everything"""
+    visibility_index = _get_visibility_index(kd_id, revealed_info, galaxies_inverted)
+    return visibility_index["masks"].get(other_kd_id, visibility_index["default_mask"])
+
+def _redact_kd_info(kd_info_parse, kingdom_info_keys):
+    if kingdom_info_keys == None:
+        return kd_info_parse
 
     kd_info_parse_allowed = {
         k: v
@@ -796,11 +1039,7 @@ def _get_max_kd_info(other_kd_id, kd_id, revealed_info, max=False, galaxies_inve
             for project, project_dict in uas.PROJECTS.items()
             if "max_bonus" in project_dict
         }
-        kd_info_parse_allowed["current_bonuses"] = {
-            project: project_dict.get("max_bonus", 0) * min(kd_info_parse_allowed["projects_points"][project] / kd_info_parse_allowed["projects_max_points"][project], 1.0)
-            for project, project_dict in uas.PROJECTS.items()
-            if "max_bonus" in project_dict
-        }
+        kd_info_parse_allowed["current_bonuses"] = _get_current_bonuses(kd_info_parse)
         kd_info_parse_allowed["engineers"] = kd_info_parse["units"]["engineers"]
         try:
             kd_info_parse_allowed["units"]["engineers"] = kd_info_parse["units"]["engineers"]
@@ -810,6 +1049,21 @@ def _get_max_kd_info(other_kd_id, kd_id, revealed_info, max=False, galaxies_inve
             }
     return kd_info_parse_allowed
 
+def _get_max_kd_info(other_kd_id, kd_id, revealed_info, max=False, galaxies_inverted=None):
+    if galaxies_inverted == None:
+        galaxies_inverted, _ = _get_galaxies_inverted()
+    kd_info = REQUESTS_SESSION.get(
+        os.environ['AZURE_FUNCTION_ENDPOINT'] + f'/kingdom/{other_kd_id}',
+        headers={'x-functions-key': os.environ['AZURE_FUNCTIONS_HOST_KEY']}
+    )
+    
+    kd_info_parse = json.loads(kd_info.text)
+    if max:
+        return kd_info_parse
+
+    kingdom_info_keys = _get_max_kd_info_keys(other_kd_id, kd_id, revealed_info, galaxies_inverted)
+    return _redact_kd_info(kd_info_parse, kingdom_info_keys)
+
 
 @app.route('/api/kingdom/<other_kd_id>', methods=['GET'])
 @flask_praetorian.auth_required
@@ -1108,11 +1362,7 @@ def projects():
         for project, project_dict in uas.PROJECTS.items()
         if "max_bonus" in project_dict
     }
-    current_bonuses = {
-        project: project_dict.get("max_bonus", 0) * min(kd_info_parse["projects_points"][project] / kd_info_parse["projects_max_points"][project], 1.0)
-        for project, project_dict in uas.PROJECTS.items()
-        if "max_bonus" in project_dict
-    }
+    current_bonuses = _get_current_bonuses(kd_info_parse)
     available_engineers = kd_info_parse["units"]["engineers"] - sum(kd_info_parse["projects_assigned"].values())
 
     payload = {
@@ -1139,6 +1389,7 @@ def revealed():
     kd_id = flask_praetorian.current_user().kd_id
     
     revealed_info = _get_revealed(kd_id)
+    revealed_info.pop("expiry_index", None)
     return (flask.jsonify(revealed_info), 200)
 
 def _get_shared(kd_id):
@@ -1157,6 +1408,7 @@ def shared():
     kd_id = flask_praetorian.current_user().kd_id
     
     shared_info = _get_shared(kd_id)
+    shared_info.pop("expiry_index", None)
     return (flask.jsonify(shared_info), 200)
 
 def _get_pinned(kd_id):
@@ -1177,13 +1429,32 @@ def pinned():
     pinned_info = _get_pinned(kd_id)
     return (flask.jsonify(pinned_info["pinned"]), 200)
 
-def _get_max_kingdoms(kd_id, kingdoms):
-    revealed_info = _get_revealed(kd_id)
-    galaxies_inverted, _ = _get_galaxies_inverted()
+def _get_max_kingdoms(kd_id, kingdoms, revealed_info=None, galaxies_inverted=None):
+    if revealed_info == None:
+        revealed_info = _get_revealed(kd_id)
+    if galaxies_inverted == None:
+        galaxies_inverted, _ = _get_galaxies_inverted()
+
+    if not kingdoms:
+        return {}
+
+    visibility_index = _get_visibility_index(kd_id, revealed_info, galaxies_inverted)
+    kingdoms_info_keys = {
+        other_kd_id: visibility_index["masks"].get(other_kd_id, visibility_index["default_mask"])
+        for other_kd_id in kingdoms
+    }
+    if any(keys == None for keys in kingdoms_info_keys.values()):
+        fields = None
+    else:
+        fields = set().union(*kingdoms_info_keys.values())
+        if "projects_points" in fields:
+            fields.add("units")
+    kds_info = _get_kds_info(list(kingdoms), fields)
 
     payload = {
-        other_kd_id: _get_max_kd_info(other_kd_id, kd_id, revealed_info, galaxies_inverted=galaxies_inverted)
+        other_kd_id: _redact_kd_info(kds_info[other_kd_id], kingdoms_info_keys[other_kd_id])
         for other_kd_id in kingdoms
+        if other_kd_id in kds_info
     }
     return payload
 
@@ -1317,4 +1588,4 @@ def get_history():
 @app.route('/api/time')
 @flask_praetorian.auth_required
 def get_time():
-    return (flask.jsonify(datetime.datetime.now(datetime.timezone.utc).isoformat()), 200)
\ No newline at end of file
+    return (flask.jsonify(CLOCK.now().isoformat()), 200)
\ No newline at end of file
@@ -0,0 +1,64 @@
+import threading
+import time
+
+IDENTITY_FIELDS = ["id", "username", "roles", "kd_id", "kd_created", "is_active", "kd_death_date"]
+
+
+class CachedIdentity:
+    """Read-only snapshot of the User fields needed to authenticate and route a request"""
+
+    def __init__(self, **fields):
+        for field in IDENTITY_FIELDS:
+            setattr(self, field, fields.get(field))
+
+    @classmethod
+    def from_user(cls, user):
+        return cls(**{field: getattr(user, field) for field in IDENTITY_FIELDS})
+
+    @property
+    def rolenames(self):
+        try:
+            return self.roles.split(',')
+        except Exception:
+            return []
+
+    @property
+    def identity(self):
+        return self.id
+
+    def is_valid(self):
+        return self.is_active
+
+
+class IdentityCache:
+    """Process cache of user id to CachedIdentity with a short TTL"""
+
+    def __init__(self, ttl=30.0):
+        self.ttl = ttl
+        self.identities = {}
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, user_id, load):
+        with self._lock:
+            cached = self.identities.get(user_id)
+        if cached is not None and time.monotonic() - cached[0] < self.ttl:
+            self.hits += 1
+            return cached[1]
+        self.misses += 1
+        user = load(user_id)
+        if user is None:
+            return None
+        identity = CachedIdentity.from_user(user)
+        with self._lock:
+            self.identities[user_id] = (time.monotonic(), identity)
+        return identity
+
+    def invalidate(self, user_ids=None):
+        with self._lock:
+            if user_ids is None:
+                self.identities.clear()
+                return
+            for user_id in user_ids:
+                self.identities.pop(user_id, None)
@@ -0,0 +1,76 @@
+import json
+import os
+import secrets
+import threading
+
+# Stands in for passwords in journaled request bodies; replays sign up with it
+JOURNAL_REDACTED = "journal-redacted"
+JOURNAL_REDACTED_KEYS = {"password"}
+
+
+def new_seed():
+    return secrets.randbits(63)
+
+
+def redact(body):
+    if not isinstance(body, dict):
+        return body
+    return {
+        key: JOURNAL_REDACTED if key in JOURNAL_REDACTED_KEYS else value
+        for key, value in body.items()
+    }
+
+
+class ActionJournal:
+    """
+    Append-only JSON-lines journal of the actions that change the game
+
+    Every entry is appended with a single write to a file opened in append mode,
+    so processes sharing the file never interleave lines. Entries are written when
+    their action finishes, which is the order a replay re-executes them in.
+    Disabled when path is None.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self._fd = None
+        self._lock = threading.Lock()
+        self.stats = {
+            "entries": 0,
+            "bytes": 0,
+        }
+
+    @property
+    def enabled(self):
+        return self.path is not None
+
+    def record(self, entry):
+        if not self.enabled:
+            return
+        line = (json.dumps(entry, separators=(",", ":"), default=str) + "\n").encode()
+        with self._lock:
+            if self._fd is None:
+                self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+            os.write(self._fd, line)
+            self.stats["entries"] += 1
+            self.stats["bytes"] += len(line)
+
+    def size(self):
+        """Bytes journaled so far, from every process; where a replay from a snapshot taken now starts"""
+        if not self.enabled or not os.path.exists(self.path):
+            return 0
+        return os.path.getsize(self.path)
+
+    def close(self):
+        with self._lock:
+            if self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
+
+
+def read_journal(path, offset=0):
+    with open(path) as journal_file:
+        journal_file.seek(offset)
+        for line in journal_file:
+            if line.strip():
+                yield json.loads(line)
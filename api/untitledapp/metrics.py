@@ -0,0 +1,152 @@
+import bisect
+import collections
+import re
+import threading
+import urllib.parse
+
+LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+ID_SEGMENT = re.compile(r"\d")
+
+_LOCAL = threading.local()
+
+
+def normalize_target(url):
+    """Collapse ids in a backend URL path so calls group by route, e.g. /kingdom/{id}/news"""
+    path = urllib.parse.urlsplit(url).path
+    segments = [
+        "{id}" if ID_SEGMENT.search(segment) else segment
+        for segment in path.split("/")
+    ]
+    target = "/".join(segments)
+    if target.startswith("/api/"):
+        target = target[len("/api"):]
+    return target
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class BackendMetrics:
+    """
+    Counts backend calls, bytes and latency per Flask route (or phase) and target path
+
+    The labels of the current thread are set by the request hooks or by
+    set_phase() for background work such as the refresh tick.
+    """
+
+    def __init__(self):
+        self.backend_calls = collections.Counter()
+        self.backend_bytes_sent = collections.Counter()
+        self.backend_bytes_received = collections.Counter()
+        self.backend_latency = collections.defaultdict(Histogram)
+        self.route_calls = collections.Counter()
+        self.route_latency = collections.defaultdict(Histogram)
+        self._lock = threading.Lock()
+
+    def labels(self):
+        return getattr(_LOCAL, "route", "background"), getattr(_LOCAL, "phase", "")
+
+    def set_route(self, route):
+        _LOCAL.route = route
+        _LOCAL.calls = []
+
+    def clear_route(self):
+        calls = getattr(_LOCAL, "calls", [])
+        _LOCAL.route = "background"
+        _LOCAL.calls = []
+        return calls
+
+    def set_phase(self, phase):
+        previous = getattr(_LOCAL, "phase", "")
+        _LOCAL.phase = phase
+        return previous
+
+    def call_count(self):
+        """Backend calls made by the current thread so far"""
+        return getattr(_LOCAL, "call_count", 0)
+
+    def record_backend_call(self, method, url, status, bytes_sent, bytes_received, seconds):
+        route, phase = self.labels()
+        _LOCAL.call_count = getattr(_LOCAL, "call_count", 0) + 1
+        target = normalize_target(url)
+        with self._lock:
+            self.backend_calls[(route, phase, method, target, str(status))] += 1
+            self.backend_bytes_sent[(route, phase, target)] += bytes_sent
+            self.backend_bytes_received[(route, phase, target)] += bytes_received
+            self.backend_latency[(route, phase, target)].observe(seconds)
+        calls = getattr(_LOCAL, "calls", None)
+        if calls is not None:
+            calls.append((method, target, status, bytes_sent, bytes_received, seconds))
+
+    def record_route(self, route, method, status, seconds):
+        with self._lock:
+            self.route_calls[(route, method, str(status))] += 1
+            self.route_latency[route].observe(seconds)
+
+    def record_response(self, response, *args, **kwargs):
+        """requests response hook"""
+        request = response.request
+        body = request.body or b""
+        if isinstance(body, str):
+            body = body.encode()
+        self.record_backend_call(
+            request.method,
+            request.url,
+            response.status_code,
+            len(body),
+            len(response.content or b""),
+            response.elapsed.total_seconds(),
+        )
+
+    def render(self):
+        """Render all metrics in the Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            lines.append("# TYPE untitledapp_backend_requests_total counter")
+            for (route, phase, method, target, status), value in sorted(self.backend_calls.items()):
+                lines.append(
+                    f'untitledapp_backend_requests_total{{route="{route}",phase="{phase}",method="{method}",target="{target}",status="{status}"}} {value}'
+                )
+            for name, counter in [
+                ("untitledapp_backend_request_bytes_total", self.backend_bytes_sent),
+                ("untitledapp_backend_response_bytes_total", self.backend_bytes_received),
+            ]:
+                lines.append(f"# TYPE {name} counter")
+                for (route, phase, target), value in sorted(counter.items()):
+                    lines.append(f'{name}{{route="{route}",phase="{phase}",target="{target}"}} {value}')
+            lines.append("# TYPE untitledapp_backend_request_seconds histogram")
+            for (route, phase, target), histogram in sorted(self.backend_latency.items()):
+                lines.extend(_render_histogram(
+                    "untitledapp_backend_request_seconds",
+                    f'route="{route}",phase="{phase}",target="{target}"',
+                    histogram,
+                ))
+            lines.append("# TYPE untitledapp_http_requests_total counter")
+            for (route, method, status), value in sorted(self.route_calls.items()):
+                lines.append(f'untitledapp_http_requests_total{{route="{route}",method="{method}",status="{status}"}} {value}')
+            lines.append("# TYPE untitledapp_http_request_seconds histogram")
+            for route, histogram in sorted(self.route_latency.items()):
+                lines.extend(_render_histogram("untitledapp_http_request_seconds", f'route="{route}"', histogram))
+        return "\n".join(lines) + "\n"
+
+
+def _render_histogram(name, labels, histogram):
+    lines = []
+    cumulative = 0
+    for bucket, count in zip(histogram.buckets + [float("inf")], histogram.counts):
+        cumulative += count
+        le = "+Inf" if bucket == float("inf") else repr(bucket)
+        lines.append(f'{name}_bucket{{{labels},le="{le}"}} {cumulative}')
+    lines.append(f"{name}_sum{{{labels}}} {histogram.sum}")
+    lines.append(f"{name}_count{{{labels}}} {histogram.count}")
+    return lines
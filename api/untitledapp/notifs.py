@@ -0,0 +1,134 @@
+import atexit
+import collections
+import logging
+import threading
+import time
+
+LOGGER = logging.getLogger(__name__)
+
+
+class NotifAggregator:
+    """Coalesces notif category changes per kingdom and flushes them as one write per window
+
+    The frontend only checks whether a category is non-zero, so repeated adds of
+    a category within a window are deduplicated. Adds and clears of the same
+    category cancel out so the batched write (adds, then clears) keeps the
+    order they were made in. A kingdom's batch that fails to write is requeued
+    up to max_retries times, then dropped.
+    """
+
+    def __init__(self, reader, writer, window=1.0, max_retries=5):
+        self.reader = reader
+        self.writer = writer
+        self.window = window
+        self.max_retries = max_retries
+        self.retries = collections.Counter()
+        self.pending_add = collections.defaultdict(set)
+        self.pending_clear = collections.defaultdict(set)
+        self.snapshots = {}
+        self.flushed = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self._lock = threading.Lock()
+        self._thread = None
+        atexit.register(self.flush)
+
+    def add(self, kd_id, categories):
+        with self._lock:
+            for category in categories:
+                if category in self.pending_add[kd_id]:
+                    self.coalesced += 1
+                self.pending_add[kd_id].add(category)
+                self.pending_clear[kd_id].discard(category)
+        self._start()
+
+    def clear(self, kd_id, categories):
+        with self._lock:
+            for category in categories:
+                self.pending_clear[kd_id].add(category)
+                self.pending_add[kd_id].discard(category)
+        self._start()
+
+    def get(self, kd_id):
+        with self._lock:
+            snapshot = self.snapshots.get(kd_id)
+        if snapshot is None or time.monotonic() - snapshot[0] > self.window:
+            notifs = self.reader(kd_id)
+            with self._lock:
+                self.snapshots[kd_id] = (time.monotonic(), notifs)
+        else:
+            notifs = snapshot[1]
+        with self._lock:
+            return self._apply(
+                notifs,
+                self.pending_add.get(kd_id, ()),
+                self.pending_clear.get(kd_id, ()),
+            )
+
+    def flush(self):
+        with self._lock:
+            pending_add, self.pending_add = self.pending_add, collections.defaultdict(set)
+            pending_clear, self.pending_clear = self.pending_clear, collections.defaultdict(set)
+        for kd_id in set(pending_add) | set(pending_clear):
+            add_categories = sorted(pending_add.get(kd_id, ()))
+            clear_categories = sorted(pending_clear.get(kd_id, ()))
+            if not add_categories and not clear_categories:
+                continue
+            try:
+                self.writer(kd_id, add_categories, clear_categories)
+                self.flushed += 1
+                self.retries.pop(kd_id, None)
+            except Exception as e:
+                self.retries[kd_id] += 1
+                if self.retries[kd_id] > self.max_retries:
+                    LOGGER.warning(
+                        'Dropping notifs for %s after %s failed flushes (add %s, clear %s): %s',
+                        kd_id, self.max_retries + 1, add_categories, clear_categories, str(e),
+                    )
+                    self.retries.pop(kd_id)
+                    self.dropped += 1
+                    continue
+                LOGGER.warning('Error flushing notifs for %s: %s', kd_id, str(e))
+                with self._lock:
+                    for category in add_categories:
+                        if category not in self.pending_clear[kd_id]:
+                            self.pending_add[kd_id].add(category)
+                    for category in clear_categories:
+                        if category not in self.pending_add[kd_id]:
+                            self.pending_clear[kd_id].add(category)
+                continue
+            with self._lock:
+                if kd_id in self.snapshots:
+                    self.snapshots[kd_id] = (
+                        self.snapshots[kd_id][0],
+                        self._apply(self.snapshots[kd_id][1], add_categories, clear_categories),
+                    )
+
+    def stats(self):
+        with self._lock:
+            return {
+                "pending": len(set(self.pending_add) | set(self.pending_clear)),
+                "snapshots": len(self.snapshots),
+                "flushed": self.flushed,
+                "coalesced": self.coalesced,
+                "dropped": self.dropped,
+            }
+
+    def _apply(self, notifs, add_categories, clear_categories):
+        notifs = dict(notifs)
+        for category in add_categories:
+            notifs[category] = notifs.get(category, 0) + 1
+        for category in clear_categories:
+            notifs[category] = 0
+        return notifs
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.window)
+            self.flush()
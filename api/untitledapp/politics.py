@@ -5,14 +5,13 @@ import itertools
 import json
 import math
 import os
-import random
 
 import flask
 import flask_praetorian
 
 import untitledapp.getters as uag
 import untitledapp.shared as uas
-from untitledapp import app, alive_required, start_required, REQUESTS_SESSION, SOCK_HANDLERS
+from untitledapp import app, alive_required, start_required, CLOCK, REQUESTS_SESSION
 
 @app.route('/api/galaxypolitics/leader', methods=['POST'])
 @flask_praetorian.auth_required
@@ -505,7 +504,7 @@ def leave_empire():
 
     if len(empires_info[kd_empire]["galaxies"]) > 0 and empire_politics["leader"] == kd_galaxy_id:
         kd_empire_payload = {
-            "leader": random.choice(empires_info[kd_empire]["galaxies"])
+            "leader": uas.RNG.get().choice(empires_info[kd_empire]["galaxies"])
         }
 
         empire_response = REQUESTS_SESSION.patch(
@@ -549,7 +548,7 @@ def denounce(target_empire):
     
     empires_info["empires"][kd_empire]["denounced"] = target_empire
 
-    time_now = datetime.datetime.now(datetime.timezone.utc)
+    time_now = CLOCK.now()
     time_denounce_expires = time_now + datetime.timedelta(
         seconds=uas.GAME_CONFIG["BASE_EPOCH_SECONDS"] * uas.GAME_CONFIG["DENOUNCE_DURATION_MULTIPLIER"]
     )
@@ -621,7 +620,7 @@ def declare_war(target_empire):
     empires_info["empires"][kd_empire]["war"].append(target_empire)
     empires_info["empires"][target_empire]["war"].append(kd_empire)
 
-    time_now = datetime.datetime.now(datetime.timezone.utc)
+    time_now = CLOCK.now()
     time_surprise_war_expires = time_now + datetime.timedelta(
         seconds=uas.GAME_CONFIG["BASE_EPOCH_SECONDS"] * uas.GAME_CONFIG["SURPRISE_WAR_PENALTY_MULTIPLIER"]
     )
@@ -1085,7 +1084,7 @@ def _surrender(
         if empire_id != winning_empire
     ]
 
-    time_now = datetime.datetime.now(datetime.timezone.utc)
+    time_now = CLOCK.now()
     time_peace_expires = time_now + datetime.timedelta(
         seconds=uas.GAME_CONFIG["BASE_EPOCH_SECONDS"] * uas.GAME_CONFIG["PEACE_DURATION_MULTIPLIER"]
     )
@@ -4,109 +4,79 @@ import datetime
 import json
 import math
 import os
-import random
+import secrets
+import socket
+import tempfile
+import threading
+import time
 
 import flask
 import flask_praetorian
-from flask_sock import Sock, ConnectionClosed
 
+import untitledapp.account as uaa
+import untitledapp.bots as uabot
 import untitledapp.build as uab
 import untitledapp.conquer as uac
+import untitledapp.formulas as uaf
 import untitledapp.getters as uag
 import untitledapp.shared as uas
-from untitledapp import app, db, User, _mark_kingdom_death, REQUESTS_SESSION, SOCK_HANDLERS
-
-
-def _calc_pop_change_per_epoch(
-    kd_info_parse,
-    fuelless: bool,
-    epoch_elapsed,
-):
+from untitledapp import app, db, User, _mark_kingdom_death, _publish_event, _begin_journal_action, CLOCK, JOURNAL, METRICS, REQUESTS_SESSION
+from untitledapp.engine import TickEngine
+from untitledapp.tracing import TickTracer
+
+REFRESH_LEASE_HOLDER = f"{socket.gethostname()}-{os.getpid()}"
+REFRESH_LEASE_SECONDS = int(os.environ.get("REFRESH_LEASE_SECONDS", "900"))
+TRACER = TickTracer(
+    METRICS,
+    keep=int(os.environ.get("REFRESH_TRACE_KEEP", "50")),
+    path=os.environ.get("REFRESH_TRACE_FILE", os.path.join(tempfile.gettempdir(), "untitledapp-ticks.jsonl")),
+    write_kingdoms=os.environ.get("REFRESH_TRACE_KINGDOMS", "false").lower() == "true",
+)
+ENGINE = TickEngine(
+    uas.GAME_CONFIG,
+    uas.UNITS,
+    uas.GAME_FUNCS,
+    tick_seconds=float(os.environ.get("ENGINE_TICK_SECONDS", "1")),
+    checkpoint_seconds=float(os.environ.get("ENGINE_CHECKPOINT_SECONDS", "60")),
+)
+ENGINE_RUN = {
+    "thread": None,
+    "stop": None,
+}
+REFRESH_STATS = {
+    "ticks": 0,
+    "catch_up_ticks": 0,
+    "queued": 0,
+    "rejected": 0,
+    "last_tick": None,
+    "last_duration": None,
+    "last_lag": None,
+}
+
+
+def _calc_hangar_overflow(kd_info_parse):
     current_units = kd_info_parse["units"]
     generals_units = kd_info_parse["generals_out"]
     mobis_info = uag._get_mobis_queue(kd_info_parse["kdId"])
     mobis_units = mobis_info
-    int_fuelless = int(fuelless)
 
-    start_time = datetime.datetime.now(datetime.timezone.utc)
+    start_time = CLOCK.now()
     units = uag._calc_units(start_time, current_units, generals_units, mobis_units)
     max_hangar_capacity, current_hangar_capacity = uag._calc_hangar_capacity(kd_info_parse, units)
+    return max(current_hangar_capacity - max_hangar_capacity, 0)
 
-    overflow = max(current_hangar_capacity - max_hangar_capacity, 0)
-    pop_capacity = math.floor(
-        kd_info_parse["structures"]["homes"]
-        * uas.GAME_CONFIG["BASE_HOMES_CAPACITY"]
-        * (
-            1 
-            - (int_fuelless * uas.GAME_CONFIG["BASE_FUELLESS_POP_CAP_REDUCTION"])
-            - (int(kd_info_parse["race"] == "Vult") * uas.GAME_CONFIG["VULT_POPULATION_REDUCTION"])
-        )
-    )
-    
-    pop_capacity_less_overflow = max(pop_capacity - overflow, 0)
-
-    pop_difference = pop_capacity_less_overflow - kd_info_parse["population"]
-    if pop_difference < 0:
-        pct_pop_loss = uas.GAME_CONFIG["BASE_PCT_POP_LOSS_PER_EPOCH"] * kd_info_parse["population"] * epoch_elapsed
-        stars_pop_loss = uas.GAME_CONFIG["BASE_POP_LOSS_PER_STAR_PER_EPOCH"] * kd_info_parse["stars"] * epoch_elapsed
-        greater_pop_loss = max(pct_pop_loss, stars_pop_loss)
-        pop_change = -1 *min(greater_pop_loss, abs(pop_difference))
-    elif pop_difference > 0:
-        pct_pop_gain = uas.GAME_CONFIG["BASE_PCT_POP_GROWTH_PER_EPOCH"] * kd_info_parse["population"] * epoch_elapsed
-        stars_pop_gain = uas.GAME_CONFIG["BASE_POP_GROWTH_PER_STAR_PER_EPOCH"] * kd_info_parse["stars"] * epoch_elapsed
-        greater_pop_gain = max(pct_pop_gain, stars_pop_gain) * (1 - int_fuelless * uas.GAME_CONFIG["BASE_FUELLESS_POP_GROWTH_REDUCTION"])
-        pop_change = min(greater_pop_gain, pop_difference)
-    else:
-        pop_change = 0
-    
-    return pop_change, pop_capacity_less_overflow
-
-def _calc_structures_losses(
-    kd_info_parse,
-    epoch_elapsed
-):
-
-    current_structures = kd_info_parse["structures"]
-    count_current_structures = sum(current_structures.values())
-    total_structures = {
-        k: (
-            kd_info_parse["structures"].get(k, 0)
-        )
-        for k in uas.STRUCTURES
-    }
-    count_total_structures = (
-        count_current_structures
-    )
-    if count_total_structures <= kd_info_parse["stars"]:
-        return None
-    try:
-        pct_total_structures = {
-            k: v / count_total_structures
-            for k, v in total_structures.items()
-        }
-    except ZeroDivisionError:
-        pct_total_structures = {
-            k: 0
-            for k in total_structures
-        }
-    
-    structures_to_reduce = count_total_structures - kd_info_parse["stars"]
-    reduction_per_epoch = structures_to_reduce * uas.GAME_CONFIG["BASE_STRUCTURES_LOSS_RETURN_RATE"] * epoch_elapsed
-    reduction_per_stars = min(kd_info_parse["stars"] * uas.GAME_CONFIG["BASE_STRUCTURES_LOSS_PER_STAR_PER_EPOCH"] * epoch_elapsed, structures_to_reduce, count_current_structures)
-    greater_reduction = max(reduction_per_epoch, reduction_per_stars)
-
-    structures_to_reduce = {
-        k: v * greater_reduction
-        for k, v in pct_total_structures.items()
-    }
-    return structures_to_reduce
-    
 def _calc_siphons(
     gross_income,
     kd_id,
     time_update,
-    epoch_elapsed,
+    siphon_epochs,
 ):
+    """
+    Pay the siphons out of a kingdom over siphon_epochs and collect the ones paid to it
+
+    Returns the money siphoned out per epoch, the money siphoned in since the last
+    settlement and the siphons in.
+    """
     siphons_out = uag._get_siphons_out(kd_id)
     siphons_in = uag._get_siphons_in(kd_id)
 
@@ -117,7 +87,7 @@ def _calc_siphons(
         from_kd = siphon_out["from"]
         time_expiry = datetime.datetime.fromisoformat(siphon_out["time"]).astimezone(datetime.timezone.utc)
         pct_siphon = siphon_out["siphon"] / total_siphons
-        siphon_money = pct_siphon * siphon_pool * epoch_elapsed
+        siphon_money = pct_siphon * siphon_pool * siphon_epochs
         payload_siphons_in = {
             "new_siphons": {
                 "from": kd_id,
@@ -149,7 +119,7 @@ def _calc_siphons(
         data=json.dumps(siphon_out_payload),
     )
 
-    siphon_in_income = sum(siphon["siphon"] for siphon in siphons_in) / epoch_elapsed
+    siphon_in_money = sum(siphon["siphon"] for siphon in siphons_in)
     resolve_siphons_in_payload = {
         "siphons": []
     }
@@ -158,7 +128,7 @@ def _calc_siphons(
         headers={'x-functions-key': os.environ['AZURE_FUNCTIONS_HOST_KEY']},
         data=json.dumps(resolve_siphons_in_payload),
     )
-    return siphon_pool, siphon_in_income, siphons_in
+    return siphon_pool, siphon_in_money, siphons_in
 
 def _calc_networth(
     kd_info_parse,
@@ -194,30 +164,16 @@ def _kingdom_with_income(
     time_last_income = datetime.datetime.fromisoformat(kd_info_parse["last_income"]).astimezone(datetime.timezone.utc)
     seconds_elapsed = (time_now - time_last_income).total_seconds()
     epoch_elapsed = seconds_elapsed / uas.GAME_CONFIG["BASE_EPOCH_SECONDS"]
+    # The tick engine moves last_income at every checkpoint, so siphons are settled
+    # over the whole time since the last refresh instead
+    time_last_siphons = datetime.datetime.fromisoformat(
+        kd_info_parse.get("last_siphons") or kd_info_parse["last_income"]
+    ).astimezone(datetime.timezone.utc)
+    siphon_epochs = (time_now - time_last_siphons).total_seconds() / uas.GAME_CONFIG["BASE_EPOCH_SECONDS"]
 
     is_isolationist = "Isolationist" in state["state"]["active_policies"]
     is_free_trade = "Free Trade" in state["state"]["active_policies"]
 
-    income = {
-        "money": {},
-        "fuel": {},
-    }
-    income["money"]["mines"] = math.floor(kd_info_parse["structures"]["mines"]) * uas.GAME_CONFIG["BASE_MINES_INCOME_PER_EPOCH"]
-    income["money"]["population"] = math.floor(kd_info_parse["population"]) * uas.GAME_CONFIG["BASE_POP_INCOME_PER_EPOCH"]
-    income["money"]["bonus"] = current_bonuses["money_bonus"] - is_isolationist * uas.GAME_CONFIG["BASE_ISOLATIONIST_DECREASE"] + is_free_trade * uas.GAME_CONFIG["BASE_FREE_TRADE_INCREASE"]
-    income["money"]["gross"] = (
-        income["money"]["mines"]
-        + income["money"]["population"]
-    ) * (1 + income["money"]["bonus"])
-    income["money"]["siphons_out"], income["money"]["siphons_in"], siphons_in = _calc_siphons(
-        income["money"]["gross"],
-        kd_info_parse["kdId"],
-        time_now,
-        epoch_elapsed,
-    )
-    income["money"]["net"] = (income["money"]["gross"] + income["money"]["siphons_in"] - income["money"]["siphons_out"])
-    new_income = income["money"]["net"] * epoch_elapsed
-
     total_units = {
         k: v
         for k, v in kd_info_parse["units"].items()
@@ -228,6 +184,14 @@ def _kingdom_with_income(
                 continue
             total_units[key_unit] += value_unit
 
+    income = {
+        "money": {},
+        "fuel": {},
+    }
+    income["money"]["mines"] = math.floor(kd_info_parse["structures"]["mines"]) * uas.GAME_CONFIG["BASE_MINES_INCOME_PER_EPOCH"]
+    income["money"]["population"] = math.floor(kd_info_parse["population"]) * uas.GAME_CONFIG["BASE_POP_INCOME_PER_EPOCH"]
+    income["money"]["bonus"] = current_bonuses["money_bonus"] - is_isolationist * uas.GAME_CONFIG["BASE_ISOLATIONIST_DECREASE"] + is_free_trade * uas.GAME_CONFIG["BASE_FREE_TRADE_INCREASE"]
+
     income["fuel"]["fuel_plants"] = math.floor(kd_info_parse["structures"]["fuel_plants"]) * uas.GAME_CONFIG["BASE_FUEL_PLANTS_INCOME_PER_EPOCH"]
     income["fuel"]["bonus"] = current_bonuses["fuel_bonus"] + (int(kd_info_parse["race"] == "Lumina") * uas.GAME_CONFIG["LUMINA_FUEL_PRODUCTION_INCREASE"])
     income["fuel"]["units"] = {}
@@ -240,37 +204,49 @@ def _kingdom_with_income(
     income["fuel"]["shields"]["spy_radar"] = kd_info_parse["shields"]["spy_radar"] * 100 * kd_info_parse["stars"] * uas.GAME_CONFIG["BASE_SPY_RADAR_COST_PER_LAND_PER_PCT"]
     income["fuel"]["shields"]["missiles"] = kd_info_parse["shields"]["missiles"] * 100 * kd_info_parse["stars"] * uas.GAME_CONFIG["BASE_MISSILES_SHIELDS_COST_PER_LAND_PER_PCT"]
 
-    new_fuel = income["fuel"]["fuel_plants"] * (1 + income["fuel"]["bonus"])
-    raw_fuel_consumption = (
-        sum(income["fuel"]["units"].values())
-        + sum(income["fuel"]["shields"].values())
-        + income["fuel"]["population"]
+    economy = uaf.calc_economy(
+        uas.GAME_CONFIG,
+        {
+            "structures": kd_info_parse["structures"],
+            "stars": kd_info_parse["stars"],
+            "population": kd_info_parse["population"],
+            "fuel": kd_info_parse["fuel"],
+            "money_bonus": income["money"]["bonus"],
+            "fuel_bonus": income["fuel"]["bonus"],
+            "is_vult": kd_info_parse["race"] == "Vult",
+            "overflow": _calc_hangar_overflow(kd_info_parse),
+            "units_fuel": sum(income["fuel"]["units"].values()),
+            "shields_fuel": sum(income["fuel"]["shields"].values()),
+            "min_fuel": uas.GAME_FUNCS["BASE_NEGATIVE_FUEL_CAP"](kd_info_parse["stars"]),
+            "projects_assigned": kd_info_parse["projects_assigned"],
+        },
+        epoch_elapsed,
     )
-    income["fuel"]["net"] = new_fuel - raw_fuel_consumption
-    net_fuel = income["fuel"]["net"] * epoch_elapsed
-    max_fuel = math.floor(kd_info_parse["structures"]["fuel_plants"]) * uas.GAME_CONFIG["BASE_FUEL_PLANTS_CAPACITY"]
-    min_fuel = uas.GAME_FUNCS["BASE_NEGATIVE_FUEL_CAP"](kd_info_parse["stars"])
-
-    income["drones"] = (
-        math.floor(kd_info_parse["structures"]["drone_factories"])
-        * uas.GAME_CONFIG["BASE_DRONE_FACTORIES_PRODUCTION_PER_EPOCH"]
-        * (
-            1
-            + (int(kd_info_parse["race"] == "Vult") * uas.GAME_CONFIG["VULT_DRONE_PRODUCTION_INCREASE"])
-        )
+
+    income["money"]["gross"] = economy["gross_income"]
+    income["money"]["siphons_out"], siphon_in_money, siphons_in = _calc_siphons(
+        income["money"]["gross"],
+        kd_info_parse["kdId"],
+        time_now,
+        siphon_epochs,
+    )
+    income["money"]["siphons_in"] = siphon_in_money / siphon_epochs if siphon_epochs > 0 else 0
+    income["money"]["net"] = (income["money"]["gross"] + income["money"]["siphons_in"] - income["money"]["siphons_out"])
+    new_income = (
+        income["money"]["gross"] * epoch_elapsed
+        + siphon_in_money
+        - income["money"]["siphons_out"] * siphon_epochs
     )
-    new_drones = income["drones"] * epoch_elapsed
 
-    fuelless = kd_info_parse["fuel"] <= 0
-    pop_change, _ = _calc_pop_change_per_epoch(kd_info_parse, fuelless, epoch_elapsed)
-    income["population"] = pop_change / epoch_elapsed
+    income["fuel"]["net"] = economy["new_fuel"] - economy["fuel_consumption"]
+    income["drones"] = economy["drones"]
+    new_drones = income["drones"] * epoch_elapsed
 
-    structures_to_reduce = _calc_structures_losses(kd_info_parse, epoch_elapsed)
+    pop_change = economy["pop_change"]
+    income["population"] = pop_change / epoch_elapsed if epoch_elapsed > 0 else 0
 
-    new_project_points = {
-        key_project: assigned_engineers * uas.GAME_CONFIG["BASE_ENGINEER_PROJECT_POINTS_PER_EPOCH"] * epoch_elapsed
-        for key_project, assigned_engineers in kd_info_parse["projects_assigned"].items()
-    }
+    structures_to_reduce = economy["structures_reduction"]
+    new_project_points = economy["project_points"]
     new_kd_info = kd_info_parse.copy()
     for key_project, new_points in new_project_points.items():
         new_kd_info["projects_points"][key_project] += new_points
@@ -280,17 +256,13 @@ def _kingdom_with_income(
                 new_kd_info["completed_projects"].append(key_project)
                 new_kd_info["projects_assigned"][key_project] = 0
                 new_kd_info["projects_target"][key_project] = 0
-                try:
-                    ws = SOCK_HANDLERS[kd_info_parse["kdId"]]
-                    ws.send(json.dumps({
-                        "message": f"Completed project {key_project}!",
-                        "status": "info",
-                        "category": "Projects",
-                        "delay": 15000,
-                        "update": [],
-                    }))
-                except (KeyError, ConnectionError, StopIteration, ConnectionClosed):
-                    pass
+                _publish_event(kd_info_parse["kdId"], {
+                    "message": f"Completed project {key_project}!",
+                    "status": "info",
+                    "category": "Projects",
+                    "delay": 15000,
+                    "update": [],
+                })
 
     if new_kd_info["auto_spending_enabled"]:
         pct_allocated = sum(new_kd_info["auto_spending"].values())
@@ -299,10 +271,11 @@ def _kingdom_with_income(
         new_kd_info["money"] += new_income * (1 - pct_allocated)
     else:
         new_kd_info["money"] += new_income
-    new_kd_info["fuel"] = max(min(max_fuel, new_kd_info["fuel"] + net_fuel), min_fuel)
+    new_kd_info["fuel"] = economy["fuel"]
     new_kd_info["drones"] += new_drones
     new_kd_info["population"] = new_kd_info["population"] + pop_change
     new_kd_info["last_income"] = time_now.isoformat()
+    new_kd_info["last_siphons"] = time_now.isoformat()
     new_kd_info["income"] = income
     new_kd_info["networth"] = math.floor(_calc_networth(
         new_kd_info,
@@ -354,17 +327,13 @@ def _resolve_settles(kd_id, time_update):
         data=json.dumps(settles_payload),
     )
     if ready_settles:
-        try:
-            ws = SOCK_HANDLERS[kd_id]
-            ws.send(json.dumps({
-                "message": f"Finished settling {ready_settles} stars",
-                "status": "info",
-                "category": "Settles",
-                "delay": 5000,
-                "update": [],
-            }))
-        except (KeyError, ConnectionError, StopIteration, ConnectionClosed):
-            pass
+        _publish_event(kd_id, {
+            "message": f"Finished settling {ready_settles} stars",
+            "status": "info",
+            "category": "Settles",
+            "delay": 5000,
+            "update": [],
+        })
     
     return ready_settles, next_resolve
     
@@ -398,19 +367,15 @@ def _resolve_mobis(kd_id, time_update):
         headers={'x-functions-key': os.environ['AZURE_FUNCTIONS_HOST_KEY']},
         data=json.dumps(mobis_payload),
     )
-    try:
-        ws = SOCK_HANDLERS[kd_id]
-        count_mobis = sum(ready_mobis.values())
-        if count_mobis:
-            ws.send(json.dumps({
-                "message": f"Finished mobilizing {count_mobis} units",
-                "status": "info",
-                "category": "Mobis",
-                "delay": 5000,
-                "update": [],
-            }))
-    except (KeyError, ConnectionError, StopIteration, ConnectionClosed):
-        pass
+    count_mobis = sum(ready_mobis.values())
+    if count_mobis:
+        _publish_event(kd_id, {
+            "message": f"Finished mobilizing {count_mobis} units",
+            "status": "info",
+            "category": "Mobis",
+            "delay": 5000,
+            "update": [],
+        })
     
     return ready_mobis, next_resolve
     
@@ -444,19 +409,15 @@ def _resolve_structures(kd_id, time_update):
         headers={'x-functions-key': os.environ['AZURE_FUNCTIONS_HOST_KEY']},
         data=json.dumps(structures_payload),
     )
-    try:
-        ws = SOCK_HANDLERS[kd_id]
-        count_structures = sum(ready_structures.values())
-        if count_structures:
-            ws.send(json.dumps({
-                "message": f"Finished building {count_structures} structures",
-                "status": "info",
-                "category": "Structures",
-                "delay": 5000,
-                "update": [],
-            }))
-    except (KeyError, ConnectionError, StopIteration, ConnectionClosed):
-        pass
+    count_structures = sum(ready_structures.values())
+    if count_structures:
+        _publish_event(kd_id, {
+            "message": f"Finished building {count_structures} structures",
+            "status": "info",
+            "category": "Structures",
+            "delay": 5000,
+            "update": [],
+        })
     
     return ready_structures, next_resolve
     
@@ -488,19 +449,15 @@ def _resolve_missiles(kd_id, time_update):
         headers={'x-functions-key': os.environ['AZURE_FUNCTIONS_HOST_KEY']},
         data=json.dumps(missiles_payload),
     )
-    try:
-        ws = SOCK_HANDLERS[kd_id]
-        count_missiles = sum(ready_missiles.values())
-        if count_missiles:
-            ws.send(json.dumps({
-                "message": f"Finished building {count_missiles} missiles",
-                "status": "info",
-                "category": "Missiles",
-                "delay": 5000,
-                "update": [],
-            }))
-    except (KeyError, ConnectionError, StopIteration, ConnectionClosed):
-        pass
+    count_missiles = sum(ready_missiles.values())
+    if count_missiles:
+        _publish_event(kd_id, {
+            "message": f"Finished building {count_missiles} missiles",
+            "status": "info",
+            "category": "Missiles",
+            "delay": 5000,
+            "update": [],
+        })
     
     return ready_missiles, next_resolve
     
@@ -532,96 +489,35 @@ def _resolve_engineers(kd_id, time_update):
         data=json.dumps(engineers_payload),
     )
     if ready_engineers:
-        try:
-            ws = SOCK_HANDLERS[kd_id]
-            ws.send(json.dumps({
-                "message": f"Finished training {ready_engineers} engineers",
-                "status": "info",
-                "category": "Engineers",
-                "delay": 5000,
-                "update": [],
-            }))
-        except (KeyError, ConnectionError, StopIteration, ConnectionClosed):
-            pass
+        _publish_event(kd_id, {
+            "message": f"Finished training {ready_engineers} engineers",
+            "status": "info",
+            "category": "Engineers",
+            "delay": 5000,
+            "update": [],
+        })
     
     return ready_engineers, next_resolve
     
 def _resolve_revealed(kd_id, time_update):
-    revealed_info = REQUESTS_SESSION.get(
-        os.environ['AZURE_FUNCTION_ENDPOINT'] + f'/kingdom/{kd_id}/revealed',
-        headers={'x-functions-key': os.environ['AZURE_FUNCTIONS_HOST_KEY']}
-    )
-    revealed_info_parse = json.loads(revealed_info.text)
-
-    keep_revealed = collections.defaultdict(dict)
-    keep_galaxies = {}
-    next_resolve = datetime.datetime(year=2099, month=1, day=1).astimezone(datetime.timezone.utc)
-
-    for revealed_kd_id, revealed_dict in revealed_info_parse["revealed"].items():
-        for revealed_stat, time_str in revealed_dict.items():
-            time = datetime.datetime.fromisoformat(time_str).astimezone(datetime.timezone.utc)
-            if time > time_update:
-                next_resolve = min(time, next_resolve)
-                keep_revealed[revealed_kd_id][revealed_stat] = time_str
-
-    for galaxy_id, time_str in revealed_info_parse["galaxies"].items():
-        time = datetime.datetime.fromisoformat(time_str).astimezone(datetime.timezone.utc)
-        if time > time_update:
-            keep_galaxies[galaxy_id] = time_str
-            next_resolve = min(time, next_resolve)
-
-    revealed_payload = {
-        "revealed": keep_revealed,
-        "galaxies": keep_galaxies,
-    }
-    revealed_patch = REQUESTS_SESSION.patch(
-        os.environ['AZURE_FUNCTION_ENDPOINT'] + f'/kingdom/{kd_id}/revealed',
+    revealed_expire = REQUESTS_SESSION.post(
+        os.environ['AZURE_FUNCTION_ENDPOINT'] + f'/kingdom/{kd_id}/revealed/expire',
         headers={'x-functions-key': os.environ['AZURE_FUNCTIONS_HOST_KEY']},
-        data=json.dumps(revealed_payload),
+        data=json.dumps({"time": time_update.isoformat()}),
     )
+    revealed_expire_parse = json.loads(revealed_expire.text)
+    next_resolve = datetime.datetime.fromisoformat(revealed_expire_parse["next_resolve"]).astimezone(datetime.timezone.utc)
     
     return next_resolve
     
 def _resolve_shared(kd_id, time_update):
-    shared_info = REQUESTS_SESSION.get(
-        os.environ['AZURE_FUNCTION_ENDPOINT'] + f'/kingdom/{kd_id}/shared',
-        headers={'x-functions-key': os.environ['AZURE_FUNCTIONS_HOST_KEY']}
-    )
-    shared_info_parse = json.loads(shared_info.text)
-
-    keep_shared = collections.defaultdict(dict)
-    keep_shared_requests = collections.defaultdict(dict)
-    keep_shared_offers = collections.defaultdict(dict)
-    next_resolve = datetime.datetime(year=2099, month=1, day=1).astimezone(datetime.timezone.utc)
-
-    for shared_kd_id, shared_dict in shared_info_parse["shared"].items():
-        time = datetime.datetime.fromisoformat(shared_dict["time"]).astimezone(datetime.timezone.utc)
-        if time > time_update:
-            next_resolve = min(time, next_resolve)
-            keep_shared[shared_kd_id] = shared_dict
-
-    for shared_kd_id, shared_dict in shared_info_parse["shared_requests"].items():
-        time = datetime.datetime.fromisoformat(shared_dict["time"]).astimezone(datetime.timezone.utc)
-        if time > time_update:
-            next_resolve = min(time, next_resolve)
-            keep_shared_requests[shared_kd_id] = shared_dict
-
-    for shared_kd_id, shared_dict in shared_info_parse["shared_offers"].items():
-        time = datetime.datetime.fromisoformat(shared_dict["time"]).astimezone(datetime.timezone.utc)
-        if time > time_update:
-            next_resolve = min(time, next_resolve)
-            keep_shared_offers[shared_kd_id] = shared_dict
-
-    shared_payload = {
-        "shared": keep_shared,
-        "shared_requests": keep_shared_requests,
-        "shared_offers": keep_shared_offers,
-    }
-    shared_post = REQUESTS_SESSION.post(
-        os.environ['AZURE_FUNCTION_ENDPOINT'] + f'/kingdom/{kd_id}/shared',
+    shared_expire = REQUESTS_SESSION.post(
+        os.environ['AZURE_FUNCTION_ENDPOINT'] + f'/kingdom/{kd_id}/shared/expire',
         headers={'x-functions-key': os.environ['AZURE_FUNCTIONS_HOST_KEY']},
-        data=json.dumps(shared_payload),
+        data=json.dumps({"time": time_update.isoformat()}),
     )
+    shared_expire_parse = json.loads(shared_expire.text)
+    next_resolve = datetime.datetime.fromisoformat(shared_expire_parse["next_resolve"]).astimezone(datetime.timezone.utc)
     
     return next_resolve
 
@@ -648,19 +544,15 @@ def _resolve_generals(kd_info_parse, time_update):
 
     kd_info_parse["generals_out"] = generals_keep
     
-    try:
-        ws = SOCK_HANDLERS[kd_info_parse["kdId"]]
-        count_returning_units = sum(returning_units.values())
-        if count_returning_units:
-            ws.send(json.dumps({
-                "message": f"{returning_generals} generals returned with {count_returning_units} units",
-                "status": "info",
-                "category": "Generals",
-                "delay": 15000,
-                "update": [],
-            }))
-    except (KeyError, ConnectionError, StopIteration, ConnectionClosed):
-        pass
+    count_returning_units = sum(returning_units.values())
+    if count_returning_units:
+        _publish_event(kd_info_parse["kdId"], {
+            "message": f"{returning_generals} generals returned with {count_returning_units} units",
+            "status": "info",
+            "category": "Generals",
+            "delay": 15000,
+            "update": [],
+        })
     return kd_info_parse, next_resolve
 
 
@@ -677,17 +569,13 @@ def _resolve_spy(kd_info_parse, time_update, current_bonuses):
     )
     if kd_info_parse["spy_attempts"] < uas.GAME_CONFIG["BASE_SPY_ATTEMPTS_MAX"]:
         kd_info_parse["spy_attempts"] += 1
-        try:
-            ws = SOCK_HANDLERS[kd_info_parse["kdId"]]
-            ws.send(json.dumps({
-                "message": f"A new spy attempt is available",
-                "status": "info",
-                "category": "Spy",
-                "delay": 15000,
-                "update": [],
-            }))
-        except (KeyError, ConnectionError, StopIteration, ConnectionClosed):
-            pass
+        _publish_event(kd_info_parse["kdId"], {
+            "message": f"A new spy attempt is available",
+            "status": "info",
+            "category": "Spy",
+            "delay": 15000,
+            "update": [],
+        })
     return kd_info_parse, next_resolve_time
 
 def _resolve_auto_spending(
@@ -733,7 +621,7 @@ def _resolve_auto_spending(
     
 
     def _weighted_random_by_dct(dct):
-        rand_val = random.random()
+        rand_val = uas.RNG.get().random()
         total = 0
         for k, v in dct.items():
             total += v
@@ -955,17 +843,13 @@ def _resolve_auto_attack(kd_info_parse):
                     value_unit,
                 )
     kd_info_parse, payload, _ = uac._attack_primitives(req, kd_info_parse["kdId"])
-    try:
-        ws = SOCK_HANDLERS[kd_info_parse["kdId"]]
-        ws.send(json.dumps({
-            "message": payload["message"],
-            "status": payload.get("status", "info"),
-            "category": "Auto Primitives",
-            "delay": 15000,
-            "update": ["mobis", "attackhistory"],
-        }))
-    except (KeyError, ConnectionError, StopIteration, ConnectionClosed):
-        pass
+    _publish_event(kd_info_parse["kdId"], {
+        "message": payload["message"],
+        "status": payload.get("status", "info"),
+        "category": "Auto Primitives",
+        "delay": 15000,
+        "update": ["mobis", "attackhistory"],
+    })
     return kd_info_parse
 
 def _resolve_auto_rob(kd_info_parse):
@@ -979,18 +863,13 @@ def _resolve_auto_rob(kd_info_parse):
             "shielded": shielded,
         }
         kd_info_parse, payload, _ = uac._rob_primitives(req, kd_info_parse["kdId"])
-        try:
-            app.logger.info('Sock handlers before auto rob: %s', str(SOCK_HANDLERS))
-            ws = SOCK_HANDLERS[kd_info_parse["kdId"]]
-            ws.send(json.dumps({
-                "message": payload["message"],
-                "status": payload.get("status", "info"),
-                "category": "Auto Primitives",
-                "delay": 15000,
-                "update": ["spyhistory"],
-            }))
-        except (KeyError, ConnectionError, StopIteration, ConnectionClosed):
-            pass
+        _publish_event(kd_info_parse["kdId"], {
+            "message": payload["message"],
+            "status": payload.get("status", "info"),
+            "category": "Auto Primitives",
+            "delay": 15000,
+            "update": ["spyhistory"],
+        })
     return kd_info_parse
 
 def _resolve_auto_projects(kd_info_parse):
@@ -1050,6 +929,7 @@ def _resolve_schedule_attack(new_kd_info, schedule):
                 },
                 "buffer": schedule["options"].get("autofill_buffer", 0.01) * 100,
                 "generals": schedule["options"].get("generals", 0),
+                "objective": schedule["options"].get("autofill_objective", "priority"),
             }
             autofill_payload, _ = uac._autofill_attack(autofill_req, new_kd_info["kdId"], target_kd)
             if autofill_payload["attacker_offense"] > autofill_payload["defender_defense"]:
@@ -1473,6 +1353,286 @@ def _resolve_empires(
 
 
 
+def _acquire_refresh_lease(time_now, token=None):
+    """
+    Acquire the refresh lease, or renew it with the token of the acquisition holding it
+
+    The returned lease carries the token to renew and release it with.
+    """
+    token = token or secrets.token_hex(16)
+    expires = time_now + datetime.timedelta(seconds=REFRESH_LEASE_SECONDS)
+    lease_response = REQUESTS_SESSION.post(
+        os.environ['AZURE_FUNCTION_ENDPOINT'] + f'/lease/refresh/acquire',
+        headers={'x-functions-key': os.environ['AZURE_FUNCTIONS_HOST_KEY']},
+        data=json.dumps({
+            "holder": REFRESH_LEASE_HOLDER,
+            "token": token,
+            "time": time_now.isoformat(),
+            "expires": expires.isoformat(),
+        }),
+    )
+    if lease_response.status_code != 200:
+        app.logger.warning('Error acquiring the refresh lease %s', lease_response.text)
+        return {"acquired": False, "queued": False}
+    return {**json.loads(lease_response.text), "token": token}
+
+def _release_refresh_lease(token):
+    lease_response = REQUESTS_SESSION.post(
+        os.environ['AZURE_FUNCTION_ENDPOINT'] + f'/lease/refresh/release',
+        headers={'x-functions-key': os.environ['AZURE_FUNCTIONS_HOST_KEY']},
+        data=json.dumps({
+            "holder": REFRESH_LEASE_HOLDER,
+            "token": token,
+            "stats": {
+                "last_tick": REFRESH_STATS["last_tick"],
+                "last_duration": REFRESH_STATS["last_duration"],
+                "last_lag": REFRESH_STATS["last_lag"],
+            },
+        }),
+    )
+    if lease_response.status_code != 200:
+        app.logger.warning('Error releasing the refresh lease %s', lease_response.text)
+        return {"released": False, "pending": False}
+    return json.loads(lease_response.text)
+
+def _timed_refresh_tick(trigger_time, catch_up=False):
+    tick_start = datetime.datetime.now(datetime.timezone.utc)
+    start_counter = time.perf_counter()
+    journal_entry, rng_token = _begin_journal_action() if JOURNAL.enabled else (None, None)
+    TRACER.start_tick(catch_up=catch_up)
+    message, status = "Failed", 500
+    try:
+        message, status = _refresh_tick()
+    finally:
+        TRACER.finish_tick(message)
+        if rng_token is not None:
+            uas.RNG.reset(rng_token)
+    if journal_entry is not None:
+        JOURNAL.record({
+            **journal_entry,
+            "kind": "tick",
+            "catch_up": catch_up,
+            "status": status,
+            "seconds": time.perf_counter() - start_counter,
+        })
+    REFRESH_STATS["ticks"] += 1
+    REFRESH_STATS["catch_up_ticks"] += int(catch_up)
+    REFRESH_STATS["last_tick"] = tick_start.isoformat()
+    REFRESH_STATS["last_duration"] = time.perf_counter() - start_counter
+    REFRESH_STATS["last_lag"] = (tick_start - trigger_time).total_seconds()
+    app.logger.info(
+        'Refresh tick %s (catch up %s) took %.2fs with %.2fs lag',
+        message, catch_up, REFRESH_STATS["last_duration"], REFRESH_STATS["last_lag"],
+    )
+    return message, status
+
+def _run_refresh():
+    """
+    Run a refresh tick under the refresh lease
+
+    Triggers arriving while another tick holds the lease are queued on the lease
+    instead of running concurrently. When the tick finishes with triggers queued,
+    a single catch-up tick covers all of them; kingdom income is computed from each
+    kingdom's last_income, so that tick applies the full elapsed epochs.
+    """
+    if _engine_running():
+        REFRESH_STATS["queued"] += 1
+        return ("Covered by the tick engine", 202)
+
+    trigger_time = datetime.datetime.now(datetime.timezone.utc)
+    lease = _acquire_refresh_lease(trigger_time)
+    if not lease["acquired"]:
+        if lease.get("queued"):
+            REFRESH_STATS["queued"] += 1
+            return ("Queued behind running refresh", 202)
+        REFRESH_STATS["rejected"] += 1
+        return ("Refresh already running", 409)
+
+    try:
+        message, status = _timed_refresh_tick(trigger_time)
+    finally:
+        release = _release_refresh_lease(lease["token"])
+
+    if release.get("pending"):
+        time_now = datetime.datetime.now(datetime.timezone.utc)
+        catch_up_trigger_time = (
+            datetime.datetime.fromisoformat(release["pending_since"]).astimezone(datetime.timezone.utc)
+            if release.get("pending_since")
+            else time_now
+        )
+        lease = _acquire_refresh_lease(time_now)
+        if lease["acquired"]:
+            try:
+                message, status = _timed_refresh_tick(catch_up_trigger_time, catch_up=True)
+            finally:
+                _release_refresh_lease(lease["token"])
+    return (message, status)
+
+def _engine_running():
+    return ENGINE_RUN["thread"] is not None and ENGINE_RUN["thread"].is_alive()
+
+def _load_engine(kd_ids, state):
+    created_kd_ids = {
+        kd_id
+        for kd_id, in db.session.query(User.kd_id).filter(User.kd_created == True).all()
+    }
+    kds_info = list(uag._get_kds_info([kd_id for kd_id in kd_ids if kd_id in created_kd_ids]).values())
+    ENGINE.load(
+        kds_info,
+        {kd_info["kdId"]: uag._get_current_bonuses(kd_info) for kd_info in kds_info},
+        state["state"]["active_policies"],
+        {
+            kd_info["kdId"]: _calc_hangar_overflow(kd_info)
+            for kd_info in kds_info
+            if kd_info["status"].lower() != "dead"
+        },
+    )
+
+def _checkpoint_engine(time_now, kd_ids=None):
+    """
+    Write the engine's changes of the given kingdoms, or all of them, to storage
+
+    Returns the ids of the kingdoms that could not be written; the operations not
+    applied to them are put back into the engine for the next checkpoint.
+    """
+    operations = ENGINE.checkpoint(time_now, kd_ids)
+    if not operations:
+        return []
+    checkpoint_response = REQUESTS_SESSION.patch(
+        os.environ['AZURE_FUNCTION_ENDPOINT'] + f'/kingdoms/bulk/operations',
+        headers={'x-functions-key': os.environ['AZURE_FUNCTIONS_HOST_KEY']},
+        data=json.dumps({"kingdoms": operations}),
+    )
+    if checkpoint_response.status_code == 200:
+        return []
+    try:
+        checkpoint_result = json.loads(checkpoint_response.text)
+    except ValueError:
+        checkpoint_result = {"updated": [], "applied": {}}
+    updated = set(checkpoint_result["updated"])
+    failed = [kd_id for kd_id in operations if kd_id not in updated]
+    for kd_id in failed:
+        ENGINE.requeue(kd_id, operations[kd_id][checkpoint_result["applied"].get(kd_id, 0):])
+    app.logger.warning('Engine checkpoint failed for %s kingdoms', len(failed))
+    return failed
+
+def _begin_engine_cycle():
+    TRACER.start_tick(engine=True)
+    begun = _begin_refresh_tick()
+    if begun is None:
+        TRACER.finish_tick("Not started")
+        return None
+    state, kingdoms, time_update, update_history = begun
+
+    kd_ids = list(kingdoms)
+    new_kd_ids = [kd_id for kd_id in kd_ids if kd_id not in ENGINE.kingdoms]
+    if new_kd_ids:
+        _load_engine(new_kd_ids, state)
+    return {
+        "start": datetime.datetime.now(datetime.timezone.utc),
+        "state": state,
+        "pending": collections.deque(kd_ids),
+        "slice": max(math.ceil(len(kd_ids) * ENGINE.tick_seconds / ENGINE.checkpoint_seconds), 1),
+        "update_history": update_history,
+        "kd_scores": {
+            "stars": {},
+            "networth": {},
+        },
+    }
+
+def _step_engine_cycle(cycle):
+    start_counter = time.perf_counter()
+    kd_ids = [cycle["pending"].popleft() for _ in range(min(cycle["slice"], len(cycle["pending"])))]
+    # Kingdoms whose changes were not written keep them in the engine and are retried later in the cycle
+    failed_kd_ids = set(_checkpoint_engine(CLOCK.now(), kd_ids))
+    cycle["pending"].extend(kd_id for kd_id in kd_ids if kd_id in failed_kd_ids)
+    kd_ids = [kd_id for kd_id in kd_ids if kd_id not in failed_kd_ids]
+    for kd_id in kd_ids:
+        with TRACER.span("kingdom", kd_id):
+            _refresh_kingdom(kd_id, cycle["state"], CLOCK.now(), cycle["update_history"], cycle["kd_scores"])
+    _load_engine(kd_ids, cycle["state"])
+
+    if not cycle["pending"]:
+        _finish_refresh_tick(cycle["kd_scores"], CLOCK.now())
+        TRACER.finish_tick("Refreshed")
+        REFRESH_STATS["ticks"] += 1
+        REFRESH_STATS["last_tick"] = cycle["start"].isoformat()
+        REFRESH_STATS["last_duration"] = (datetime.datetime.now(datetime.timezone.utc) - cycle["start"]).total_seconds()
+        ENGINE.stats["cycles"] += 1
+        cycle = None
+    checkpoint_seconds = time.perf_counter() - start_counter
+    ENGINE.stats["last_checkpoint_seconds"] = checkpoint_seconds
+    ENGINE.stats["max_checkpoint_seconds"] = max(ENGINE.stats["max_checkpoint_seconds"], checkpoint_seconds)
+    return cycle
+
+def _run_engine(stop_event):
+    """
+    Tick the in-memory economy every ENGINE.tick_seconds until stop_event is set
+
+    The engine holds the refresh lease while it runs, so refresh triggers from
+    other processes queue behind it; it renews the lease at the start of every
+    cycle and stops if the lease was lost. Refresh ticks run as rolling cycles of about
+    ENGINE.checkpoint_seconds: after each engine tick, the next slice of kingdoms
+    is checkpointed, refreshed as in _refresh_tick and reloaded, so every kingdom
+    is written to storage and picks up its players' changes once per cycle while
+    the economy of all of them keeps ticking. A late tick still covers the whole
+    elapsed time.
+    """
+    lease = _acquire_refresh_lease(datetime.datetime.now(datetime.timezone.utc))
+    if not lease["acquired"]:
+        app.logger.warning('Tick engine not started, the refresh lease is held by %s', lease.get("holder"))
+        return
+    cycle = None
+    lease_lost = False
+    try:
+        next_tick = time.monotonic()
+        while not stop_event.is_set():
+            if time.monotonic() - next_tick > ENGINE.tick_seconds:
+                ENGINE.stats["late_ticks"] += 1
+                next_tick = time.monotonic()
+            ENGINE.tick(CLOCK.now())
+            if cycle is None:
+                renewed = _acquire_refresh_lease(datetime.datetime.now(datetime.timezone.utc), lease["token"])
+                if not renewed["acquired"]:
+                    app.logger.warning('Tick engine stopped, the refresh lease was lost to %s', renewed.get("holder"))
+                    lease_lost = True
+                    break
+                cycle = _begin_engine_cycle()
+            if cycle is not None:
+                cycle = _step_engine_cycle(cycle)
+            next_tick += ENGINE.tick_seconds
+            stop_event.wait(max(next_tick - time.monotonic(), 0))
+    finally:
+        if cycle is not None:
+            TRACER.finish_tick("Stopped")
+        # Once the lease is lost, the new holder's ticks compute the income since the
+        # last written last_income, so the changes not yet checkpointed are dropped
+        if not lease_lost:
+            _checkpoint_engine(CLOCK.now())
+        ENGINE.unload()
+        if not lease_lost:
+            _release_refresh_lease(lease["token"])
+
+def _start_engine():
+    if _engine_running():
+        return False
+
+    def _engine_thread(stop_event):
+        with app.app_context():
+            _run_engine(stop_event)
+
+    ENGINE_RUN["stop"] = threading.Event()
+    ENGINE_RUN["thread"] = threading.Thread(target=_engine_thread, args=(ENGINE_RUN["stop"],), daemon=True)
+    ENGINE_RUN["thread"].start()
+    return True
+
+def _stop_engine():
+    if not _engine_running():
+        return False
+    ENGINE_RUN["stop"].set()
+    ENGINE_RUN["thread"].join()
+    return True
+
 @app.route('/api/refreshdata')
 def refresh_data():
     """Perform periodic refresh tasks"""
@@ -1480,63 +1640,68 @@ def refresh_data():
     if headers.get("Refresh-Secret", "") != os.environ["REFRESH_SECRET"]:
         return ("Not Authorized", 401)
     
-    state = uag._get_state()
-    time_now = datetime.datetime.now(datetime.timezone.utc).isoformat()
-    if time_now < state["state"]["game_start"]:
-        return ("Not started", 200)
-    if time_now > state["state"]["election_end"] and state["state"]["election_end"] != "":
-        state = _resolve_election(state)
-    elif time_now > state["state"]["election_start"] and state["state"]["election_end"] == "":
-        state = _begin_election(state)
-
-    kingdoms = uag._get_kingdoms()
-    time_update = datetime.datetime.now(datetime.timezone.utc)
-
-    history_datetime = datetime.datetime.fromisoformat(state["state"]["next_history"]).astimezone(datetime.timezone.utc)
-    if history_datetime < time_update:
-        update_history = True
-        next_history = history_datetime + datetime.timedelta(seconds=uas.GAME_CONFIG["BASE_EPOCH_SECONDS"])
-        state_payload = {
-            "next_history": next_history.isoformat(),
-        }
-
-        update_response = REQUESTS_SESSION.patch(
-            os.environ['AZURE_FUNCTION_ENDPOINT'] + f'/updatestate',
-            headers={'x-functions-key': os.environ['AZURE_FUNCTIONS_HOST_KEY']},
-            data=json.dumps(state_payload)
-        )
+    return _run_refresh()
+
+@app.route('/api/admin/refresh', methods=['GET'])
+@flask_praetorian.roles_required('admin')
+def refresh_stats():
+    """
+    Return refresh tick counts, duration and lag for this process
+    """
+    return flask.jsonify(REFRESH_STATS), 200
+
+@app.route('/api/admin/ticks', methods=['GET'])
+@flask_praetorian.roles_required('admin')
+def tick_traces():
+    """
+    Return the traces of the last refresh ticks, with every kingdom when kingdoms=true
+    """
+    include_kingdoms = flask.request.args.get("kingdoms", "false").lower() == "true"
+    return flask.jsonify(TRACER.get_traces(include_kingdoms)), 200
+
+@app.route('/api/admin/engine', methods=['GET'])
+@flask_praetorian.roles_required('admin')
+def engine_stats():
+    """
+    Return whether the tick engine runs in this process, with its tick and checkpoint stats
+    """
+    return flask.jsonify({"running": _engine_running(), **ENGINE.stats}), 200
+
+@app.route('/api/admin/engine', methods=['POST'])
+@flask_praetorian.roles_required('admin')
+def set_engine():
+    """
+    Start or stop the tick engine in this process
+    """
+    req = flask.request.get_json(force=True)
+    if req.get("enabled"):
+        changed = _start_engine()
     else:
-        update_history = False
+        changed = _stop_engine()
+    return flask.jsonify({"running": _engine_running(), "changed": changed}), 200
 
-    kd_scores = {
-        "stars": {},
-        "networth": {},
-    }
-    for kd_id in kingdoms:
-        try:
-            query = db.session.query(User).filter_by(kd_id=kd_id).all()
-            user = query[0]
-            if not user.kd_created:
-                continue
-        except:
-            print(f"Could not query kd_id {kd_id}")
-            pass
-        next_resolves = {}
-        kd_info = REQUESTS_SESSION.get(
-            os.environ['AZURE_FUNCTION_ENDPOINT'] + f'/kingdom/{kd_id}',
-            headers={'x-functions-key': os.environ['AZURE_FUNCTIONS_HOST_KEY']}
-        )
-        kd_info_parse = json.loads(kd_info.text)
-        if kd_info_parse["status"].lower() == "dead":
-            continue
-        current_bonuses = {
-            project: project_dict.get("max_bonus", 0) * min(kd_info_parse["projects_points"][project] / kd_info_parse["projects_max_points"][project], 1.0)
-            for project, project_dict in uas.PROJECTS.items()
-            if "max_bonus" in project_dict
-        }
-
-        categories_to_resolve = [cat for cat, time in kd_info_parse["next_resolve"].items() if datetime.datetime.fromisoformat(time).astimezone(datetime.timezone.utc) < time_update]
-        if "settles" in categories_to_resolve:
+def _refresh_kingdom(kd_id, state, time_update, update_history, kd_scores):
+    try:
+        query = db.session.query(User).filter_by(kd_id=kd_id).all()
+        user = query[0]
+        if not user.kd_created:
+            return
+    except:
+        print(f"Could not query kd_id {kd_id}")
+        pass
+    next_resolves = {}
+    kd_info = REQUESTS_SESSION.get(
+        os.environ['AZURE_FUNCTION_ENDPOINT'] + f'/kingdom/{kd_id}',
+        headers={'x-functions-key': os.environ['AZURE_FUNCTIONS_HOST_KEY']}
+    )
+    kd_info_parse = json.loads(kd_info.text)
+    if kd_info_parse["status"].lower() == "dead":
+        return
+    current_bonuses = uag._get_current_bonuses(kd_info_parse)
+
+    categories_to_resolve = [cat for cat, time in kd_info_parse["next_resolve"].items() if datetime.datetime.fromisoformat(time).astimezone(datetime.timezone.utc) < time_update]
+    if "settles" in categories_to_resolve:
+        with TRACER.span("settles", kd_id):
             new_stars, next_resolves["settles"] = _resolve_settles(
                 kd_id,
                 time_update,
@@ -1545,54 +1710,63 @@ def refresh_data():
             for key_project, project_dict in uas.PROJECTS.items():
                 project_max_func = uas.PROJECTS_FUNCS[key_project]
                 kd_info_parse["projects_max_points"][key_project] = project_max_func(kd_info_parse["stars"])
-        
-        if "mobis" in categories_to_resolve:
+    
+    if "mobis" in categories_to_resolve:
+        with TRACER.span("mobis", kd_id):
             new_units, next_resolves["mobis"] = _resolve_mobis(kd_id, time_update)
             for key_unit, amt_unit in new_units.items():
                 kd_info_parse["units"][key_unit] += amt_unit
-        
-        if "structures" in categories_to_resolve:
+    
+    if "structures" in categories_to_resolve:
+        with TRACER.span("structures", kd_id):
             new_structures, next_resolves["structures"] = _resolve_structures(kd_id, time_update)
             for key_structure, amt_structure in new_structures.items():
                 kd_info_parse["structures"][key_structure] += amt_structure
-        
-        if "missiles" in categories_to_resolve:
+    
+    if "missiles" in categories_to_resolve:
+        with TRACER.span("missiles", kd_id):
             new_missiles, next_resolves["missiles"] = _resolve_missiles(kd_id, time_update)
             for key_missiles, amt_missiles in new_missiles.items():
                 kd_info_parse["missiles"][key_missiles] += amt_missiles
 
-        if "engineers" in categories_to_resolve:
+    if "engineers" in categories_to_resolve:
+        with TRACER.span("engineers", kd_id):
             new_engineers, next_resolves["engineers"] = _resolve_engineers(
                 kd_id,
                 time_update,
             )
             kd_info_parse["units"]["engineers"] += new_engineers
-        
-        if "revealed" in categories_to_resolve:
+    
+    if "revealed" in categories_to_resolve:
+        with TRACER.span("revealed", kd_id):
             next_resolves["revealed"] = _resolve_revealed(
                 kd_id,
                 time_update,
             )
-        
-        if "shared" in categories_to_resolve:
+    
+    if "shared" in categories_to_resolve:
+        with TRACER.span("shared", kd_id):
             next_resolves["shared"] = _resolve_shared(
                 kd_id,
                 time_update,
             )
 
-        if "generals" in categories_to_resolve:
+    if "generals" in categories_to_resolve:
+        with TRACER.span("generals", kd_id):
             kd_info_parse, next_resolves["generals"] = _resolve_generals(
                 kd_info_parse,
                 time_update,
             )
-        
-        if "spy_attempt" in categories_to_resolve:
+    
+    if "spy_attempt" in categories_to_resolve:
+        with TRACER.span("spy_attempt", kd_id):
             kd_info_parse, next_resolves["spy_attempt"] = _resolve_spy(
                 kd_info_parse,
                 time_update,
                 current_bonuses,
             )
-        if "auto_spending" in categories_to_resolve:
+    if "auto_spending" in categories_to_resolve:
+        with TRACER.span("auto_spending", kd_id):
             kd_info_parse, next_resolves_auto_spending = _resolve_auto_spending(
                 kd_info_parse,
                 time_update,
@@ -1609,33 +1783,104 @@ def refresh_data():
                 **next_resolves,
                 **next_resolves_spending_effective,
             }
-        if kd_info_parse["auto_assign_projects"] and (kd_info_parse["units"]["engineers"] - sum(kd_info_parse["projects_assigned"].values()) > 0):
+    if kd_info_parse["auto_assign_projects"] and (kd_info_parse["units"]["engineers"] - sum(kd_info_parse["projects_assigned"].values()) > 0):
+        with TRACER.span("auto_projects", kd_id):
             kd_info_parse = _resolve_auto_projects(kd_info_parse)
 
-        for category, next_resolve_datetime in next_resolves.items():
-            kd_info_parse["next_resolve"][category] = next_resolve_datetime.isoformat()
+    for category, next_resolve_datetime in next_resolves.items():
+        kd_info_parse["next_resolve"][category] = next_resolve_datetime.isoformat()
+    with TRACER.span("income", kd_id):
         new_kd_info = _kingdom_with_income(kd_info_parse, current_bonuses, state, time_update)
         kd_patch_response = REQUESTS_SESSION.patch(
             os.environ['AZURE_FUNCTION_ENDPOINT'] + f'/kingdom/{kd_id}',
             headers={'x-functions-key': os.environ['AZURE_FUNCTIONS_HOST_KEY']},
             data=json.dumps(new_kd_info, default=str),
         )
+    with TRACER.span("schedules", kd_id):
         new_kd_info = _resolve_schedules(new_kd_info, time_update)
-        if new_kd_info["auto_attack_enabled"] and new_kd_info["generals_available"] > 0:
+    if new_kd_info["auto_attack_enabled"] and new_kd_info["generals_available"] > 0:
+        with TRACER.span("auto_attack", kd_id):
             new_kd_info = _resolve_auto_attack(new_kd_info)
-        if new_kd_info["auto_rob_enabled"]:
+    if new_kd_info["auto_rob_enabled"]:
+        with TRACER.span("auto_rob", kd_id):
             new_kd_info = _resolve_auto_rob(new_kd_info)
 
-        kd_scores["stars"][kd_id] = new_kd_info["stars"]
-        kd_scores["networth"][kd_id] = new_kd_info["networth"]
+    # The tick already has the new kingdom, so it is pushed as the patch instead of refetched
+    _publish_event(kd_id, {"update": ["kingdom"], "patch": {"kingdom": new_kd_info}})
+
+    kd_scores["stars"][kd_id] = new_kd_info["stars"]
+    kd_scores["networth"][kd_id] = new_kd_info["networth"]
 
-        if update_history:
+    if update_history:
+        with TRACER.span("history", kd_id):
             _update_history(
                 new_kd_info,
                 time_update,
             )
-    
-    _resolve_scores(kd_scores, time_update)
-    _resolve_empires(kd_scores, time_update)
-        
-    return "Refreshed", 200
\ No newline at end of file
+
+def _begin_refresh_tick():
+    """
+    Run the parts of a refresh tick that come before the kingdoms
+
+    Returns the state, the kingdoms, the update time and whether history is due,
+    or None when the game has not started.
+    """
+    with TRACER.span("state"):
+        state = uag._get_state()
+    time_now = CLOCK.now().isoformat()
+    if time_now < state["state"]["game_start"]:
+        return None
+    with TRACER.span("election"):
+        if time_now > state["state"]["election_end"] and state["state"]["election_end"] != "":
+            state = _resolve_election(state)
+        elif time_now > state["state"]["election_start"] and state["state"]["election_end"] == "":
+            state = _begin_election(state)
+
+    with TRACER.span("kingdoms"):
+        kingdoms = uag._get_kingdoms()
+    time_update = CLOCK.now()
+
+    history_datetime = datetime.datetime.fromisoformat(state["state"]["next_history"]).astimezone(datetime.timezone.utc)
+    if history_datetime < time_update:
+        update_history = True
+        next_history = history_datetime + datetime.timedelta(seconds=uas.GAME_CONFIG["BASE_EPOCH_SECONDS"])
+        state_payload = {
+            "next_history": next_history.isoformat(),
+        }
+
+        update_response = REQUESTS_SESSION.patch(
+            os.environ['AZURE_FUNCTION_ENDPOINT'] + f'/updatestate',
+            headers={'x-functions-key': os.environ['AZURE_FUNCTIONS_HOST_KEY']},
+            data=json.dumps(state_payload)
+        )
+    else:
+        update_history = False
+
+    with TRACER.span("bots"):
+        uabot._resolve_bots(time_update)
+    return state, kingdoms, time_update, update_history
+
+def _finish_refresh_tick(kd_scores, time_update):
+    with TRACER.span("scores"):
+        _resolve_scores(kd_scores, time_update)
+    with TRACER.span("empires"):
+        _resolve_empires(kd_scores, time_update)
+    with TRACER.span("accounts"):
+        uaa._reconcile_accounts_if_due()
+
+def _refresh_tick():
+    begun = _begin_refresh_tick()
+    if begun is None:
+        return ("Not started", 200)
+    state, kingdoms, time_update, update_history = begun
+
+    kd_scores = {
+        "stars": {},
+        "networth": {},
+    }
+    for kd_id in kingdoms:
+        with TRACER.span("kingdom", kd_id):
+            _refresh_kingdom(kd_id, state, time_update, update_history, kd_scores)
+
+    _finish_refresh_tick(kd_scores, time_update)
+    return "Refreshed", 200
@@ -1,6 +1,7 @@
-import math
+import contextvars
 import random
-from functools import partial
+
+import untitledapp.formulas as uaf
 
 UNITS = {
     'attack': {
@@ -51,6 +52,15 @@ AUTOFILL_PRIORITY = [
     "flex",
 ]
 
+AUTOFILL_OBJECTIVES = [
+    "priority",
+    "units",
+    "networth",
+    "defense",
+]
+
+AUTOFILL_SEARCH_STEPS = 16
+
 STRUCTURES = [
     "homes",
     "mines",
@@ -93,8 +103,16 @@ RACES = [
     "Fuzi",
 ]
 
+# Source of every random game outcome; set to a seeded random.Random per journaled
+# action so that its replay rolls the same outcomes
+RNG = contextvars.ContextVar("RNG", default=random)
+
+# Epoch length at game speed 1; the state document's game_speed divides it
+BASE_EPOCH_SECONDS = 30 * 60
+GAME_SPEED = 1.0
+
 GAME_CONFIG = {
-    "BASE_EPOCH_SECONDS": 30 * 60, 
+    "BASE_EPOCH_SECONDS": BASE_EPOCH_SECONDS, 
 
     "BASE_SETTLE_STARS_POWER": 0.5,
     "BASE_SETTLE_COST_CONSTANT": 50,
@@ -287,17 +305,26 @@ GAME_CONFIG = {
     "SURPRISE_WAR_PENALTY_MULTIPLIER": 48,
 }
 
-GAME_FUNCS = {
-    "BASE_SETTLE_COST": lambda stars: math.floor((stars ** GAME_CONFIG["BASE_SETTLE_STARS_POWER"]) * GAME_CONFIG["BASE_SETTLE_COST_CONSTANT"]), 
-    "BASE_MAX_SETTLE": lambda stars: math.floor(stars * GAME_CONFIG["BASE_MAX_SETTLE_CAP"]), 
-    "BASE_STRUCTURE_COST": lambda stars: math.floor((stars ** GAME_CONFIG["BASE_STRUCTURE_STARS_POWER"]) * GAME_CONFIG["BASE_STRUCTURE_COST_CONSTANT"]), 
-    "BASE_MAX_RECRUITS": lambda pop: math.floor(pop * GAME_CONFIG["BASE_MAX_RECRUITS_CAP"]), 
-    "BASE_MAX_ENGINEERS": lambda pop: math.floor(pop * GAME_CONFIG["BASE_MAX_ENGINEERS_POP_CAP"]), 
-    "BASE_GENERALS_BONUS": lambda generals: (generals - 1) * GAME_CONFIG["BASE_GENERALS_ATTACK_MODIFIER"], 
-    "BASE_PRIMITIVES_DEFENSE_PER_STAR": lambda seconds: GAME_CONFIG["BASE_PRIMITIVES_DEFENSE_PER_STAR"] * math.sqrt(1 + seconds / (GAME_CONFIG["BASE_EPOCH_SECONDS"] * GAME_CONFIG["BASE_PRIMITIVES_DEFENSE_EPOCH_MULTIPLER"])), 
-    "BASE_PRIMITIVES_ROB_PER_DRONE": lambda seconds: GAME_CONFIG["BASE_PRIMITIVES_ROB_PER_DRONE"] / math.sqrt(1 + seconds / (GAME_CONFIG["BASE_EPOCH_SECONDS"] * GAME_CONFIG["BASE_PRIMITIVES_ROB_EPOCH_MULTIPLIER"])), 
-    "BASE_NEGATIVE_FUEL_CAP": lambda stars: stars * -GAME_CONFIG["BASE_NEGATIVE_FUEL_PER_STAR"], 
-}
+GAME_FUNCS = uaf.build_game_funcs(GAME_CONFIG)
+GAME_FUNCS_NP = uaf.build_game_funcs_np(GAME_CONFIG)
+
+
+def _set_game_speed(game_speed):
+    """
+    Scale every epoch-based duration of this process to the state's game speed
+
+    GAME_CONFIG["BASE_EPOCH_SECONDS"] is read at call time everywhere except the
+    bound formulas, which are rebuilt in place so existing references see the change.
+    """
+    global GAME_SPEED
+    game_speed = float(game_speed)
+    if game_speed == GAME_SPEED:
+        return
+    GAME_SPEED = game_speed
+    GAME_CONFIG["BASE_EPOCH_SECONDS"] = BASE_EPOCH_SECONDS / game_speed
+    GAME_FUNCS.update(uaf.build_game_funcs(GAME_CONFIG))
+    if GAME_FUNCS_NP is not None:
+        GAME_FUNCS_NP.update(uaf.build_game_funcs_np(GAME_CONFIG))
 
 PROJECTS = {
     "pop_bonus": {
@@ -368,16 +395,10 @@ PROJECTS = {
     },
 }
 
-PROJECTS_MAX_POINTS_FUNC = lambda stars, stars_power, constant: (stars ** stars_power) * constant
+PROJECTS_MAX_POINTS_FUNC = uaf.projects_max_points
 
-PROJECTS_FUNCS = {
-    key: partial(
-        PROJECTS_MAX_POINTS_FUNC,
-        stars_power=project_dict["stars_power"],
-        constant=project_dict["constant"]
-    )
-    for key, project_dict in PROJECTS.items()
-}
+PROJECTS_FUNCS = uaf.build_projects_funcs(PROJECTS)
+PROJECTS_FUNCS_NP = uaf.build_projects_funcs_np(PROJECTS)
 
 ONE_TIME_PROJECTS = [
     "big_flexers",
@@ -402,6 +423,17 @@ AGGRO_OPERATIONS = [
     "suicidedrones"
 ]
 
+REVEALED_ALWAYS_ALLOWED_KEYS = ["name", "race", "status", "coordinate"]
+REVEALED_ALLOWED_KEYS = {
+    "stats": ["stars", "networth"],
+    "kingdom": ["stars", "fuel", "population", "networth", "money", "missiles"],
+    "military": ["units", "generals_available", "generals_out"],
+    "structures": ["structures"],
+    "shields": ["shields"],
+    "projects": ["projects_points", "projects_max_points", "projects_assigned", "completed_projects"],
+    "drones": ["drones", "spy_attempts"],
+}
+
 DATE_SENTINEL = "2099-01-01T00:00:00+00:00"
 
 INITIAL_KINGDOM_STARS = 300
@@ -413,6 +445,7 @@ INITIAL_KINGDOM_STATE = {
         "status": "Active",
         "coordinate": 0,
         "last_income": "",
+        "last_siphons": "",
         "next_resolve": {
             "generals": DATE_SENTINEL,
             "spy_attempt": DATE_SENTINEL,
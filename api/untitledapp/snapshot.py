@@ -0,0 +1,131 @@
+import collections
+import datetime
+import gzip
+import json
+import re
+import struct
+import zlib
+
+SNAPSHOT_MAGIC = b"UTSNAP01"
+# Index offset and length, then the magic again, at the very end of the file
+SNAPSHOT_FOOTER = struct.Struct(">QQ8s")
+SNAPSHOT_VERSION = 1
+SNAPSHOT_CHUNK_ITEMS = 500
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def _item_type(item):
+    # Kingdom documents carry their type, the shared ones are named by id: galaxy_news_1:2 -> galaxy_news
+    return item.get("type") or re.sub(r"_[\d:]+$", "", item["id"])
+
+
+class SnapshotWriter:
+    """
+    Streams items into a snapshot archive
+
+    The archive is the magic bytes, then gzip-compressed chunks of up to
+    `chunk_items` items as JSON lines, then a gzip-compressed JSON index of the
+    chunks (offset, length, crc32, item count) and of which chunk holds each
+    item id, then a fixed-size footer locating the index. Only one chunk is held
+    in memory at a time.
+    """
+
+    def __init__(self, fileobj, chunk_items=SNAPSHOT_CHUNK_ITEMS, metadata=None, compresslevel=6):
+        self.fileobj = fileobj
+        self.chunk_items = chunk_items
+        self.compresslevel = compresslevel
+        self.index = {
+            "version": SNAPSHOT_VERSION,
+            "created": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "metadata": metadata or {},
+            "items": 0,
+            "raw_bytes": 0,
+            "counts": collections.Counter(),
+            "chunks": [],
+            "item_chunks": {},
+        }
+        self._pending = []
+        self._offset = len(SNAPSHOT_MAGIC)
+        self.fileobj.write(SNAPSHOT_MAGIC)
+
+    def add(self, item):
+        self._pending.append(item)
+        if len(self._pending) >= self.chunk_items:
+            self._flush()
+
+    def add_all(self, items):
+        for item in items:
+            self.add(item)
+
+    def _flush(self):
+        if not self._pending:
+            return
+        raw = "".join(json.dumps(item, separators=(",", ":")) + "\n" for item in self._pending).encode()
+        compressed = gzip.compress(raw, compresslevel=self.compresslevel, mtime=0)
+        self.fileobj.write(compressed)
+        chunk_number = len(self.index["chunks"])
+        self.index["chunks"].append({
+            "offset": self._offset,
+            "length": len(compressed),
+            "raw_bytes": len(raw),
+            "items": len(self._pending),
+            "crc32": zlib.crc32(compressed),
+        })
+        for item in self._pending:
+            self.index["item_chunks"][item["id"]] = chunk_number
+            self.index["counts"][_item_type(item)] += 1
+        self.index["items"] += len(self._pending)
+        self.index["raw_bytes"] += len(raw)
+        self._offset += len(compressed)
+        self._pending = []
+
+    def close(self):
+        """Write the last chunk, the index and the footer; returns the index"""
+        self._flush()
+        index_bytes = gzip.compress(json.dumps(self.index).encode(), mtime=0)
+        self.fileobj.write(index_bytes)
+        self.fileobj.write(SNAPSHOT_FOOTER.pack(self._offset, len(index_bytes), SNAPSHOT_MAGIC))
+        self.fileobj.flush()
+        return self.index
+
+
+class SnapshotReader:
+    """Reads the index, chunks and single items of a snapshot archive"""
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.fileobj.seek(0)
+        if self.fileobj.read(len(SNAPSHOT_MAGIC)) != SNAPSHOT_MAGIC:
+            raise SnapshotError("Not a snapshot archive")
+        self.fileobj.seek(-SNAPSHOT_FOOTER.size, 2)
+        index_offset, index_length, magic = SNAPSHOT_FOOTER.unpack(self.fileobj.read(SNAPSHOT_FOOTER.size))
+        if magic != SNAPSHOT_MAGIC:
+            raise SnapshotError("Snapshot archive is truncated")
+        self.fileobj.seek(index_offset)
+        self.index = json.loads(gzip.decompress(self.fileobj.read(index_length)))
+        if self.index["version"] != SNAPSHOT_VERSION:
+            raise SnapshotError(f"Unsupported snapshot version {self.index['version']}")
+
+    def read_chunk(self, chunk_number):
+        chunk = self.index["chunks"][chunk_number]
+        self.fileobj.seek(chunk["offset"])
+        compressed = self.fileobj.read(chunk["length"])
+        if zlib.crc32(compressed) != chunk["crc32"]:
+            raise SnapshotError(f"Snapshot chunk {chunk_number} is corrupt")
+        return [json.loads(line) for line in gzip.decompress(compressed).splitlines()]
+
+    def iter_chunks(self):
+        for chunk_number in range(len(self.index["chunks"])):
+            yield self.read_chunk(chunk_number)
+
+    def read_item(self, item_id):
+        chunk_number = self.index["item_chunks"].get(item_id)
+        if chunk_number is None:
+            return None
+        return next(item for item in self.read_chunk(chunk_number) if item["id"] == item_id)
+
+    def summary(self):
+        return {key: value for key, value in self.index.items() if key not in ("chunks", "item_chunks")}
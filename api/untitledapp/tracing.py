@@ -0,0 +1,109 @@
+import collections
+import contextlib
+import datetime
+import json
+import threading
+import time
+
+SLOWEST_KINGDOMS = 10
+
+
+class TickTracer:
+    """
+    Records per-phase and per-kingdom durations and backend call counts of refresh ticks
+
+    Spans also set the metrics phase, so backend calls made inside a span are labelled
+    with it on /api/metrics. Spans opened outside a tick only set the phase.
+    The last `keep` traces stay in memory and every trace is appended to `path` as a JSON line,
+    without the full kingdoms list unless `write_kingdoms` is set.
+    """
+
+    def __init__(self, metrics, keep=50, path=None, write_kingdoms=False):
+        self.metrics = metrics
+        self.path = path
+        self.write_kingdoms = write_kingdoms
+        self.traces = collections.deque(maxlen=keep)
+        self._tick = None
+        self._lock = threading.Lock()
+
+    def start_tick(self, **attributes):
+        self._tick = {
+            "start": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "start_counter": time.perf_counter(),
+            "start_calls": self.metrics.call_count(),
+            "attributes": attributes,
+            "phases": collections.defaultdict(lambda: {"count": 0, "seconds": 0.0, "calls": 0}),
+            "kingdoms": {},
+        }
+
+    @contextlib.contextmanager
+    def span(self, name, kd_id=None):
+        previous_phase = self.metrics.set_phase(f"refresh:{name}")
+        start_counter = time.perf_counter()
+        start_calls = self.metrics.call_count()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start_counter
+            calls = self.metrics.call_count() - start_calls
+            self.metrics.set_phase(previous_phase)
+            tick = self._tick
+            if tick is not None:
+                phase = tick["phases"][name]
+                phase["count"] += 1
+                phase["seconds"] += seconds
+                phase["calls"] += calls
+                if kd_id is not None:
+                    kingdom = tick["kingdoms"].setdefault(kd_id, {"kd_id": kd_id, "phases": {}})
+                    kingdom["phases"][name] = {"seconds": seconds, "calls": calls}
+                    if name == "kingdom":
+                        kingdom["seconds"] = seconds
+                        kingdom["calls"] = calls
+
+    def finish_tick(self, message):
+        tick = self._tick
+        if tick is None:
+            return None
+        self._tick = None
+
+        kingdoms = sorted(
+            tick["kingdoms"].values(),
+            key=lambda kingdom: kingdom.get("seconds", 0.0),
+            reverse=True,
+        )
+        trace = {
+            "start": tick["start"],
+            "message": message,
+            **tick["attributes"],
+            "seconds": time.perf_counter() - tick["start_counter"],
+            "calls": self.metrics.call_count() - tick["start_calls"],
+            "phases": dict(tick["phases"]),
+            "slowest_kingdoms": kingdoms[:SLOWEST_KINGDOMS],
+            "kingdoms": kingdoms,
+        }
+        with self._lock:
+            self.traces.append(trace)
+        self._write(trace)
+        return trace
+
+    def _write(self, trace):
+        if not self.path:
+            return
+        if not self.write_kingdoms:
+            # One entry per kingdom per tick would grow the file without bound; the slowest are kept
+            trace = {key: value for key, value in trace.items() if key != "kingdoms"}
+        try:
+            with open(self.path, "a") as trace_file:
+                trace_file.write(json.dumps(trace, default=str) + "\n")
+        except OSError:
+            pass
+
+    def get_traces(self, include_kingdoms=False):
+        with self._lock:
+            traces = list(self.traces)
+        if include_kingdoms:
+            return traces
+        return [
+            {key: value for key, value in trace.items() if key != "kingdoms"}
+            for trace in traces
+        ]
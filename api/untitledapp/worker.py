@@ -0,0 +1,71 @@
+"""
+Standalone game loop, run with `python -m untitledapp.worker`
+
+Runs the same refresh tick as /api/refreshdata (elections, kingdom resolves,
+scores and empires) on a fixed cadence in its own process, under the same
+refresh lease, so it can run alongside the route without overlapping ticks.
+Websocket events reach the web workers when both use WS_BUS=socket.
+"""
+import argparse
+import datetime
+import os
+import signal
+import threading
+
+from untitledapp import app
+import untitledapp.refresh as uar
+
+STOP = threading.Event()
+
+
+def _stop(signum, frame):
+    app.logger.info('Worker received signal %s, stopping', signum)
+    STOP.set()
+
+
+def run_once():
+    with app.app_context():
+        try:
+            message, status = uar._run_refresh()
+        except Exception as e:
+            app.logger.warning('Error running refresh tick %s', str(e))
+            return None
+    app.logger.info('Worker refresh %s (%s)', message, status)
+    return status
+
+
+def run(interval_seconds):
+    """Run ticks every interval_seconds, skipping slots missed while a tick overran"""
+    next_run = datetime.datetime.now(datetime.timezone.utc)
+    while not STOP.is_set():
+        run_once()
+        next_run += datetime.timedelta(seconds=interval_seconds)
+        time_now = datetime.datetime.now(datetime.timezone.utc)
+        if next_run < time_now:
+            missed_slots = int((time_now - next_run).total_seconds() // interval_seconds) + 1
+            app.logger.info('Worker tick overran, skipping %s slots', missed_slots)
+            next_run += datetime.timedelta(seconds=interval_seconds * missed_slots)
+        STOP.wait((next_run - time_now).total_seconds())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the game refresh loop outside the web process")
+    parser.add_argument(
+        "--interval",
+        type=float,
+        default=float(os.environ.get("REFRESH_INTERVAL_SECONDS", "60")),
+        help="Seconds between refresh ticks (REFRESH_INTERVAL_SECONDS)",
+    )
+    parser.add_argument("--once", action="store_true", help="Run a single tick and exit")
+    args = parser.parse_args()
+
+    signal.signal(signal.SIGTERM, _stop)
+    signal.signal(signal.SIGINT, _stop)
+    if args.once:
+        run_once()
+    else:
+        run(args.interval)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,24 +1,37 @@
 import azure.functions as func
+import bisect
 import logging
 import os
 import json
 import datetime
 from collections import defaultdict
 
+from azure.core import MatchConditions
 from azure.cosmos import CosmosClient, PartitionKey
+from azure.cosmos.exceptions import CosmosAccessConditionFailedError, CosmosResourceExistsError, CosmosResourceNotFoundError
 
-ENDPOINT = os.environ["COSMOS_ENDPOINT"]
-KEY = os.environ["COSMOS_KEY"]
+# "cosmos", or "memory" / "sqlite:<path>" to run offline against local_store
+STORE = os.environ.get("FUNCAPP_STORE", "cosmos")
 
-DATABASE_NAME = os.environ.get("COSMOS_DATABASE_NAME", "dev")
-CONTAINER_NAME = os.environ.get("COSMOS_CONTAINER_NAME", "data")
+if STORE == "cosmos":
+    ENDPOINT = os.environ["COSMOS_ENDPOINT"]
+    KEY = os.environ["COSMOS_KEY"]
 
-CLIENT = CosmosClient(url=ENDPOINT, credential=KEY)
-DATABASE = CLIENT.create_database_if_not_exists(id=DATABASE_NAME)
-CONTAINER = DATABASE.get_container_client(CONTAINER_NAME)
+    DATABASE_NAME = os.environ.get("COSMOS_DATABASE_NAME", "dev")
+    CONTAINER_NAME = os.environ.get("COSMOS_CONTAINER_NAME", "data")
+
+    CLIENT = CosmosClient(url=ENDPOINT, credential=KEY)
+    DATABASE = CLIENT.create_database_if_not_exists(id=DATABASE_NAME)
+    CONTAINER = DATABASE.get_container_client(CONTAINER_NAME)
+else:
+    from local_store import make_container
+
+    CONTAINER = make_container(STORE)
 
 APP = func.FunctionApp()
 
+EXPIRY_SENTINEL = "2099-01-01T00:00:00+00:00"
+
 RESET_KEEP_IDS = [
     "accounts",
     "state",
@@ -77,6 +90,7 @@ def init_state(req: func.HttpRequest) -> func.HttpResponse:
             {
                 "id": "accounts",
                 "accounts": [],
+                "accounts_by_id": {},
             }
         )
         CONTAINER.create_item(
@@ -163,14 +177,13 @@ def reset_state(req: func.HttpRequest) -> func.HttpResponse:
             item="accounts",
             partition_key="accounts"
         )
-        new_accounts = []
-        for account in accounts["accounts"]:
-            reset_account = account
+        accounts_by_id = _get_accounts_by_id(accounts)
+        for reset_account in accounts_by_id.values():
             reset_account["kd_id"] = None
             reset_account["kd_death_date"] = None
             reset_account["kd_created"] = False
-            new_accounts.append(reset_account)
-        accounts["accounts"] = new_accounts
+        accounts["accounts"] = []
+        accounts["accounts_by_id"] = accounts_by_id
         CONTAINER.replace_item(
             "accounts",
             accounts,
@@ -259,6 +272,79 @@ def reset_state(req: func.HttpRequest) -> func.HttpResponse:
             "Failed to reset state",
             status_code=500,
         )
+
+# Cosmos system properties, regenerated on write
+ITEM_SYSTEM_PROPERTIES = ["_rid", "_self", "_etag", "_attachments", "_ts"]
+EXPORT_MAX_ITEMS = 1000
+
+@APP.function_name(name="ExportItems")
+@APP.route(route="items/export", auth_level=func.AuthLevel.ADMIN, methods=["GET"])
+def export_items(req: func.HttpRequest) -> func.HttpResponse:
+    logging.info('Python HTTP trigger function processed an export items request.')    
+    max_items = min(int(req.params.get("max_items", EXPORT_MAX_ITEMS)), EXPORT_MAX_ITEMS)
+    try:
+        pages = CONTAINER.read_all_items(max_item_count=max_items).by_page(req.params.get("continuation") or None)
+        items = [
+            {k: v for k, v in item.items() if k not in ITEM_SYSTEM_PROPERTIES}
+            for item in next(pages, [])
+        ]
+        return func.HttpResponse(
+            json.dumps({"items": items, "continuation": pages.continuation_token}),
+            status_code=200,
+        )
+    except Exception as e:
+        logging.warn(str(e))
+        return func.HttpResponse(
+            "Failed to export items",
+            status_code=500,
+        )
+
+@APP.function_name(name="ImportItems")
+@APP.route(route="items/import", auth_level=func.AuthLevel.ADMIN, methods=["POST"])
+def import_items(req: func.HttpRequest) -> func.HttpResponse:
+    logging.info('Python HTTP trigger function processed an import items request.')    
+    req_body = req.get_json()
+    imported = 0
+    failed = []
+    for item in req_body.get("items", []):
+        try:
+            CONTAINER.upsert_item(
+                {k: v for k, v in item.items() if k not in ITEM_SYSTEM_PROPERTIES},
+            )
+            imported += 1
+        except:
+            failed.append(item.get("id"))
+    return func.HttpResponse(
+        json.dumps({"imported": imported, "failed": failed}),
+        status_code=200 if not failed else 500,
+    )
+
+@APP.function_name(name="PruneItems")
+@APP.route(route="items/prune", auth_level=func.AuthLevel.ADMIN, methods=["POST"])
+def prune_items(req: func.HttpRequest) -> func.HttpResponse:
+    logging.info('Python HTTP trigger function processed a prune items request.')    
+    req_body = req.get_json()
+    keep_ids = set(req_body["keep_ids"])
+    try:
+        deleted = []
+        for item in CONTAINER.read_all_items():
+            # Leases are held by the running restore and are never snapshotted
+            if item["id"] not in keep_ids and item.get("type") != "lease":
+                CONTAINER.delete_item(
+                    item=item["id"],
+                    partition_key=item["id"],
+                )
+                deleted.append(item["id"])
+        return func.HttpResponse(
+            json.dumps({"deleted": deleted}),
+            status_code=200,
+        )
+    except Exception as e:
+        logging.warn(str(e))
+        return func.HttpResponse(
+            "Failed to prune items",
+            status_code=500,
+        )
     
 @APP.function_name(name="GetAccounts")
 @APP.route(route="accounts", auth_level=func.AuthLevel.ADMIN, methods=["GET"])
@@ -268,6 +354,7 @@ def get_accounts(req: func.HttpRequest) -> func.HttpResponse:
             item="accounts",
             partition_key="accounts",
         )
+        accounts["accounts"] = list(_get_accounts_by_id(accounts).values())
         return func.HttpResponse(
             json.dumps(accounts),
             status_code=200,
@@ -287,7 +374,11 @@ def update_accounts(req: func.HttpRequest) -> func.HttpResponse:
             item="accounts",
             partition_key="accounts",
         )
-        accounts["accounts"] = req_body["accounts"]
+        accounts["accounts"] = []
+        accounts["accounts_by_id"] = {
+            str(account["id"]): account
+            for account in req_body["accounts"]
+        }
         CONTAINER.replace_item(
             "accounts",
             accounts,
@@ -301,6 +392,53 @@ def update_accounts(req: func.HttpRequest) -> func.HttpResponse:
             "Failed to update accounts",
             status_code=500,
         )
+
+def _get_accounts_by_id(accounts):
+    accounts_by_id = {
+        str(account["id"]): account
+        for account in accounts.get("accounts", [])
+    }
+    accounts_by_id.update(accounts.get("accounts_by_id", {}))
+    return accounts_by_id
+
+ACCOUNTS_PATCH_MAX_OPERATIONS = 10
+
+@APP.function_name(name="UpsertAccounts")
+@APP.route(route="accounts/upsert", auth_level=func.AuthLevel.ADMIN, methods=["POST"])
+def upsert_accounts(req: func.HttpRequest) -> func.HttpResponse:
+    req_body = req.get_json()
+    new_accounts = req_body["accounts"]
+    try:
+        accounts = CONTAINER.read_item(
+            item="accounts",
+            partition_key="accounts",
+        )
+        if "accounts_by_id" not in accounts or accounts["accounts"]:
+            accounts["accounts_by_id"] = _get_accounts_by_id(accounts)
+            accounts["accounts"] = []
+            CONTAINER.replace_item(
+                "accounts",
+                accounts,
+            )
+        patch_operations = [
+            {"op": "set", "path": f"/accounts_by_id/{account['id']}", "value": account}
+            for account in new_accounts
+        ]
+        for i in range(0, len(patch_operations), ACCOUNTS_PATCH_MAX_OPERATIONS):
+            CONTAINER.patch_item(
+                item="accounts",
+                partition_key="accounts",
+                patch_operations=patch_operations[i:i + ACCOUNTS_PATCH_MAX_OPERATIONS],
+            )
+        return func.HttpResponse(
+            "Upserted accounts",
+            status_code=200,
+        )
+    except:
+        return func.HttpResponse(
+            "Failed to upsert accounts",
+            status_code=500,
+        )
     
 @APP.function_name(name="GetScores")
 @APP.route(route="scores", auth_level=func.AuthLevel.ADMIN, methods=["GET"])
@@ -547,6 +685,99 @@ def update_kingdoms(req: func.HttpRequest) -> func.HttpResponse:
         )
 
 
+@APP.function_name(name="GetKingdomsBulk")
+@APP.route(route="kingdoms/bulk", auth_level=func.AuthLevel.ADMIN, methods=["POST"])
+def get_kingdoms_bulk(req: func.HttpRequest) -> func.HttpResponse:
+    logging.info('Python HTTP trigger function processed a get kingdoms bulk request.')    
+    req_body = req.get_json()
+    kd_ids = [str(kd_id) for kd_id in req_body.get("kd_ids", [])]
+    fields = req_body.get("fields", None)
+    if fields != None and not all(field.isidentifier() for field in fields):
+        return func.HttpResponse(
+            "Invalid kingdom fields",
+            status_code=400,
+        )
+    if fields == None:
+        projection = "*"
+    else:
+        projection = ", ".join(
+            ["c.kdId"] + [f'c["{field}"]' for field in fields if field != "kdId"]
+        )
+    try:
+        kds = CONTAINER.query_items(
+            query=f"SELECT {projection} FROM c WHERE ARRAY_CONTAINS(@item_ids, c.id)",
+            parameters=[
+                {"name": "@item_ids", "value": [f"kingdom_{kd_id}" for kd_id in kd_ids]},
+            ],
+            enable_cross_partition_query=True,
+        )
+        return func.HttpResponse(
+            json.dumps({"kingdoms": {kd["kdId"]: kd for kd in kds}}),
+            status_code=200,
+        )
+    except:
+        return func.HttpResponse(
+            "Could not retrieve kingdoms info",
+            status_code=500,
+        )
+
+@APP.function_name(name="UpdateKingdomsBulk")
+@APP.route(route="kingdoms/bulk", auth_level=func.AuthLevel.ADMIN, methods=["PATCH"])
+def update_kingdoms_bulk(req: func.HttpRequest) -> func.HttpResponse:
+    logging.info('Python HTTP trigger function processed an update kingdoms bulk request.')    
+    req_body = req.get_json()
+    updated = []
+    failed = []
+    for kd_id, kd_payload in req_body.get("kingdoms", {}).items():
+        item_id = f"kingdom_{kd_id}"
+        try:
+            kd = CONTAINER.read_item(
+                item=item_id,
+                partition_key=item_id,
+            )
+            CONTAINER.replace_item(
+                item_id,
+                {**kd, **kd_payload},
+            )
+            updated.append(kd_id)
+        except:
+            failed.append(kd_id)
+    return func.HttpResponse(
+        json.dumps({"updated": updated, "failed": failed}),
+        status_code=200 if not failed else 500,
+    )
+
+@APP.function_name(name="PatchKingdomsBulk")
+@APP.route(route="kingdoms/bulk/operations", auth_level=func.AuthLevel.ADMIN, methods=["PATCH"])
+def patch_kingdoms_bulk(req: func.HttpRequest) -> func.HttpResponse:
+    logging.info('Python HTTP trigger function processed a patch kingdoms bulk request.')    
+    req_body = req.get_json()
+    updated = []
+    failed = []
+    # Operations are patched in chunks, so a failed kingdom may have had its first ones applied
+    applied = {}
+    for kd_id, patch_operations in req_body.get("kingdoms", {}).items():
+        item_id = f"kingdom_{kd_id}"
+        applied_operations = 0
+        try:
+            for i in range(0, len(patch_operations), ACCOUNTS_PATCH_MAX_OPERATIONS):
+                chunk = patch_operations[i:i + ACCOUNTS_PATCH_MAX_OPERATIONS]
+                CONTAINER.patch_item(
+                    item=item_id,
+                    partition_key=item_id,
+                    patch_operations=chunk,
+                )
+                applied_operations += len(chunk)
+            updated.append(kd_id)
+        except:
+            failed.append(kd_id)
+            applied[kd_id] = applied_operations
+    return func.HttpResponse(
+        json.dumps({"updated": updated, "failed": failed, "applied": applied}),
+        status_code=200 if not failed else 500,
+    )
+
+
 @APP.function_name(name="GetGalaxies")
 @APP.route(route="galaxies", auth_level=func.AuthLevel.ADMIN, methods=["GET"])
 def get_galaxies(req: func.HttpRequest) -> func.HttpResponse:
@@ -1554,6 +1785,45 @@ def update_engineers(req: func.HttpRequest) -> func.HttpResponse:
             status_code=500,
         )
         
+def _build_revealed_expiry_index(revealed_info):
+    expiry_index = [
+        [time_str, "revealed", revealed_kd_id, revealed_stat]
+        for revealed_kd_id, revealed_dict in revealed_info.get("revealed", {}).items()
+        for revealed_stat, time_str in revealed_dict.items()
+    ] + [
+        [time_str, "galaxies", galaxy_id, ""]
+        for galaxy_id, time_str in revealed_info.get("galaxies", {}).items()
+    ]
+    return sorted(expiry_index)
+
+def _get_revealed_expiry_value(revealed_info, entry):
+    _, table, key, stat = entry
+    if table == "revealed":
+        return revealed_info["revealed"].get(key, {}).get(stat)
+    return revealed_info["galaxies"].get(key)
+
+def _expire_revealed(revealed_info, time_update):
+    """Drop revealed entries expiring at or before time_update using the sorted expiry index"""
+    expiry_index = revealed_info.get("expiry_index")
+    if expiry_index == None:
+        expiry_index = _build_revealed_expiry_index(revealed_info)
+
+    cutoff = bisect.bisect_right(expiry_index, [time_update, "\uffff"])
+    for entry in expiry_index[:cutoff]:
+        if _get_revealed_expiry_value(revealed_info, entry) != entry[0]:
+            continue
+        _, table, key, stat = entry
+        if table == "revealed":
+            revealed_info["revealed"][key].pop(stat)
+            if not revealed_info["revealed"][key]:
+                revealed_info["revealed"].pop(key)
+        else:
+            revealed_info["galaxies"].pop(key)
+    while cutoff < len(expiry_index) and _get_revealed_expiry_value(revealed_info, expiry_index[cutoff]) != expiry_index[cutoff][0]:
+        cutoff += 1
+    revealed_info["expiry_index"] = expiry_index[cutoff:]
+    return revealed_info["expiry_index"][0][0] if revealed_info["expiry_index"] else EXPIRY_SENTINEL
+
 @APP.function_name(name="GetRevealed")
 @APP.route(route="kingdom/{kdId:int}/revealed", auth_level=func.AuthLevel.ADMIN, methods=["GET"])
 def get_revealed(req: func.HttpRequest) -> func.HttpResponse:
@@ -1595,20 +1865,19 @@ def update_revealed(req: func.HttpRequest) -> func.HttpResponse:
         partition_key=item_id,
     )
     try:
+        if "expiry_index" not in revealed_info:
+            revealed_info["expiry_index"] = _build_revealed_expiry_index(revealed_info)
         if new_revealed:
             current_revealed = revealed_info["revealed"]
             for kd_id, revealed_dict in new_revealed.items():
-                kd_revealed = current_revealed.get(kd_id, {})
-                current_revealed[kd_id] = {
-                    **kd_revealed,
-                    **revealed_dict,
-                }
-            revealed_info["revealed"] = current_revealed
+                kd_revealed = current_revealed.setdefault(kd_id, {})
+                for revealed_stat, time_str in revealed_dict.items():
+                    kd_revealed[revealed_stat] = time_str
+                    bisect.insort(revealed_info["expiry_index"], [time_str, "revealed", kd_id, revealed_stat])
         if new_galaxies:
-            revealed_info["galaxies"] = {
-                **revealed_info["galaxies"],
-                **new_galaxies,
-            }
+            for galaxy_id, time_str in new_galaxies.items():
+                revealed_info["galaxies"][galaxy_id] = time_str
+                bisect.insort(revealed_info["expiry_index"], [time_str, "galaxies", galaxy_id, ""])
         if new_revealed_galaxymates:
             revealed_info["revealed_galaxymates"] += new_revealed_galaxymates
         if new_revealed_to_galaxymates:
@@ -1621,6 +1890,8 @@ def update_revealed(req: func.HttpRequest) -> func.HttpResponse:
             revealed_info["revealed_galaxymates"] = revealed_galaxymates
         if revealed_to_galaxymates != None:
             revealed_info["revealed_to_galaxymates"] = revealed_to_galaxymates
+        if revealed != None or galaxies != None:
+            revealed_info["expiry_index"] = _build_revealed_expiry_index(revealed_info)
         CONTAINER.replace_item(
             item_id,
             revealed_info,
@@ -1635,6 +1906,62 @@ def update_revealed(req: func.HttpRequest) -> func.HttpResponse:
             status_code=500,
         )
         
+@APP.function_name(name="ExpireRevealed")
+@APP.route(route="kingdom/{kdId:int}/revealed/expire", auth_level=func.AuthLevel.ADMIN, methods=["POST"])
+def expire_revealed(req: func.HttpRequest) -> func.HttpResponse:
+    logging.info('Python HTTP trigger function processed an expire revealed request.')    
+    req_body = req.get_json()
+    time_update = req_body["time"]
+    kd_id = str(req.route_params.get('kdId'))
+    item_id = f"revealed_{kd_id}"
+    revealed_info = CONTAINER.read_item(
+        item=item_id,
+        partition_key=item_id,
+    )
+    try:
+        next_resolve = _expire_revealed(revealed_info, time_update)
+        CONTAINER.replace_item(
+            item_id,
+            revealed_info,
+        )
+        return func.HttpResponse(
+            json.dumps({"next_resolve": next_resolve}),
+            status_code=200,
+        )
+    except:
+        return func.HttpResponse(
+            "The kingdom revealed were not expired",
+            status_code=500,
+        )
+
+def _build_shared_expiry_index(shared_info):
+    return sorted(
+        [shared_dict["time"], table, shared_kd_id]
+        for table in ("shared", "shared_requests", "shared_offers")
+        for shared_kd_id, shared_dict in shared_info.get(table, {}).items()
+    )
+
+def _get_shared_expiry_value(shared_info, entry):
+    _, table, key = entry
+    return shared_info[table].get(key, {}).get("time")
+
+def _expire_shared(shared_info, time_update):
+    """Drop shared entries expiring at or before time_update using the sorted expiry index"""
+    expiry_index = shared_info.get("expiry_index")
+    if expiry_index == None:
+        expiry_index = _build_shared_expiry_index(shared_info)
+
+    cutoff = bisect.bisect_right(expiry_index, [time_update, "\uffff"])
+    for entry in expiry_index[:cutoff]:
+        if _get_shared_expiry_value(shared_info, entry) != entry[0]:
+            continue
+        _, table, key = entry
+        shared_info[table].pop(key)
+    while cutoff < len(expiry_index) and _get_shared_expiry_value(shared_info, expiry_index[cutoff]) != expiry_index[cutoff][0]:
+        cutoff += 1
+    shared_info["expiry_index"] = expiry_index[cutoff:]
+    return shared_info["expiry_index"][0][0] if shared_info["expiry_index"] else EXPIRY_SENTINEL
+
 @APP.function_name(name="GetShared")
 @APP.route(route="kingdom/{kdId:int}/shared", auth_level=func.AuthLevel.ADMIN, methods=["GET"])
 def get_shared(req: func.HttpRequest) -> func.HttpResponse:
@@ -1672,6 +1999,7 @@ def set_shared(req: func.HttpRequest) -> func.HttpResponse:
         **shared,
         **req_body,
     }
+    new_shared["expiry_index"] = _build_shared_expiry_index(new_shared)
     try:
         CONTAINER.replace_item(
             item_id,
@@ -1687,6 +2015,34 @@ def set_shared(req: func.HttpRequest) -> func.HttpResponse:
             status_code=500,
         )
 
+@APP.function_name(name="ExpireShared")
+@APP.route(route="kingdom/{kdId:int}/shared/expire", auth_level=func.AuthLevel.ADMIN, methods=["POST"])
+def expire_shared(req: func.HttpRequest) -> func.HttpResponse:
+    logging.info('Python HTTP trigger function processed an expire shared request.')    
+    req_body = req.get_json()
+    time_update = req_body["time"]
+    kd_id = str(req.route_params.get('kdId'))
+    item_id = f"shared_{kd_id}"
+    shared_info = CONTAINER.read_item(
+        item=item_id,
+        partition_key=item_id,
+    )
+    try:
+        next_resolve = _expire_shared(shared_info, time_update)
+        CONTAINER.replace_item(
+            item_id,
+            shared_info,
+        )
+        return func.HttpResponse(
+            json.dumps({"next_resolve": next_resolve}),
+            status_code=200,
+        )
+    except:
+        return func.HttpResponse(
+            "The kingdom shared were not expired",
+            status_code=500,
+        )
+
 @APP.function_name(name="UpdateShared")
 @APP.route(route="kingdom/{kdId:int}/shared", auth_level=func.AuthLevel.ADMIN, methods=["PATCH"])
 def update_shared(req: func.HttpRequest) -> func.HttpResponse:
@@ -1992,4 +2348,145 @@ def update_history(req: func.HttpRequest) -> func.HttpResponse:
         return func.HttpResponse(
             "The kingdom history were not updated",
             status_code=500,
-        )
\ No newline at end of file
+        )
+
+def _read_lease(item_id):
+    try:
+        return CONTAINER.read_item(
+            item=item_id,
+            partition_key=item_id,
+        )
+    except CosmosResourceNotFoundError:
+        return None
+
+def _acquire_lease(item_id, holder, token, time_now, expires):
+    """
+    Take a free or expired lease, or renew it when holder and token match the current acquisition
+
+    Each acquisition has its own token, so another thread of the same holder process
+    waits behind the lease like any other contender instead of taking it over.
+    """
+    lease = _read_lease(item_id)
+    if lease is None:
+        try:
+            CONTAINER.create_item(
+                {
+                    "id": item_id,
+                    "type": "lease",
+                    "holder": holder,
+                    "token": token,
+                    "expires": expires,
+                    "pending": False,
+                    "pending_since": "",
+                }
+            )
+            return {"acquired": True}
+        except CosmosResourceExistsError:
+            return {"acquired": False, "queued": False}
+
+    renew = lease["holder"] == holder and lease.get("token") == token
+    if renew or lease["holder"] is None or lease["expires"] < time_now:
+        new_lease = {
+            **lease,
+            "holder": holder,
+            "token": token,
+            "expires": expires,
+            # A renewal keeps the triggers queued behind it
+            "pending": lease["pending"] if renew else False,
+            "pending_since": lease["pending_since"] if renew else "",
+        }
+        try:
+            CONTAINER.replace_item(
+                item_id,
+                new_lease,
+                etag=lease["_etag"],
+                match_condition=MatchConditions.IfNotModified,
+            )
+            return {"acquired": True}
+        except CosmosAccessConditionFailedError:
+            return {"acquired": False, "queued": False}
+
+    if not lease["pending"]:
+        try:
+            CONTAINER.replace_item(
+                item_id,
+                {**lease, "pending": True, "pending_since": time_now},
+                etag=lease["_etag"],
+                match_condition=MatchConditions.IfNotModified,
+            )
+        except CosmosAccessConditionFailedError:
+            return {"acquired": False, "queued": False, "holder": lease["holder"]}
+    return {"acquired": False, "queued": True, "holder": lease["holder"]}
+
+def _release_lease(item_id, holder, token, stats, retries=3):
+    for _ in range(retries):
+        lease = _read_lease(item_id)
+        if lease is None or lease["holder"] != holder or lease.get("token") != token:
+            return {"released": False, "pending": False}
+        new_lease = {
+            **lease,
+            **stats,
+            "holder": None,
+            "token": None,
+            "expires": "",
+            "pending": False,
+            "pending_since": "",
+        }
+        try:
+            CONTAINER.replace_item(
+                item_id,
+                new_lease,
+                etag=lease["_etag"],
+                match_condition=MatchConditions.IfNotModified,
+            )
+            return {"released": True, "pending": lease["pending"], "pending_since": lease["pending_since"]}
+        except CosmosAccessConditionFailedError:
+            continue
+    return {"released": False, "pending": False}
+
+@APP.function_name(name="AcquireLease")
+@APP.route(route="lease/{name}/acquire", auth_level=func.AuthLevel.ADMIN, methods=["POST"])
+def acquire_lease(req: func.HttpRequest) -> func.HttpResponse:
+    logging.info('Python HTTP trigger function processed an acquire lease request.')    
+    req_body = req.get_json()
+    item_id = f"lease_{req.route_params.get('name')}"
+    try:
+        lease_status = _acquire_lease(
+            item_id,
+            req_body["holder"],
+            req_body["token"],
+            req_body["time"],
+            req_body["expires"],
+        )
+        return func.HttpResponse(
+            json.dumps(lease_status),
+            status_code=200,
+        )
+    except:
+        return func.HttpResponse(
+            "The lease could not be acquired",
+            status_code=500,
+        )
+
+@APP.function_name(name="ReleaseLease")
+@APP.route(route="lease/{name}/release", auth_level=func.AuthLevel.ADMIN, methods=["POST"])
+def release_lease(req: func.HttpRequest) -> func.HttpResponse:
+    logging.info('Python HTTP trigger function processed a release lease request.')    
+    req_body = req.get_json()
+    item_id = f"lease_{req.route_params.get('name')}"
+    try:
+        lease_status = _release_lease(
+            item_id,
+            req_body["holder"],
+            req_body["token"],
+            req_body.get("stats", {}),
+        )
+        return func.HttpResponse(
+            json.dumps(lease_status),
+            status_code=200,
+        )
+    except:
+        return func.HttpResponse(
+            "The lease could not be released",
+            status_code=500,
+        )
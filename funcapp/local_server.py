@@ -0,0 +1,166 @@
+"""
+Offline stand-in for the deployed function app, run with `python local_server.py`
+
+Serves every route registered in function_app.py under /api, calling the same
+handlers over a local_store container instead of Cosmos, so the Flask app can
+run with AZURE_FUNCTION_ENDPOINT=http://localhost:7071/api and no Azure access.
+"""
+import argparse
+import os
+import re
+import socketserver
+import urllib.parse
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+ROUTE_PARAMETER = re.compile(r"\{(?P<name>\w+)(?::(?P<constraint>\w+))?\}")
+ROUTE_CONSTRAINTS = {
+    None: r"[^/]+",
+    "int": r"-?\d+",
+}
+STATUS_REASONS = {
+    200: "OK",
+    201: "Created",
+    400: "Bad Request",
+    401: "Unauthorized",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    409: "Conflict",
+    500: "Internal Server Error",
+}
+
+
+def _compile_route(route):
+    pattern = ""
+    position = 0
+    for match in ROUTE_PARAMETER.finditer(route):
+        pattern += re.escape(route[position:match.start()])
+        pattern += f"(?P<{match.group('name')}>{ROUTE_CONSTRAINTS[match.group('constraint')]})"
+        position = match.end()
+    pattern += re.escape(route[position:])
+    return re.compile(f"^{pattern}$")
+
+
+class FunctionRouter:
+    """Dispatches WSGI requests to the HTTP functions of an azure.functions FunctionApp"""
+
+    def __init__(self, function_app, host_key=None, route_prefix="api"):
+        import azure.functions as func
+
+        self.func = func
+        self.host_key = host_key
+        self.route_prefix = f"/{route_prefix}/"
+        self.routes = []
+        for function in function_app.get_functions():
+            trigger = function.get_trigger()
+            methods = {getattr(method, "value", method).upper() for method in trigger.methods}
+            self.routes.append((_compile_route(trigger.route), methods, function.get_user_function()))
+        # Literal routes win over parameterized ones, as in the Functions host
+        self.routes.sort(key=lambda route: route[0].groups)
+
+    def _match(self, method, path):
+        path_matched = False
+        for pattern, methods, handler in self.routes:
+            match = pattern.match(path)
+            if match is None:
+                continue
+            path_matched = True
+            if method in methods:
+                return handler, match.groupdict(), 200
+        return None, None, 405 if path_matched else 404
+
+    def __call__(self, environ, start_response):
+        method = environ["REQUEST_METHOD"].upper()
+        path = environ.get("PATH_INFO", "")
+        if self.host_key and environ.get("HTTP_X_FUNCTIONS_KEY") != self.host_key:
+            return self._respond(start_response, 401, b"")
+        if not path.startswith(self.route_prefix):
+            return self._respond(start_response, 404, b"")
+
+        handler, route_params, status_code = self._match(method, path[len(self.route_prefix):])
+        if handler is None:
+            return self._respond(start_response, status_code, b"")
+
+        content_length = int(environ.get("CONTENT_LENGTH") or 0)
+        body = environ["wsgi.input"].read(content_length) if content_length else b""
+        headers = {
+            key[len("HTTP_"):].replace("_", "-").lower(): value
+            for key, value in environ.items()
+            if key.startswith("HTTP_")
+        }
+        query_string = environ.get("QUERY_STRING", "")
+        request = self.func.HttpRequest(
+            method,
+            f"http://{environ.get('HTTP_HOST', 'localhost')}{path}" + (f"?{query_string}" if query_string else ""),
+            headers=headers,
+            params=dict(urllib.parse.parse_qsl(query_string)),
+            route_params=route_params,
+            body=body,
+        )
+        try:
+            response = handler(request)
+        except Exception:
+            return self._respond(start_response, 500, b"Unhandled function error")
+        return self._respond(
+            start_response,
+            response.status_code,
+            response.get_body(),
+            response.mimetype or "text/plain",
+        )
+
+    def _respond(self, start_response, status_code, body, mimetype="text/plain"):
+        start_response(
+            f"{status_code} {STATUS_REASONS.get(status_code, '')}",
+            [("Content-Type", mimetype), ("Content-Length", str(len(body)))],
+        )
+        return [body]
+
+
+class ThreadingWSGIServer(socketserver.ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def make_standin_server(host, port, store, host_key=None, quiet=True):
+    os.environ["FUNCAPP_STORE"] = store
+    import function_app
+
+    return make_server(
+        host,
+        port,
+        FunctionRouter(function_app.APP, host_key=host_key),
+        server_class=ThreadingWSGIServer,
+        handler_class=QuietRequestHandler if quiet else WSGIRequestHandler,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve function_app.py locally without Cosmos")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=7071)
+    parser.add_argument(
+        "--store",
+        default=os.environ.get("FUNCAPP_STORE", "memory"),
+        help='"memory" or "sqlite:<path>" (FUNCAPP_STORE)',
+    )
+    parser.add_argument(
+        "--key",
+        default=os.environ.get("AZURE_FUNCTIONS_HOST_KEY"),
+        help="Required x-functions-key header value, if any (AZURE_FUNCTIONS_HOST_KEY)",
+    )
+    parser.add_argument("--verbose", action="store_true", help="Log every request")
+    args = parser.parse_args()
+
+    server = make_standin_server(args.host, args.port, args.store, args.key, quiet=not args.verbose)
+    print(f"Serving function app stand-in on http://{args.host}:{args.port}/api with store {args.store}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
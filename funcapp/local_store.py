@@ -0,0 +1,250 @@
+"""
+Local stand-ins for the Cosmos container used by function_app.py
+
+Implements the container methods the function app calls (create, read, replace
+with etag conditions, delete, patch, read all and the kingdoms query) with the
+same error types, over a dict in memory or a SQLite file. Items are stored as
+JSON so every read returns a fresh copy, as it would from Cosmos.
+"""
+import json
+import re
+import sqlite3
+import threading
+import time
+import uuid
+
+from azure.core import MatchConditions
+from azure.cosmos.exceptions import CosmosAccessConditionFailedError, CosmosHttpResponseError, CosmosResourceExistsError, CosmosResourceNotFoundError
+
+QUERY_ARRAY_CONTAINS = re.compile(r"^SELECT (?P<projection>.+) FROM c WHERE ARRAY_CONTAINS\((?P<parameter>@\w+), c\.id\)$")
+PROJECTION_FIELD = re.compile(r'^c(?:\.(?P<attribute>\w+)|\["(?P<key>[^"]+)"\])$')
+
+
+class LocalContainer:
+    def __init__(self):
+        self._lock = threading.RLock()
+
+    def _load(self, item_id):
+        raise NotImplementedError
+
+    def _store(self, item_id, body):
+        raise NotImplementedError
+
+    def _remove(self, item_id):
+        raise NotImplementedError
+
+    def _item_ids(self):
+        raise NotImplementedError
+
+    def _read(self, item_id):
+        body = self._load(item_id)
+        if body is None:
+            raise CosmosResourceNotFoundError(status_code=404, message=f"Item {item_id} does not exist")
+        return json.loads(body)
+
+    def _write(self, item):
+        item = {
+            **item,
+            "_etag": f'"{uuid.uuid4()}"',
+            "_ts": int(time.time()),
+        }
+        self._store(item["id"], json.dumps(item))
+        return item
+
+    def create_item(self, body, **kwargs):
+        with self._lock:
+            if self._load(body["id"]) is not None:
+                raise CosmosResourceExistsError(status_code=409, message=f"Item {body['id']} already exists")
+            return self._write(body)
+
+    def read_item(self, item, partition_key=None, **kwargs):
+        with self._lock:
+            return self._read(item)
+
+    def upsert_item(self, body, **kwargs):
+        with self._lock:
+            return self._write(body)
+
+    def replace_item(self, item, body, etag=None, match_condition=None, **kwargs):
+        with self._lock:
+            current = self._read(item)
+            if match_condition == MatchConditions.IfNotModified and current["_etag"] != etag:
+                raise CosmosAccessConditionFailedError(status_code=412, message=f"Item {item} was modified")
+            return self._write({**body, "id": item})
+
+    def delete_item(self, item, partition_key=None, **kwargs):
+        with self._lock:
+            self._read(item)
+            self._remove(item)
+
+    def patch_item(self, item, partition_key=None, patch_operations=(), **kwargs):
+        with self._lock:
+            current = self._read(item)
+            for operation in patch_operations:
+                _apply_patch_operation(current, operation)
+            return self._write(current)
+
+    def read_all_items(self, max_item_count=None, **kwargs):
+        with self._lock:
+            return LocalItemPaged(self, self._item_ids(), max_item_count)
+
+    def query_items(self, query, parameters=(), **kwargs):
+        match = QUERY_ARRAY_CONTAINS.match(query.strip())
+        if match is None:
+            raise NotImplementedError(f"Unsupported query: {query}")
+        values = {parameter["name"]: parameter["value"] for parameter in parameters}
+        projection = match.group("projection").strip()
+        fields = None if projection == "*" else _parse_projection(projection)
+        items = []
+        with self._lock:
+            for item_id in values[match.group("parameter")]:
+                body = self._load(item_id)
+                if body is None:
+                    continue
+                item = json.loads(body)
+                if fields is not None:
+                    item = {field: item[field] for field in fields if field in item}
+                items.append(item)
+        return items
+
+
+class LocalItemPaged:
+    """
+    Items of read_all_items, loaded lazily, with the by_page() of Cosmos' ItemPaged
+
+    Continuation tokens are positions in the item ids listed by the read, so items
+    created or deleted while paging may be skipped or seen twice, as with Cosmos.
+    """
+
+    def __init__(self, container, item_ids, max_item_count=None):
+        self.container = container
+        self.item_ids = item_ids
+        self.page_size = max_item_count or max(len(item_ids), 1)
+
+    def _load_items(self, item_ids):
+        items = []
+        with self.container._lock:
+            for item_id in item_ids:
+                body = self.container._load(item_id)
+                if body is not None:
+                    items.append(json.loads(body))
+        return items
+
+    def __iter__(self):
+        for start in range(0, len(self.item_ids), self.page_size):
+            yield from self._load_items(self.item_ids[start:start + self.page_size])
+
+    def by_page(self, continuation_token=None):
+        return LocalPageIterator(self, int(continuation_token or 0))
+
+
+class LocalPageIterator:
+    """Pages of a LocalItemPaged; continuation_token resumes after the last page returned"""
+
+    def __init__(self, paged, start):
+        self.paged = paged
+        self.start = start
+        self.continuation_token = None
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        item_ids = self.paged.item_ids
+        if self.start >= len(item_ids):
+            raise StopIteration
+        page = self.paged._load_items(item_ids[self.start:self.start + self.paged.page_size])
+        self.start += self.paged.page_size
+        self.continuation_token = str(self.start) if self.start < len(item_ids) else None
+        return iter(page)
+
+
+class MemoryContainer(LocalContainer):
+    def __init__(self):
+        super().__init__()
+        self.items = {}
+
+    def _load(self, item_id):
+        return self.items.get(item_id)
+
+    def _store(self, item_id, body):
+        self.items[item_id] = body
+
+    def _remove(self, item_id):
+        del self.items[item_id]
+
+    def _item_ids(self):
+        return list(self.items)
+
+
+class SqliteContainer(LocalContainer):
+    def __init__(self, path):
+        super().__init__()
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS items (id TEXT PRIMARY KEY, body TEXT NOT NULL)")
+
+    def _load(self, item_id):
+        row = self.connection.execute("SELECT body FROM items WHERE id = ?", (item_id,)).fetchone()
+        return None if row is None else row[0]
+
+    def _store(self, item_id, body):
+        self.connection.execute("INSERT OR REPLACE INTO items (id, body) VALUES (?, ?)", (item_id, body))
+
+    def _remove(self, item_id):
+        self.connection.execute("DELETE FROM items WHERE id = ?", (item_id,))
+
+    def _item_ids(self):
+        return [item_id for item_id, in self.connection.execute("SELECT id FROM items ORDER BY id")]
+
+
+def make_container(store):
+    """Container for FUNCAPP_STORE=memory or FUNCAPP_STORE=sqlite:<path>"""
+    if store == "memory":
+        return MemoryContainer()
+    if store.startswith("sqlite:"):
+        return SqliteContainer(store[len("sqlite:"):])
+    raise ValueError(f"Unknown local store {store}")
+
+
+def _parse_projection(projection):
+    fields = []
+    for field in projection.split(","):
+        match = PROJECTION_FIELD.match(field.strip())
+        if match is None:
+            raise NotImplementedError(f"Unsupported projection: {field}")
+        fields.append(match.group("attribute") or match.group("key"))
+    return fields
+
+
+def _apply_patch_operation(item, operation):
+    keys = [key.replace("~1", "/").replace("~0", "~") for key in operation["path"].lstrip("/").split("/")]
+    parent = item
+    for key in keys[:-1]:
+        parent = parent[int(key)] if isinstance(parent, list) else parent[key]
+    key = keys[-1]
+    op = operation["op"]
+    if isinstance(parent, list):
+        if op == "add":
+            parent.insert(len(parent) if key == "-" else int(key), operation["value"])
+        elif op in ("set", "replace"):
+            parent[int(key)] = operation["value"]
+        elif op == "remove":
+            del parent[int(key)]
+        elif op == "incr":
+            parent[int(key)] += operation["value"]
+        else:
+            raise ValueError(f"Unknown patch operation {op}")
+        return
+    if op in ("add", "set"):
+        parent[key] = operation["value"]
+    elif op == "replace":
+        if key not in parent:
+            raise CosmosHttpResponseError(status_code=400, message=f"Path {operation['path']} does not exist")
+        parent[key] = operation["value"]
+    elif op == "remove":
+        del parent[key]
+    elif op == "incr":
+        parent[key] = parent.get(key, 0) + operation["value"]
+    else:
+        raise ValueError(f"Unknown patch operation {op}")
@@ -12,6 +12,7 @@ import {
 } from "react-router-dom";
 import useWebSocket, { ReadyState } from 'react-use-websocket';
 import {login, authFetch, useAuth, logout, getSession, getSessionState} from "./auth";
+import {fetchState} from "./config";
 import Button from 'react-bootstrap/Button';
 import Toast from 'react-bootstrap/Toast';
 import ToastContainer from 'react-bootstrap/ToastContainer'
@@ -228,9 +229,10 @@ function Content(props) {
 
     const fetchData = async () => {
       for (const key of loadKeys) {
-        await authFetch(endpoints[key], {keepalive: true}).then(
-          r => r.json()
-        ).then(r => (newValues[key] = r)).catch(
+        const fetchKey = key === 'state'
+          ? fetchState(authFetch)
+          : authFetch(endpoints[key], {keepalive: true}).then(r => r.json());
+        await fetchKey.then(r => (newValues[key] = r)).catch(
           err => {
             console.log('Failed to fetch ' + key);
             console.log(err);
@@ -260,33 +262,43 @@ function Content(props) {
     "auto_spending": ["kingdom", "settle", "structures", "mobis", "engineers"],
   }
   const refreshData = async () => {
-    // console.log('Updating Data');
-    // console.log(data);
-    // console.log(lastResolves);
+    // Only polled while the websocket, which pushes the kingdom and notifs, is down
     if (initLoadComplete) {
       await updateData(["kingdom", "notifs"]);
-      if (Object.keys(lastResolves).length > 0) {
-        const newResolves = Object.keys(lastResolves).filter(key => lastResolves[key] != data.kingdom.next_resolve[key]);
-        // console.log(newResolves);
-        var keysToUpdate = [];
-        for (const resolve of newResolves) {
-          keysToUpdate.push(...resolveKeysMap[resolve])
-        }
-        // console.log(keysToUpdate);
-        updateData(keysToUpdate);
-        setLastResolves(data.kingdom["next_resolve"]);
-      }
     }
   }
 
+  useEffect(() => {
+    const nextResolve = data.kingdom.next_resolve;
+    if (!initLoadComplete || !nextResolve || Object.keys(lastResolves || {}).length == 0) {
+      return;
+    }
+    const newResolves = Object.keys(lastResolves).filter(key => lastResolves[key] != nextResolve[key]);
+    if (newResolves.length > 0) {
+      var keysToUpdate = [];
+      for (const resolve of newResolves) {
+        keysToUpdate.push(...(resolveKeysMap[resolve] || []))
+      }
+      updateData(keysToUpdate);
+      setLastResolves(nextResolve);
+    }
+  }, [data.kingdom.next_resolve]);
+
 
   useEffect(() => {
     if (lastMessage !== null) {
       const jsonMessage = JSON.parse(lastMessage.data);
-      if ((jsonMessage.update || []).length > 0) {
-        updateData(jsonMessage.update);
+      const patch = jsonMessage.patch || {};
+      if (Object.keys(patch).length > 0) {
+        setData((prev) => ({...prev, ...patch}));
+      }
+      const keysToUpdate = (jsonMessage.update || []).filter((key) => !patch.hasOwnProperty(key));
+      if (keysToUpdate.length > 0) {
+        updateData(keysToUpdate);
+      }
+      if (jsonMessage.message) {
+        setMessageHistory((prev) => [lastMessage, ...prev.slice(0, 9)]);
       }
-      setMessageHistory((prev) => [lastMessage, ...prev.slice(0, 9)]);
     }
   }, [lastMessage, setMessageHistory]);
 
@@ -314,7 +326,7 @@ function Content(props) {
   }, [props.logged])
 
   useInterval(() => {
-    if (initLoadComplete) {
+    if (initLoadComplete && readyState !== ReadyState.OPEN) {
       if (data.kingdomid.created !== false) {
         refreshData()
       }
@@ -0,0 +1,18 @@
+// The static game config only changes on deploy or with the game speed, so it is
+// fetched once per config_hash and merged into the small dynamic /api/state payload.
+const configCache = {
+    hash: null,
+    config: {},
+};
+
+async function fetchState(fetchFunc) {
+    const state = await fetchFunc('api/state', {keepalive: true}).then(r => r.json());
+    if (state.config_hash !== configCache.hash) {
+        const config = await fetchFunc('api/config?v=' + state.config_hash, {keepalive: true}).then(r => r.json());
+        configCache.hash = state.config_hash;
+        configCache.config = config;
+    }
+    return {...configCache.config, ...state};
+}
+
+export {fetchState}
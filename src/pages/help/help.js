@@ -33,6 +33,7 @@ import UniversePolitics from "./politics/universepolitics.js";
 import CreateKingdom from "./other/createkingdom.js";
 import ViewKingdom from "./other/viewkingdom.js";
 import "./help.css";
+import {fetchState} from "../../config";
 
 function Help(props) {
     let location = useLocation();
@@ -41,9 +42,7 @@ function Help(props) {
 
     useEffect(() => {
         const fetchData = () => {
-            fetch('api/state', {keepalive: true}).then(
-                r => r.json()
-            ).then(r => setState(r)).catch(
+            fetchState(fetch).then(r => setState(r)).catch(
                 err => {
                     console.log('Failed to fetch state');
                     console.log(err);
@@ -3,6 +3,7 @@ import {useNavigate} from "react-router-dom";
 import {login, authFetch, useAuth, logout, getSession, getSessionState} from "../auth";
 import Button from 'react-bootstrap/Button';
 import "./landing.css";
+import {fetchState} from "../config";
 
 function Landing(props) {
     const navigate = useNavigate();
@@ -10,9 +11,7 @@ function Landing(props) {
 
     useEffect(() => {
         const fetchData = () => {
-            fetch('api/state', {keepalive: true}).then(
-                r => r.json()
-            ).then(r => setState(r)).catch(
+            fetchState(fetch).then(r => setState(r)).catch(
                 err => {
                     console.log('Failed to fetch state');
                     console.log(err);